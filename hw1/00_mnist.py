@@ -5,6 +5,15 @@ from __future__ import division
 from __future__ import print_function
 
 # Imports
+import argparse
+import json
+import multiprocessing
+import platform
+import shutil
+import sys
+import tempfile
+import time
+
 import numpy as np
 import tensorflow as tf
 
@@ -76,15 +85,156 @@ def cnn_model_fn(features, labels, mode):
             labels=labels, predictions=predictions["classes"])} 
     return tf.estimator.EstimatorSpec(
         mode=mode, loss=loss, eval_metric_ops=eval_metric_ops)
-		
-def main(unused_argv):
-    # Load training and eval data
+
+
+class StepTimer(tf.train.SessionRunHook):
+    """
+    Wall time of the session runs after the first `warmup_steps`.
+    Args:
+        warmup_steps (int): Runs excluded from the measurement (graph
+            optimization, allocator growth, input queue filling).
+    """
+
+    def __init__(self, warmup_steps=0):
+        self.warmup_steps = warmup_steps
+        self.steps = 0
+        self.timed_steps = 0
+        self.seconds = 0.
+
+    def before_run(self, run_context):
+        self._start = time.time()
+
+    def after_run(self, run_context, run_values):
+        self.steps += 1
+        if self.steps > self.warmup_steps:
+            self.timed_steps += 1
+            self.seconds += time.time() - self._start
+
+
+def load_mnist():
     mnist = tf.contrib.learn.datasets.load_dataset("mnist")
     train_data = mnist.train.images  # Returns np.array
     train_labels = np.asarray(mnist.train.labels, dtype=np.int32)
     eval_data = mnist.test.images  # Returns np.array
     eval_labels = np.asarray(mnist.test.labels, dtype=np.int32)
-    
+    return train_data, train_labels, eval_data, eval_labels
+
+
+def run_config(args):
+    """RunConfig with the seed and thread counts of the benchmark."""
+    session_config = tf.ConfigProto(
+        intra_op_parallelism_threads=args.intra_op_threads,
+        inter_op_parallelism_threads=args.inter_op_threads)
+    return tf.estimator.RunConfig(
+        tf_random_seed=args.seed, session_config=session_config,
+        # no checkpoints while timing, but CheckpointSaverHook still writes
+        # the final one that evaluate restores
+        save_summary_steps=0, save_checkpoints_steps=None,
+        save_checkpoints_secs=10 ** 9)
+
+
+def benchmark(args, batch_size, data):
+    """
+    Train and evaluate a fresh model with one batch size.
+    Returns:
+        result (dict): Examples/sec of training and evaluation, final loss
+            and accuracy.
+    """
+    train_data, train_labels, eval_data, eval_labels = data
+    np.random.seed(args.seed)
+    model_dir = tempfile.mkdtemp(prefix='mnist_bench_')
+    try:
+        mnist_classifier = tf.estimator.Estimator(
+            model_fn=cnn_model_fn, model_dir=model_dir,
+            config=run_config(args))
+        # one input thread keeps the shuffled order reproducible
+        train_input_fn = tf.estimator.inputs.numpy_input_fn(
+            x={"x": train_data},
+            y=train_labels,
+            batch_size=batch_size,
+            num_epochs=None,
+            shuffle=True,
+            num_threads=1)
+        eval_input_fn = tf.estimator.inputs.numpy_input_fn(
+            x={"x": eval_data},
+            y=eval_labels,
+            batch_size=args.eval_batch_size,
+            num_epochs=1,
+            shuffle=False)
+
+        train_timer = StepTimer(args.warmup_steps)
+        mnist_classifier.train(
+            input_fn=train_input_fn,
+            steps=args.warmup_steps + args.train_steps,
+            hooks=[train_timer])
+        eval_timer = StepTimer(1)
+        eval_results = mnist_classifier.evaluate(
+            input_fn=eval_input_fn, hooks=[eval_timer])
+    finally:
+        shutil.rmtree(model_dir, ignore_errors=True)
+
+    # every eval batch but the first is timed; the last may be partial
+    eval_examples = len(eval_data) - args.eval_batch_size
+    return {
+        'batch_size': batch_size,
+        'train_steps': train_timer.timed_steps,
+        'train_examples_per_sec':
+            train_timer.timed_steps * batch_size / train_timer.seconds,
+        'train_ms_per_step': 1e3 * train_timer.seconds / max(
+            train_timer.timed_steps, 1),
+        'eval_examples_per_sec':
+            eval_examples / eval_timer.seconds if eval_timer.seconds else None,
+        'loss': float(eval_results['loss']),
+        'accuracy': float(eval_results['accuracy']),
+    }
+
+
+def environment():
+    """Host and library versions stored with the results."""
+    return {
+        'tensorflow': tf.__version__,
+        'tensorflow_git': getattr(tf, '__git_version__', None),
+        'numpy': np.__version__,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'host': platform.node(),
+        'processor': platform.processor(),
+        'cpu_count': multiprocessing.cpu_count(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    }
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='MNIST CNN baseline and CPU throughput benchmark.')
+    parser.add_argument(
+        '--train_curve', action='store_true',
+        help='Run the original 30000-step train/evaluate loop instead of '
+             'the benchmark')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument(
+        '--batch_sizes', type=int, nargs='+', default=[100],
+        help='Training batch sizes, one fresh model each')
+    parser.add_argument('--eval_batch_size', type=int, default=1000)
+    parser.add_argument(
+        '--warmup_steps', type=int, default=50,
+        help='Training steps run before timing starts')
+    parser.add_argument(
+        '--train_steps', type=int, default=500, help='Timed training steps')
+    parser.add_argument(
+        '--intra_op_threads', type=int, default=0,
+        help='Threads inside one op (0: TensorFlow default)')
+    parser.add_argument(
+        '--inter_op_threads', type=int, default=0,
+        help='Ops run in parallel (0: TensorFlow default)')
+    parser.add_argument(
+        '--output', type=str, default='mnist_benchmark.json',
+        help='JSON file of the environment, configuration and results')
+    return parser.parse_args()
+
+
+def train_curve():
+    train_data, train_labels, eval_data, eval_labels = load_mnist()
     # Create the Estimator
     mnist_classifier = tf.estimator.Estimator(
         model_fn=cnn_model_fn, model_dir="mnist_convnet_model")
@@ -119,5 +269,32 @@ def main(unused_argv):
         print("evaluate")
         eval_results = mnist_classifier.evaluate(input_fn=eval_input_fn)
 
+
+def main():
+    args = parse_args()
+    if args.train_curve:
+        train_curve()
+        return
+    tf.logging.set_verbosity(tf.logging.WARN)
+    data = load_mnist()
+    results = []
+    for batch_size in args.batch_sizes:
+        result = benchmark(args, batch_size, data)
+        print('batch {}: train {:.1f} ex/s ({:.2f} ms/step), eval {:.1f} '
+              'ex/s, accuracy {:.4f}'.format(
+                  batch_size, result['train_examples_per_sec'],
+                  result['train_ms_per_step'],
+                  result['eval_examples_per_sec'] or float('nan'),
+                  result['accuracy']))
+        results.append(result)
+
+    config = dict((k, v) for k, v in vars(args).items() if k != 'output')
+    with open(args.output, 'w') as f:
+        json.dump({'environment': environment(), 'config': config,
+                   'argv': sys.argv[1:], 'results': results},
+                  f, indent=2, sort_keys=True)
+    print('wrote {}'.format(args.output))
+
+
 if __name__ == "__main__":
-    tf.app.run()
+    main()
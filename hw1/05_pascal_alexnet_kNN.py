@@ -17,9 +17,13 @@ import matplotlib.pyplot as plt
 from tensorflow.python.tools import inspect_checkpoint as chkp
 from tensorflow.python import pywrap_tensorflow
 import os 
-from sklearn.neighbors import NearestNeighbors
 
 from eval import compute_map
+import feature_cache
+import knn
+import pascal_data
+import pascal_input
+import model
 tf.logging.set_verbosity(tf.logging.INFO)
 
 CLASS_NAMES = [
@@ -55,286 +59,35 @@ display = 100
 # test_num = 10
 
 
-def cnn_model_fn(features, labels, mode, num_classes=20):
-    # Build model
-    if mode == tf.estimator.ModeKeys.TRAIN:
-        input_layer = tf.reshape(features["x"], [-1, IMAGE_SIZE, IMAGE_SIZE, 3])
-    else:
-        input_layer = tf.reshape(features["x"], [-1, IMAGE_CROP_SIZE, IMAGE_CROP_SIZE, 3])
-
-    def data_augmentation(inputs):
-        for i in xrange(BATCH_SIZE):
-            output = tf.image.random_flip_left_right(inputs[i])
-            output = tf.image.random_contrast(output, 0.9, 1.1)
-            output += tf.random_normal([IMAGE_SIZE, IMAGE_SIZE, 3], 0, 0.1)
-            output = tf.random_crop(output, [IMAGE_CROP_SIZE, IMAGE_CROP_SIZE, 3])
-            output = tf.expand_dims(output, 0)
-            if i == 0:
-                outputs = output
-            else:
-                outputs = tf.concat([outputs, output], 0)
-        return outputs
-
-    # def center_crop(inputs, size):
-    #     print(size)
-    #     ratio = IMAGE_CROP_SIZE / float(IMAGE_SIZE)
-    #     for i in xrange(size):
-    #         output = tf.image.central_crop(inputs[i], ratio)
-    #         output = tf.expand_dims(output, 0)
-    #         if i == 0:
-    #             outputs = output
-    #         else:
-    #             outputs = tf.concat([outputs, output], 0)
-    #     return outputs
-
-    #data augmentation
-    if mode == tf.estimator.ModeKeys.TRAIN:
-        input_layer = data_augmentation(input_layer)
-    # else:
-    #     input_layer = center_crop(input_layer, test_num)
-    print(input_layer.shape)
-
-    # Convolutional Layer #1
-    conv1 = tf.layers.conv2d(
-        inputs=input_layer,
-        filters=96,
-        kernel_size=[11, 11],
-        strides=[4, 4],
-        padding="valid",
-        activation=tf.nn.relu,
-        kernel_initializer=tf.random_normal_initializer(0, 0.01),
-        bias_initializer=tf.zeros_initializer())
-    # Pooling Layer #1
-    pool1 = tf.layers.max_pooling2d(inputs=conv1, pool_size=[3, 3], strides=2)
-
-    # Convolutional Layer #2 and Pooling Layer #2
-    conv2 = tf.layers.conv2d(
-        inputs=pool1,
-        filters=256,
-        kernel_size=[5, 5],
-        padding="same",
-        activation=tf.nn.relu,
-        kernel_initializer=tf.random_normal_initializer(0, 0.01),
-        bias_initializer=tf.zeros_initializer())
-    pool2 = tf.layers.max_pooling2d(inputs=conv2, pool_size=[3, 3], strides=2)
-
-    # Convolutional Layer #3
-    conv3 = tf.layers.conv2d(
-        inputs=pool2,
-        filters=384,
-        kernel_size=[3, 3],
-        padding="same",
-        activation=tf.nn.relu,
-        kernel_initializer=tf.random_normal_initializer(0, 0.01),
-        bias_initializer=tf.zeros_initializer())
-
-    # Convolutional Layer #4
-    conv4 = tf.layers.conv2d(
-        inputs=conv3,
-        filters=384,
-        kernel_size=[3, 3],
-        padding="same",
-        kernel_initializer=tf.random_normal_initializer(0, 0.01),
-        bias_initializer=tf.zeros_initializer())
-
-    # Convolutional Layer #5 and Max pooling #3
-    conv5 = tf.layers.conv2d(
-        inputs=conv4,
-        filters=256,
-        kernel_size=[3, 3],
-        padding="same",
-        kernel_initializer=tf.random_normal_initializer(0, 0.01),
-        bias_initializer=tf.zeros_initializer())
-    pool3 = tf.layers.max_pooling2d(inputs=conv5, pool_size=[3, 3], strides=2)
-
-    # print(pool3.shape)
-    # Dense Layer #1 and drop out #1
-    pool3_flat = tf.reshape(pool3, [-1, 256 * 5 * 5])
-    dense1 = tf.layers.dense(inputs=pool3_flat, units=4096,
-                            activation=tf.nn.relu,
-                            kernel_initializer=tf.random_normal_initializer(0, 0.005),
-                            bias_initializer=tf.zeros_initializer())
-    dropout1 = tf.layers.dropout(
-        inputs=dense1, rate=0.5, training=mode == tf.estimator.ModeKeys.TRAIN)
-
-    dense2 = tf.layers.dense(inputs=dropout1, units=4096,
-                            activation=tf.nn.relu,
-                            kernel_initializer=tf.random_normal_initializer(0, 0.005),
-                            bias_initializer=tf.zeros_initializer())
-    dropout2 = tf.layers.dropout(
-        inputs=dense2, rate=0.5, training=mode == tf.estimator.ModeKeys.TRAIN)
-
-    # Logits Layer
-    logits = tf.layers.dense(inputs=dropout2, units=20,
-                            kernel_initializer=tf.random_normal_initializer(0, 0.01),
-                            bias_initializer=tf.zeros_initializer())
-
-    predictions = {
-        # Generate predictions (for PREDICT and EVAL mode)
-        "classes": tf.argmax(input=logits, axis=1),
-        # Add `softmax_tensor` to the graph. It is used for PREDICT and by the
-        # `logging_hook`.
-        "probabilities": tf.nn.sigmoid(logits, name="sigmoid_tensor"),
-        "pool5": pool3,
-        "fc7": dense2
-    }
-
-    if mode == tf.estimator.ModeKeys.PREDICT:
-        return tf.estimator.EstimatorSpec(mode=mode, predictions=predictions)
-
-    # Calculate Loss (for both TRAIN and EVAL modes)
-    loss = tf.identity(tf.losses.sigmoid_cross_entropy(
-        multi_class_labels=labels, logits=logits), name='loss')
-
-    # Configure the Training Op (for TRAIN mode)
-    if mode == tf.estimator.ModeKeys.TRAIN:
-        lr = tf.train.exponential_decay(0.001, tf.train.get_global_step(), 10000, 0.5)
-        optimizer = tf.train.MomentumOptimizer(learning_rate=lr, momentum=0.9)
-        train_op = optimizer.minimize(
-            loss=loss,
-            global_step=tf.train.get_global_step())
-        return tf.estimator.EstimatorSpec(
-            mode=mode, loss=loss, train_op=train_op)
-
-    # Add evaluation metrics (for EVAL mode)
-    eval_metric_ops = {
-        "accuracy": tf.metrics.accuracy(
-            labels=labels, predictions=predictions["classes"])} 
-    return tf.estimator.EstimatorSpec(
-        mode=mode, loss=loss, eval_metric_ops=eval_metric_ops)
-
-
-def load_pascal(data_dir, split='train'):
-    """
-    Function to read images from PASCAL data folder.
-    Args:
-        data_dir (str): Path to the VOC2007 directory.
-        split (str): train/val/trainval split to use.
-    Returns:
-        images (np.ndarray): Return a np.float32 array of
-            shape (N, H, W, 3), where H, W are 224px each,
-            and each image is in RGB format.
-        labels (np.ndarray): An array of shape (N, 20) of
-            type np.int32, with 0s and 1s; 1s for classes that
-            are active in that image.
-    """
-    # Wrote this function
-    img_dir = data_dir + 'JPEGImages/'
-    label_dir = data_dir + 'ImageSets/Main/'
-
-    # read images
-    label_path = label_dir + split + '.txt'
-    file = open(label_path, 'r')
-    lines = file.readlines()
-    file.close()
-    img_num = len(lines)
-    first_flag = True
-    margin = (IMAGE_SIZE - IMAGE_CROP_SIZE) // 2
-
-    mean_value = [123, 116, 103]
-    mean_r = np.tile(np.array(mean_value[0]), (IMAGE_SIZE, IMAGE_SIZE))
-    mean_g = np.tile(np.array(mean_value[1]), (IMAGE_SIZE, IMAGE_SIZE))
-    mean_b = np.tile(np.array(mean_value[2]), (IMAGE_SIZE, IMAGE_SIZE))
-    mean = np.stack((mean_r, mean_g, mean_b), axis=2)
-#     print(mean.shape)
-
-    if split != 'test':
-        img_list = np.zeros((len(lines), IMAGE_SIZE, IMAGE_SIZE, 3))
-    else:
-        img_list = np.zeros((len(lines), IMAGE_CROP_SIZE, IMAGE_CROP_SIZE, 3))
-
-    count = 0
-    for line in lines:
-        line = line[:6]
-        img_name = img_dir + line + '.jpg'
-        img = sci.imread(img_name)
-        img = sci.imresize(img, (IMAGE_SIZE, IMAGE_SIZE, 3))
-        img = np.subtract(img, mean)
+MODEL_PARAMS = dict(
+    arch='alexnet',
+    image_size=IMAGE_SIZE,
+    crop_size=IMAGE_CROP_SIZE,
+    mean=pascal_data.MEAN_VALUE,
+    scale=True,
+    augment=dict(contrast=(0.9, 1.1), noise_stddev=0.1),
+    endpoints=('pool5', 'fc7'))
 
-        if split == 'test':
-            img = img[margin:IMAGE_CROP_SIZE+margin, margin:IMAGE_CROP_SIZE+margin, :]
-        img_list[count, :, :, :] = img
-        count += 1
-        if count % 1000 == 1:
-            print(count)
-
-    print("finish loading images")
-    img_list = img_list.astype(np.float32)
-    img_list /= 255.0
-    img_list -= 0.5
-    img_list *= 2       
-
-    # read labels
-    label_list = np.zeros((img_num, 20))
-    weight_list = np.zeros((img_num, 20))
-    cls_pos = 0
-    for class_name in CLASS_NAMES:
-        img_pos = 0
-        label_path = label_dir + class_name + '_' + split + '.txt'
-        # load images
-        file = open(label_path, 'r')
-        lines = file.readlines()
-        file.close()
-        for line in lines:
-            label = line.split()[1]
-            label = int(label)
-            if label == 1:
-                label_list[img_pos, cls_pos] = 1
-                weight_list[img_pos, cls_pos] = 1
-            # elif label == 0:
-            #     label_list[img_pos, cls_pos] = 1
-            else:
-                weight_list[img_pos, cls_pos] = 1
-            img_pos += 1
-        cls_pos += 1
-    print("finish loading label")
-
-    img_list = img_list.astype(np.float32)
-    label_list = label_list.astype(np.int32)
-    weight_list = weight_list.astype(np.int32)
-    return img_list, label_list, weight_list
-    
 
-def load_test_image(test_data_dir):
-    mean_value = [123, 116, 103]
-    mean_r = np.tile(np.array(mean_value[0]), (IMAGE_SIZE, IMAGE_SIZE))
-    mean_g = np.tile(np.array(mean_value[1]), (IMAGE_SIZE, IMAGE_SIZE))
-    mean_b = np.tile(np.array(mean_value[2]), (IMAGE_SIZE, IMAGE_SIZE))
-    mean = np.stack((mean_r, mean_g, mean_b), axis=2)
-    
-    img_path_list = [f for f in listdir(test_data_dir) if isfile(join(test_data_dir, f))]
-    img_list = np.zeros((len(img_path_list), IMAGE_CROP_SIZE, IMAGE_CROP_SIZE, 3))
-    count = 0
-    margin = (IMAGE_SIZE - IMAGE_CROP_SIZE) // 2
-    for img_name in img_path_list:
-        img_name = test_data_dir + img_name
-        img = sci.imread(img_name)
-        img = sci.imresize(img, (IMAGE_SIZE, IMAGE_SIZE, 3))
-        img = np.subtract(img, mean)
-        img = img[margin:IMAGE_CROP_SIZE+margin, margin:IMAGE_CROP_SIZE+margin, :]
-        img_list[count, :, :, :] = img
-        count += 1
-
-    print("finish loading test images")
-    print(img_list.shape)
-    img_list = img_list.astype(np.float32)
-    img_list /= 255.0
-    img_list -= 0.5
-    img_list *= 2
-    return img_list
+def cnn_model_fn(features, labels, mode, num_classes=20):
+    return model.model_fn(features, labels, mode, num_classes=num_classes,
+                          **MODEL_PARAMS)
 
 
 def parse_args():
     parser = argparse.ArgumentParser(
-        description='Train a classifier in tensorflow!')
+        description='Nearest test-set neighbours of the testKNN images.')
     parser.add_argument(
-        'data_dir', type=str, default='data/VOC2007',
+        'data_dir', type=str, nargs='?', default='data/VOC2007',
         help='Path to PASCAL data storage')
-    if len(sys.argv) == 1:
-        parser.print_help()
-        sys.exit(1)
-    args = parser.parse_args()
-    return args
+    parser.add_argument(
+        '--num_workers', type=int, default=None,
+        help='Number of JPEG decoder processes (default: one per CPU)')
+    parser.add_argument(
+        '--cache_dir', type=str, default='data/cache',
+        help='Directory of the image packs and the feature store of the '
+             'test split (see feature_cache.py)')
+    return parser.parse_args()
 
 
 def _get_el(arr, i):
@@ -344,32 +97,24 @@ def _get_el(arr, i):
         return arr
 
 
-def findNearestNeighbours(pred_eval, pred_test):
-    # Feature extraction
-    pool5_eval = np.stack(p['pool5'] for p in pred_eval)
-    pool5_eval = np.reshape(pool5_eval, (-1, 5*5*256))
-#     print(pool5_eval.shape)
-    fc7_eval = np.stack(p['fc7'] for p in pred_eval)
-    fc7_eval = np.reshape(fc7_eval, (-1, 4096))
-#     print(fc7_eval.shape)
+def findNearestNeighbours(eval_features, pred_test):
+    # Feature extraction: the test split comes memory-mapped from the
+    # feature store, only the few kNN query images are stacked here
+    pool5_eval = eval_features['pool5']
+    fc7_eval = eval_features['fc7']
 
     pool5_test = np.stack(p['pool5'] for p in pred_test)
     pool5_test = np.reshape(pool5_test, (-1, 5*5*256))
-#     print(pool5_test.shape)
     fc7_test = np.stack(p['fc7'] for p in pred_test)
     fc7_test = np.reshape(fc7_test, (-1, 4096))
-#     print(fc7_test.shape)
 
-    # find kNN
-    nb_pool5 = NearestNeighbors(n_neighbors=5, algorithm='ball_tree', n_jobs=-1)
-    nb_pool5.fit(pool5_eval)
-    dist_pool5, indices_pool5 = nb_pool5.kneighbors(pool5_test)
+    # find kNN: exact brute force with chunked matmuls (a ball tree
+    # degrades to brute force at this dimensionality anyway)
+    _, indices_pool5 = knn.ExactIndex().fit(pool5_eval).search(pool5_test, 5)
     print("pool5, kNN")
     print(indices_pool5)
-    
-    nb_fc7 = NearestNeighbors(n_neighbors=5, algorithm='ball_tree', n_jobs=-1)
-    nb_fc7.fit(fc7_eval)
-    dist_fc7, indices_fc7 = nb_fc7.kneighbors(fc7_test)
+
+    _, indices_fc7 = knn.ExactIndex().fit(fc7_eval).search(fc7_test, 5)
     print("fc5, kNN")
     print(indices_fc7)
 
@@ -408,50 +153,41 @@ def showNearestNeighbouts(data_dir, eval_data_dir, test_data_dir, indices, mode)
 
 
 def main():
-#     args = parse_args()
-    data_dir = 'data/VOC2007/'
+    args = parse_args()
+    data_dir = osp.join(args.data_dir, '')
     test_data_dir =data_dir + 'testKNN/'
 
-    # Load whole test data
-    eval_data, eval_labels, eval_weights = load_pascal(
-        data_dir, split='test')
-    
-    # Load knn test data
-    test_data = load_test_image(test_data_dir)
+    # knn test images, in the listing order of showNearestNeighbouts;
+    # decoded in parallel and normalized by cnn_model_fn like the store
+    test_paths = [join(test_data_dir, f) for f in listdir(test_data_dir)
+                  if isfile(join(test_data_dir, f))]
+    test_input_fn = pascal_input.files_input_fn(
+        test_paths, image_size=IMAGE_SIZE, crop_size=IMAGE_CROP_SIZE,
+        batch_size=BATCH_SIZE)
 
     # Define Estimator
     pascal_classifier = tf.estimator.Estimator(
-        model_fn=partial(cnn_model_fn, num_classes=eval_labels.shape[1]),
+        model_fn=partial(cnn_model_fn, num_classes=len(CLASS_NAMES)),
         model_dir=MODEL_PATH)
 
-    # Build data
-    eval_input_fn = tf.estimator.inputs.numpy_input_fn(
-        x={"x": eval_data, "w": eval_weights},
-        y=eval_labels,
-        num_epochs=1,
-        shuffle=False)
-    
-    test_weights = np.zeros((test_data.shape[0], eval_labels.shape[1]))
-    test_labels = np.zeros((test_data.shape[0], eval_labels.shape[1]))
-    test_input_fn = tf.estimator.inputs.numpy_input_fn(
-        x={"x": test_data, "w": test_weights},
-        y=test_labels,
-        num_epochs=1,
-        shuffle=False)
-
-    # Extract features
-    pred_eval = list(pascal_classifier.predict(input_fn=eval_input_fn))
-    pred_prob_eval = np.stack([p['probabilities'] for p in pred_eval])
-    AP = compute_map(eval_labels, pred_prob_eval, eval_weights, average=None)
+    # Extract features of the whole test data, or reuse the stored ones
+    # of the current checkpoint
+    eval_features, eval_labels, eval_weights = \
+        feature_cache.predict_features(
+            pascal_classifier, data_dir, args.cache_dir, 'test',
+            MODEL_PARAMS,
+            ('probabilities', 'pool5', 'fc7'), num_workers=args.num_workers)
+    AP = compute_map(eval_labels, eval_features['probabilities'],
+                     eval_weights, average=None)
     print('All test data')
     print('Obtained {} mAP'.format(np.mean(AP)))
     print('per class:')
     for cid, cname in enumerate(CLASS_NAMES):
         print('{}: {}'.format(cname, _get_el(AP, cid)))
-    
+
     pred_test = list(pascal_classifier.predict(input_fn=test_input_fn))
     
-    indices_pool5, indices_fc7 = findNearestNeighbours(pred_eval, pred_test)
+    indices_pool5, indices_fc7 = findNearestNeighbours(eval_features, pred_test)
     showNearestNeighbouts(data_dir, data_dir + 'JPEGImages/', test_data_dir, indices_pool5, 'pool5')
     showNearestNeighbouts(data_dir, data_dir + 'JPEGImages/', test_data_dir, indices_fc7, 'fc7')
 
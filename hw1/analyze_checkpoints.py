@@ -0,0 +1,228 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+# One pass over the training history of a model directory. Every checkpoint
+# still on disk is probed by a pool of worker processes; each worker builds
+# the network once and only restores variables per checkpoint, instead of
+# an Estimator (and a new graph) per checkpoint. Probes:
+#   map      test mAP and per-class AP
+#   filters  conv1 filter mosaic (see mosaic.py)
+#   drift    cosine similarity and 5-NN overlap of --drift_layer features of
+#            the first --drift_images test images with the last checkpoint
+#   norms    L2 norm of every kernel and bias
+# All results land in one .npz with one array per column, ordered by step.
+import argparse
+import multiprocessing
+import os
+import os.path as osp
+import time
+
+import numpy as np
+import tensorflow as tf
+
+from eval import compute_map
+import knn
+import model
+import mosaic
+import pascal_data
+
+PROBES = ('map', 'filters', 'drift', 'norms')
+GRAPH_PROBES = ('map', 'drift')
+FILTER_VARIABLE = 'conv2d/kernel'
+
+# per-process state, set up once by _init_worker
+_worker = {}
+
+
+def _weight_names(reader):
+    """Kernels and biases of a checkpoint, without optimizer slots."""
+    return sorted(name for name in reader.get_variable_to_shape_map()
+                  if name.endswith(('/kernel', '/bias')))
+
+
+def _init_worker(args, model_params, num_threads):
+    """Build the probe graph of this process and open the test pack."""
+    _worker.clear()
+    _worker['args'] = args
+    if not any(p in GRAPH_PROBES for p in args.probes):
+        return
+    images, labels, weights = pascal_data.open_pack(
+        args.data_dir, args.cache_dir, split='test',
+        image_size=model_params.get('image_size', 256),
+        crop_size=model_params.get('crop_size', 224))
+    if args.num_images is not None:
+        images = images[:args.num_images]
+        labels, weights = labels[:len(images)], weights[:len(images)]
+    _worker.update(images=images, labels=labels, weights=weights)
+
+    graph = tf.Graph()
+    with graph.as_default():
+        x = tf.placeholder(tf.uint8, [None] + list(images.shape[1:]))
+        # the PREDICT graph of the training script, as the Estimator
+        # builds it for predict()
+        spec = model.model_fn(
+            {"x": x}, None, tf.estimator.ModeKeys.PREDICT,
+            **dict(model_params, tta=False, endpoints=(args.drift_layer,)))
+        features = spec.predictions[args.drift_layer]
+        _worker['fetches'] = {
+            'probabilities': spec.predictions['probabilities'],
+            'features': tf.reshape(
+                features, [-1, features.shape[1:].num_elements()])}
+        _worker['x'] = x
+        _worker['saver'] = tf.train.Saver()
+    _worker['sess'] = tf.Session(graph=graph, config=tf.ConfigProto(
+        intra_op_parallelism_threads=num_threads,
+        inter_op_parallelism_threads=1))
+
+
+def _run_graph(checkpoint, num_images):
+    """Probabilities and flattened features of the first num_images."""
+    sess, x = _worker['sess'], _worker['x']
+    _worker['saver'].restore(sess, checkpoint)
+    images = _worker['images'][:num_images]
+    batch_size = _worker['args'].batch_size
+    out = {'probabilities': [], 'features': []}
+    for start in range(0, len(images), batch_size):
+        batch = sess.run(_worker['fetches'],
+                         {x: images[start:start + batch_size]})
+        for key in out:
+            out[key].append(batch[key])
+    return dict((key, np.concatenate(v)) for key, v in out.items())
+
+
+def reference_features(checkpoint, path):
+    """Write the drift features of the reference checkpoint to path."""
+    args = _worker['args']
+    features = _run_graph(checkpoint, args.drift_images)['features']
+    np.save(path, features)
+    return path
+
+
+def probe_checkpoint(job):
+    """
+    Run the enabled probes on one checkpoint.
+    Args:
+        job (tuple): (step, checkpoint prefix, reference features path or
+            None).
+    Returns:
+        row (dict): Column name to value for this checkpoint.
+    """
+    step, checkpoint, reference_path = job
+    args = _worker['args']
+    start = time.time()
+    row = {'step': step}
+    reader = tf.train.NewCheckpointReader(checkpoint)
+    if 'norms' in args.probes:
+        for name in _weight_names(reader):
+            row['norm/' + name] = np.linalg.norm(reader.get_tensor(name))
+    if 'filters' in args.probes:
+        row['conv1_kernel'] = reader.get_tensor(FILTER_VARIABLE)
+
+    if any(p in GRAPH_PROBES for p in args.probes):
+        num_images = len(_worker['images'])
+        if 'map' not in args.probes:
+            num_images = args.drift_images
+        out = _run_graph(checkpoint, num_images)
+        if 'map' in args.probes:
+            ap = compute_map(_worker['labels'], out['probabilities'],
+                             _worker['weights'], average=None)
+            row['ap'] = np.asarray(ap, dtype=np.float32)
+            row['map'] = np.mean(ap)
+        if 'drift' in args.probes:
+            if 'reference' not in _worker:
+                ref = np.load(reference_path)
+                _worker['reference'] = ref
+                _worker['reference_knn'] = knn.ExactIndex().fit(ref).search(
+                    ref, 6)[1][:, 1:]
+            ref = _worker['reference']
+            feat = out['features'][:args.drift_images]
+            cos = np.einsum('ij,ij->i', feat, ref) / np.maximum(
+                np.linalg.norm(feat, axis=1) * np.linalg.norm(ref, axis=1),
+                1e-12)
+            row['drift_cosine'] = cos.mean()
+            found = knn.ExactIndex().fit(feat).search(feat, 6)[1][:, 1:]
+            row['drift_knn_overlap'] = knn.recall_at_k(
+                found, _worker['reference_knn'])
+    row['probe_seconds'] = time.time() - start
+    return row
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Probe every checkpoint of a training run in one pass.')
+    parser.add_argument('model_dir', type=str, help='Estimator model_dir')
+    parser.add_argument(
+        'data_dir', type=str, help='Path to PASCAL data storage')
+    parser.add_argument(
+        '--cache_dir', type=str, default='data/cache',
+        help='Directory of memory-mapped image packs (see pascal_data.py)')
+    parser.add_argument(
+        '--script', type=str, required=True,
+        help='Training script of the run, e.g. 03_pascal_vgg16; its '
+             'MODEL_PARAMS define the network and the input size')
+    parser.add_argument(
+        '--probes', type=str, nargs='+', default=list(PROBES),
+        choices=PROBES)
+    parser.add_argument(
+        '--num_workers', type=int, default=2,
+        help='Worker processes, each probing one checkpoint at a time')
+    parser.add_argument(
+        '--num_images', type=int, default=None,
+        help='Test images used by the mAP probe (default: all)')
+    parser.add_argument('--drift_layer', type=str, default='fc7')
+    parser.add_argument('--drift_images', type=int, default=500)
+    parser.add_argument('--batch_size', type=int, default=64)
+    parser.add_argument(
+        '--output', type=str, default=None,
+        help='Results file (default: <model_dir>/checkpoint_probes.npz)')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    checkpoints, steps = mosaic.checkpoint_history(args.model_dir)
+    if not checkpoints:
+        raise ValueError('no checkpoints in {}'.format(args.model_dir))
+    model_params = model.script_model_params(args.script)
+    output = args.output or osp.join(args.model_dir, 'checkpoint_probes.npz')
+    print('probing {} checkpoints ({} to {}) with {}'.format(
+        len(checkpoints), steps[0], steps[-1], ', '.join(args.probes)))
+
+    num_workers = max(1, min(args.num_workers, len(checkpoints)))
+    num_threads = max(1, multiprocessing.cpu_count() // num_workers)
+    pool = multiprocessing.Pool(num_workers, _init_worker,
+                                (args, model_params, num_threads))
+    start = time.time()
+    try:
+        reference_path = None
+        if 'drift' in args.probes:
+            reference_path = pool.apply(
+                reference_features,
+                (checkpoints[-1], output + '.drift_reference.npy'))
+        rows = []
+        for row in pool.imap_unordered(
+                probe_checkpoint,
+                [(s, c, reference_path) for s, c in zip(steps, checkpoints)]):
+            print('step {}: {}'.format(row['step'], ', '.join(
+                '{} {:.4f}'.format(k, float(row[k])) for k in
+                ('map', 'drift_cosine', 'drift_knn_overlap') if k in row)))
+            rows.append(row)
+    finally:
+        pool.close()
+        pool.join()
+    if reference_path is not None:
+        os.remove(reference_path)
+
+    rows.sort(key=lambda r: r['step'])
+    columns = dict((key, np.stack([r[key] for r in rows])) for key in rows[0])
+    if 'filters' in args.probes:
+        columns['filters'] = mosaic.filter_mosaics(
+            columns.pop('conv1_kernel'))
+    np.savez(output, **columns)
+    print('probed {} checkpoints in {:.1f}s, wrote {} columns to {}'.format(
+        len(rows), time.time() - start, len(columns), output))
+
+
+if __name__ == "__main__":
+    main()
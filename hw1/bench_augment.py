@@ -0,0 +1,90 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+# Compare the batched augmentation in pascal_input with the per-image loop
+# the hw1 model functions used to build.
+import argparse
+import time
+
+import numpy as np
+import tensorflow as tf
+
+import pascal_input
+
+IMAGE_SIZE = 256
+IMAGE_CROP_SIZE = 224
+
+
+def loop_augmentation(inputs, batch_size, jitter):
+    """The original per-image data_augmentation from 02_pascal_alexnet.py."""
+    for i in range(batch_size):
+        output = tf.image.random_flip_left_right(inputs[i])
+        if jitter:
+            output = tf.image.random_contrast(output, 0.9, 1.1)
+            output += tf.random_normal([IMAGE_SIZE, IMAGE_SIZE, 3], 0, 0.1)
+        output = tf.random_crop(output, [IMAGE_CROP_SIZE, IMAGE_CROP_SIZE, 3])
+        output = tf.expand_dims(output, 0)
+        if i == 0:
+            outputs = output
+        else:
+            outputs = tf.concat([outputs, output], 0)
+    return outputs
+
+
+def batched_augmentation(inputs, batch_size, jitter):
+    if jitter:
+        return pascal_input.augment_batch(
+            inputs, IMAGE_CROP_SIZE, contrast=(0.9, 1.1), noise_stddev=0.1)
+    return pascal_input.augment_batch(inputs, IMAGE_CROP_SIZE)
+
+
+def time_augmentation(build_fn, batch_size, jitter, iters, warmup=5):
+    """Return (graph op count, seconds per batch) for one implementation."""
+    graph = tf.Graph()
+    with graph.as_default():
+        images = tf.placeholder(
+            tf.float32, [None, IMAGE_SIZE, IMAGE_SIZE, 3])
+        out = build_fn(images, batch_size, jitter)
+        num_ops = len(graph.get_operations())
+        data = np.random.uniform(
+            0, 255, (batch_size, IMAGE_SIZE, IMAGE_SIZE, 3)).astype(np.float32)
+        with tf.Session(graph=graph) as sess:
+            for _ in range(warmup):
+                sess.run(out, feed_dict={images: data})
+            start = time.time()
+            for _ in range(iters):
+                sess.run(out, feed_dict={images: data})
+            elapsed = (time.time() - start) / iters
+    return num_ops, elapsed
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Benchmark batched vs per-image augmentation.')
+    parser.add_argument(
+        '--batch_sizes', type=int, nargs='+', default=[10, 20, 64])
+    parser.add_argument('--iters', type=int, default=50)
+    parser.add_argument(
+        '--no_jitter', action='store_true',
+        help='Only flip and crop (the VGG scripts setting)')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    jitter = not args.no_jitter
+    print('{:>6} {:>10} {:>10} {:>12} {:>12} {:>8}'.format(
+        'batch', 'loop ops', 'batch ops', 'loop ms', 'batch ms', 'speedup'))
+    for batch_size in args.batch_sizes:
+        loop_ops, loop_t = time_augmentation(
+            loop_augmentation, batch_size, jitter, args.iters)
+        batch_ops, batch_t = time_augmentation(
+            batched_augmentation, batch_size, jitter, args.iters)
+        print('{:>6} {:>10} {:>10} {:>12.2f} {:>12.2f} {:>7.2f}x'.format(
+            batch_size, loop_ops, batch_ops, loop_t * 1e3, batch_t * 1e3,
+            loop_t / batch_t))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+# Compare training steps/sec of the hw1 networks with NHWC (channels_last)
+# and NCHW (channels_first) convolutions. On CPU, NCHW is the native layout
+# of MKL-DNN builds; stock CPU builds have no NCHW conv/pool kernels, so
+# there NCHW is reported as unsupported instead of timed.
+import argparse
+import time
+
+import numpy as np
+import tensorflow as tf
+
+import model
+
+DATA_FORMATS = ('channels_last', 'channels_first')
+
+
+def time_training(arch, data_format, batch_size, iters, warmup=5,
+                  crop_size=224, num_classes=20):
+    """Return train steps/sec of model.model_fn on random data."""
+    graph = tf.Graph()
+    with graph.as_default():
+        tf.train.create_global_step()
+        images = tf.placeholder(tf.float32, [None, crop_size, crop_size, 3])
+        labels = tf.placeholder(tf.float32, [None, num_classes])
+        spec = model.model_fn(
+            {"x": images}, labels, tf.estimator.ModeKeys.TRAIN, arch=arch,
+            num_classes=num_classes, image_size=crop_size,
+            crop_size=crop_size, data_format=data_format)
+        rng = np.random.RandomState(0)
+        feed = {
+            images: rng.randn(
+                batch_size, crop_size, crop_size, 3).astype(np.float32),
+            labels: (rng.rand(batch_size, num_classes) < 0.1).astype(
+                np.float32)}
+        with tf.Session(graph=graph) as sess:
+            sess.run(tf.global_variables_initializer())
+            for _ in range(warmup):
+                sess.run(spec.train_op, feed_dict=feed)
+            start = time.time()
+            for _ in range(iters):
+                sess.run(spec.train_op, feed_dict=feed)
+            elapsed = time.time() - start
+    return iters / elapsed
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Benchmark NHWC vs NCHW training steps/sec.')
+    parser.add_argument(
+        '--archs', type=str, nargs='+', default=['alexnet', 'vgg'],
+        choices=sorted(model.NETWORKS))
+    parser.add_argument('--batch_sizes', type=int, nargs='+', default=[10, 32])
+    parser.add_argument('--iters', type=int, default=20)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    formats = DATA_FORMATS
+    if not model.channels_first_supported():
+        print('no MKL-DNN or GPU: channels_first is not timed')
+        formats = DATA_FORMATS[:1]
+    print('{:>8} {:>6} {:>12} {:>12} {:>8}'.format(
+        'arch', 'batch', 'NHWC steps/s', 'NCHW steps/s', 'speedup'))
+    for arch in args.archs:
+        for batch_size in args.batch_sizes:
+            rates = []
+            for data_format in DATA_FORMATS:
+                if data_format not in formats:
+                    rates.append(None)
+                    continue
+                try:
+                    rates.append(time_training(
+                        arch, data_format, batch_size, args.iters))
+                except (tf.errors.InvalidArgumentError,
+                        tf.errors.UnimplementedError) as e:
+                    tf.logging.warn('%s/%s: %s', arch, data_format, e.message)
+                    rates.append(None)
+            nhwc, nchw = rates
+            print('{:>8} {:>6} {:>12} {:>12} {:>8}'.format(
+                arch, batch_size,
+                '{:.2f}'.format(nhwc) if nhwc else 'n/a',
+                '{:.2f}'.format(nchw) if nchw else 'n/a',
+                '{:.2f}x'.format(nchw / nhwc) if nhwc and nchw else '-'))
+
+
+if __name__ == "__main__":
+    main()
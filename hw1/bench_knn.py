@@ -0,0 +1,81 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+# Recall@k vs query latency of the knn indices. The database is a features.npy
+# written by feature_cache.py (e.g. the VOC test pool5 or fc7 features);
+# the first --num_queries rows are held out as queries.
+import argparse
+import time
+
+import numpy as np
+
+import knn
+
+
+def make_indices(dim):
+    """The configurations compared, by name."""
+    indices = [('exact', knn.ExactIndex())]
+    for size in (128, 512):
+        if size < dim:
+            indices.append(('pca{}+rerank'.format(size), knn.ReducedIndex(
+                knn.PCA(size), rerank=100)))
+            indices.append(('rp{}+rerank'.format(size), knn.ReducedIndex(
+                knn.RandomProjection(size), rerank=100)))
+    for num_probe in (1, 4, 16):
+        indices.append(('ivf64/probe{}'.format(num_probe),
+                        knn.IVFIndex(num_lists=64, num_probe=num_probe)))
+    for num_subspaces in (16, 64):
+        if dim % num_subspaces == 0:
+            indices.append(('pq{}'.format(num_subspaces),
+                            knn.PQIndex(num_subspaces)))
+            indices.append(('pq{}+rerank'.format(num_subspaces),
+                            knn.PQIndex(num_subspaces, rerank=100)))
+    return indices
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Benchmark exact and approximate kNN retrieval.')
+    parser.add_argument(
+        '--features', type=str, default=None,
+        help='features.npy of a feature_cache directory '
+             '(default: random clustered data)')
+    parser.add_argument('--num_queries', type=int, default=500)
+    parser.add_argument('--k', type=int, default=5)
+    parser.add_argument(
+        '--synthetic', type=int, nargs=2, default=[5000, 4096],
+        metavar=('N', 'D'), help='Size of the random data')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    if args.features is not None:
+        data = np.load(args.features, mmap_mode='r')
+    else:
+        rng = np.random.RandomState(0)
+        n, dim = args.synthetic
+        centers = rng.randn(50, dim) * 3
+        data = centers[rng.randint(50, size=n)] + rng.randn(n, dim)
+    data = np.asarray(data, dtype=np.float32)
+    queries, database = data[:args.num_queries], data[args.num_queries:]
+
+    truth = None
+    print('{:>18} {:>10} {:>12} {:>10}'.format(
+        'index', 'build s', 'ms/query', 'recall@{}'.format(args.k)))
+    for name, index in make_indices(data.shape[1]):
+        start = time.time()
+        index.fit(database)
+        build = time.time() - start
+        start = time.time()
+        _, found = index.search(queries, args.k)
+        per_query = (time.time() - start) / len(queries)
+        if truth is None:
+            truth = found
+        print('{:>18} {:>10.2f} {:>12.3f} {:>10.3f}'.format(
+            name, build, per_query * 1e3, knn.recall_at_k(found, truth)))
+
+
+if __name__ == "__main__":
+    main()
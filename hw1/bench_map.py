@@ -0,0 +1,93 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+# Compare eval.compute_map with the per-class sklearn loop it replaced, and
+# report how far the binned StreamingMAP is from the exact AP.
+import argparse
+import time
+
+import numpy as np
+import sklearn.metrics
+
+from eval import StreamingMAP, compute_map
+
+
+def sklearn_map(gt, pred, valid):
+    """The original per-class compute_map from eval.py."""
+    all_ap = []
+    for cid in range(gt.shape[1]):
+        gt_cls = gt[:, cid][valid[:, cid] > 0].astype('float32')
+        pred_cls = pred[:, cid][valid[:, cid] > 0].astype('float32')
+        pred_cls -= 1e-5 * gt_cls
+        all_ap.append(sklearn.metrics.average_precision_score(
+            gt_cls, pred_cls, average=None))
+    return np.array(all_ap)
+
+
+def make_data(n, num_classes=20, seed=0):
+    """VOC-like labels (about 8% positives, 3% ignored) and noisy scores."""
+    rng = np.random.RandomState(seed)
+    gt = (rng.rand(n, num_classes) < 0.08).astype(np.int32)
+    valid = (rng.rand(n, num_classes) > 0.03).astype(np.int32)
+    pred = np.clip(0.3 * gt + rng.rand(n, num_classes), 0, 1)
+    # quantize some scores so the tie handling is exercised too
+    pred[:n // 10] = np.round(pred[:n // 10], 2)
+    return gt, pred.astype(np.float32), valid
+
+
+def best_time(fn, repeats):
+    times = []
+    for _ in range(repeats):
+        start = time.time()
+        fn()
+        times.append(time.time() - start)
+    return min(times)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Benchmark the vectorized mAP engine against sklearn.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[5000, 100000])
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument(
+        '--bins', type=int, nargs='+', default=[1000, 10000],
+        help='StreamingMAP histogram sizes to compare with the exact AP')
+    parser.add_argument('--batch_size', type=int, default=1000)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    print('{:>8} {:>12} {:>12} {:>8} {:>12}'.format(
+        'N', 'sklearn ms', 'numpy ms', 'speedup', 'max |diff|'))
+    for n in args.sizes:
+        gt, pred, valid = make_data(n)
+        diff = np.max(np.abs(
+            compute_map(gt, pred, valid) - sklearn_map(gt, pred, valid)))
+        assert diff < 1e-9, 'AP mismatch: {}'.format(diff)
+        ref_t = best_time(lambda: sklearn_map(gt, pred, valid), args.repeats)
+        new_t = best_time(lambda: compute_map(gt, pred, valid), args.repeats)
+        print('{:>8} {:>12.2f} {:>12.2f} {:>7.2f}x {:>12.2e}'.format(
+            n, ref_t * 1e3, new_t * 1e3, ref_t / new_t, diff))
+
+    print('\n{:>8} {:>8} {:>12} {:>14}'.format(
+        'N', 'bins', 'stream ms', 'max |AP diff|'))
+    for n in args.sizes:
+        gt, pred, valid = make_data(n)
+        exact = compute_map(gt, pred, valid)
+        for num_bins in args.bins:
+            def stream():
+                meter = StreamingMAP(gt.shape[1], num_bins=num_bins)
+                for i in range(0, n, args.batch_size):
+                    j = i + args.batch_size
+                    meter.update(gt[i:j], pred[i:j], valid[i:j])
+                return meter.result()
+            diff = np.max(np.abs(stream() - exact))
+            stream_t = best_time(stream, args.repeats)
+            print('{:>8} {:>8} {:>12.2f} {:>14.2e}'.format(
+                n, num_bins, stream_t * 1e3, diff))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+# Request latency of a trained classifier: Estimator.predict on one image
+# (graph build and restore per call) against serving.Predictor on the
+# exported SavedModel with concurrent clients and dynamic micro-batching.
+import argparse
+import json
+import threading
+import time
+
+import numpy as np
+import tensorflow as tf
+
+import model
+import serving
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Benchmark single-image serving latency.')
+    parser.add_argument('model_dir', type=str, help='Estimator model_dir')
+    parser.add_argument(
+        '--script', type=str, required=True,
+        help='Training script of the model, e.g. 03_pascal_vgg16; its '
+             'MODEL_PARAMS define the network and the input size')
+    parser.add_argument(
+        '--export_dir', type=str, default=None,
+        help='Existing SavedModel to serve (default: export one to '
+             '<model_dir>/export)')
+    parser.add_argument('--num_clients', type=int, default=8)
+    parser.add_argument('--num_requests', type=int, default=2000)
+    parser.add_argument('--max_batch_size', type=int, default=32)
+    parser.add_argument('--max_wait_ms', type=float, default=5.)
+    parser.add_argument(
+        '--estimator_calls', type=int, default=3,
+        help='Single-image Estimator.predict calls for comparison')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    model_params = model.script_model_params(args.script)
+    export_dir = args.export_dir or serving.export_saved_model(
+        args.model_dir, args.model_dir + '/export', model_params)
+
+    # requests are center crops, the PREDICT input of model_fn
+    side = serving.input_size(model_params)
+    rng = np.random.RandomState(0)
+    images = rng.randint(0, 256, (64, side, side, 3)).astype(np.uint8)
+
+    estimator = tf.estimator.Estimator(
+        model_fn=lambda features, labels, mode: model.model_fn(
+            features, labels, mode, **model_params),
+        model_dir=args.model_dir)
+    estimator_ms = []
+    for i in range(args.estimator_calls):
+        start = time.time()
+        list(estimator.predict(tf.estimator.inputs.numpy_input_fn(
+            x={"x": images[i:i + 1]}, num_epochs=1, shuffle=False)))
+        estimator_ms.append((time.time() - start) * 1e3)
+
+    predictor = serving.Predictor(
+        export_dir, max_batch_size=args.max_batch_size,
+        max_wait_ms=args.max_wait_ms)
+    per_client = args.num_requests // args.num_clients
+
+    def client(seed):
+        for i in range(per_client):
+            predictor.predict(images[(seed + i) % len(images)])
+
+    threads = [threading.Thread(target=client, args=(c,))
+               for c in range(args.num_clients)]
+    start = time.time()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.time() - start
+    predictor.close()
+
+    report = predictor.latency_report()
+    report.update(
+        clients=args.num_clients,
+        images_per_sec=per_client * args.num_clients / elapsed,
+        estimator_predict_ms=float(np.median(estimator_ms)))
+    print(json.dumps(report, indent=2, sort_keys=True))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,278 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+# 2-d embeddings of CNN features for the t-SNE plots. Running t-SNE on raw
+# 4096-dim fc7 of a whole split is slow and memory-hungry, so the pipeline
+# is: randomized PCA (knn.PCA) to ~50 dims, an exact kNN graph on the
+# reduced features (chunked matmuls split over worker threads), then either
+# Barnes-Hut t-SNE on that sparse graph (sklearn) or a UMAP-like layout of
+# the fuzzy kNN graph by negative-sampling SGD in plain NumPy. The reduced
+# features, the kNN graph and the final embedding are cached in cache_dir
+# under the hash of their inputs, so replotting recomputes nothing.
+import hashlib
+import json
+import os
+import os.path as osp
+from multiprocessing.pool import ThreadPool
+
+import numpy as np
+
+import knn
+
+EMBED_METHODS = ('graph', 'tsne')
+# a, b of the UMAP curve 1 / (1 + a d^2b) for min_dist=0.1, spread=1
+CURVE_A = 1.577
+CURVE_B = 0.895
+
+
+def array_digest(data, chunk_size=4096):
+    """sha1 of the shape, dtype and contents of an array, read in chunks."""
+    h = hashlib.sha1()
+    h.update(json.dumps([list(data.shape), data.dtype.str]).encode('utf-8'))
+    for start in range(0, len(data), chunk_size):
+        h.update(np.ascontiguousarray(data[start:start + chunk_size]).data)
+    return h.hexdigest()
+
+
+def _cached(cache_dir, name, key, compute):
+    """Load cache_dir/name_key.npz, or compute() and save its arrays."""
+    if cache_dir is None:
+        return compute()
+    path = osp.join(cache_dir, '{}_{}.npz'.format(name, key[:16]))
+    if osp.isfile(path):
+        print('loading {}'.format(path))
+        with np.load(path) as f:
+            return tuple(f['arr_{}'.format(i)] for i in range(len(f.files)))
+    arrays = compute()
+    if not osp.isdir(cache_dir):
+        os.makedirs(cache_dir)
+    tmp_path = path + '.tmp{}.npz'.format(os.getpid())
+    np.savez(tmp_path, *arrays)
+    os.rename(tmp_path, path)
+    return arrays
+
+
+def _key(*parts):
+    return hashlib.sha1(json.dumps(parts).encode('utf-8')).hexdigest()
+
+
+def knn_graph(data, k, num_workers=None, chunk_size=1024):
+    """
+    Exact k nearest neighbours of every row among the other rows.
+    Blocks of queries are searched by knn.ExactIndex in a thread pool; the
+    matmuls release the GIL, so the threads run on separate cores.
+    Args:
+        data (np.ndarray): float32 rows of shape (N, D).
+        k (int): Neighbours per row, the row itself excluded.
+        num_workers (int): Threads, None for one per CPU.
+        chunk_size (int): Queries per task.
+    Returns:
+        dist (np.ndarray): Shape (N, k) squared distances, ascending.
+        indices (np.ndarray): Shape (N, k) neighbour rows.
+    """
+    index = knn.ExactIndex(query_chunk=chunk_size).fit(data)
+    starts = range(0, len(data), chunk_size)
+    pool = ThreadPool(num_workers)
+    try:
+        results = pool.map(
+            lambda s: index.search(data[s:s + chunk_size], k + 1), starts)
+    finally:
+        pool.close()
+    dist = np.concatenate([r[0] for r in results])
+    idx = np.concatenate([r[1] for r in results])
+    # drop each row from its own list (or the farthest hit if a duplicate
+    # row pushed it out)
+    other = idx != np.arange(len(idx))[:, None]
+    other[other.all(axis=1), -1] = False
+    return (dist[other].reshape(len(idx), -1),
+            idx[other].reshape(len(idx), -1))
+
+
+def fuzzy_graph(dist, idx, num_iters=64):
+    """
+    Symmetric fuzzy kNN graph of UMAP.
+    Every row gets exp(-(d - rho) / sigma) edge weights, with rho its
+    nearest distance and sigma found by bisection so that the weights sum
+    to log2(k); the two directions of an edge are combined as a fuzzy
+    union a + b - ab.
+    Args:
+        dist (np.ndarray): (N, k) squared distances from knn_graph.
+        idx (np.ndarray): (N, k) neighbours from knn_graph.
+        num_iters (int): Bisection steps.
+    Returns:
+        head (np.ndarray): Source row of every directed edge.
+        tail (np.ndarray): Target row of every directed edge.
+        weights (np.ndarray): Edge weights in (0, 1].
+    """
+    n, k = idx.shape
+    d = np.sqrt(dist)
+    d = np.maximum(d - d[:, :1], 0)
+    target = np.log2(k)
+    lo = np.zeros(n)
+    hi = np.full(n, np.inf)
+    sigma = np.ones(n)
+    for _ in range(num_iters):
+        big = np.exp(-d / sigma[:, None]).sum(axis=1) > target
+        hi = np.where(big, sigma, hi)
+        lo = np.where(big, lo, sigma)
+        sigma = np.where(np.isinf(hi), sigma * 2, (lo + hi) / 2)
+    w = np.exp(-d / sigma[:, None]).ravel()
+
+    rows = np.repeat(np.arange(n), k)
+    cols = idx.ravel()
+    keys, inverse = np.unique(
+        np.concatenate([rows * n + cols, cols * n + rows]),
+        return_inverse=True)
+    w = np.concatenate([w, w])
+    total = np.bincount(inverse, weights=w, minlength=len(keys))
+    count = np.bincount(inverse, minlength=len(keys))
+    # for an edge listed by both ends, ab = ((a + b)^2 - a^2 - b^2) / 2
+    sq = np.bincount(inverse, weights=w * w, minlength=len(keys))
+    weights = np.where(count == 2, total - (total * total - sq) / 2, total)
+    return keys // n, keys % n, weights
+
+
+def graph_layout(head, tail, weights, init, num_epochs=200,
+                 learning_rate=1.0, negative_rate=5, seed=0):
+    """
+    UMAP-like layout of a weighted graph by stochastic gradient descent.
+    Each epoch samples every edge with probability proportional to its
+    weight, pulls its ends together under the curve 1 / (1 + a d^2b) and
+    pushes the head away from negative_rate random rows. The updates of an
+    epoch are applied at once with bincount, so an epoch is a handful of
+    vectorized passes over the edges.
+    Args:
+        head, tail, weights (np.ndarray): Edges from fuzzy_graph.
+        init (np.ndarray): (N, 2) initial positions.
+        num_epochs (int): Passes over the edges.
+        learning_rate (float): Initial step, decayed linearly to 0.
+        negative_rate (int): Negative samples per sampled edge.
+        seed (int): Seed of the sampling.
+    Returns:
+        y (np.ndarray): (N, 2) float32 positions.
+    """
+    rng = np.random.RandomState(seed)
+    y = np.array(init, dtype=np.float32)
+    n = len(y)
+    prob = weights / weights.max()
+    a, b = CURVE_A, CURVE_B
+
+    def apply(rows, grad, step):
+        for c in range(y.shape[1]):
+            y[:, c] += step * np.bincount(rows, weights=grad[:, c],
+                                          minlength=n)
+
+    for epoch in range(num_epochs):
+        step = learning_rate * (1 - epoch / num_epochs)
+        active = rng.random_sample(len(prob)) < prob
+        h, t = head[active], tail[active]
+        diff = y[h] - y[t]
+        d2 = np.maximum(np.einsum('ij,ij->i', diff, diff), 1e-12)
+        coef = -2 * a * b * d2 ** (b - 1) / (1 + a * d2 ** b)
+        grad = np.clip(coef[:, None] * diff, -4, 4)
+        apply(h, grad, step)
+        apply(t, -grad, step)
+
+        h = np.repeat(h, negative_rate)
+        t = rng.randint(n, size=len(h))
+        diff = y[h] - y[t]
+        d2 = np.einsum('ij,ij->i', diff, diff)
+        coef = 2 * b / ((0.001 + d2) * (1 + a * d2 ** b))
+        coef[h == t] = 0
+        grad = np.clip(coef[:, None] * diff, -4, 4)
+        apply(h, grad, step)
+    return y
+
+
+def tsne_layout(dist, idx, init, perplexity=30.0, num_workers=None, seed=0):
+    """
+    Barnes-Hut t-SNE (sklearn) on a precomputed sparse kNN graph.
+    Args:
+        dist (np.ndarray): (N, k) squared distances from knn_graph, with
+            k > 3 * perplexity + 1.
+        idx (np.ndarray): (N, k) neighbours from knn_graph.
+        init (np.ndarray): (N, 2) initial positions.
+        perplexity (float): t-SNE perplexity.
+        num_workers (int): Threads of the neighbour search, None for all.
+        seed (int): Seed of the optimization.
+    Returns:
+        y (np.ndarray): (N, 2) float32 positions.
+    """
+    from scipy import sparse
+    from sklearn.manifold import TSNE
+
+    n, k = idx.shape
+    graph = sparse.csr_matrix(
+        (dist.ravel(), idx.ravel(), np.arange(0, n * k + 1, k)), (n, n))
+    tsne = TSNE(n_components=2, perplexity=perplexity, metric='precomputed',
+                method='barnes_hut', init=init, random_state=seed,
+                n_jobs=num_workers if num_workers is not None else -1)
+    return tsne.fit_transform(graph).astype(np.float32)
+
+
+def embed(features, method='graph', num_components=50, num_neighbors=15,
+          perplexity=30.0, num_epochs=200, num_workers=None, cache_dir=None,
+          seed=0):
+    """
+    2-d embedding of a feature matrix for plotting.
+    Args:
+        features (np.ndarray): (N, D) features, e.g. a memmap of the
+            feature store.
+        method (str): One of EMBED_METHODS: "graph" for the UMAP-like
+            layout, "tsne" for Barnes-Hut t-SNE.
+        num_components (int): PCA dimensionality before the kNN graph.
+        num_neighbors (int): kNN graph degree of the "graph" method; "tsne"
+            uses 3 * perplexity.
+        perplexity (float): Perplexity of the "tsne" method.
+        num_epochs (int): SGD epochs of the "graph" method.
+        num_workers (int): Threads, None for one per CPU.
+        cache_dir (str): Directory of the reduced features, kNN graph and
+            embedding caches, None to disable caching.
+        seed (int): Seed of PCA, initialization and optimization.
+    Returns:
+        y (np.ndarray): (N, 2) float32 positions.
+    """
+    if method not in EMBED_METHODS:
+        raise ValueError('unknown embedding method {}'.format(method))
+    if method == 'tsne':
+        # sklearn needs 3 * perplexity + 1 neighbours besides the row
+        num_neighbors = min(int(3 * perplexity + 1) + 1, len(features) - 1)
+    data_key = array_digest(features)
+    pca_key = _key(data_key, num_components, seed)
+    graph_key = _key(pca_key, num_neighbors)
+    embed_key = _key(graph_key, method, perplexity, num_epochs)
+
+    memo = {}
+
+    def cached(name, key, compute):
+        if name not in memo:
+            memo[name] = _cached(cache_dir, name, key, compute)
+        return memo[name]
+
+    def reduce():
+        print('PCA {} -> {}'.format(features.shape, num_components))
+        return (knn.PCA(num_components, seed=seed).fit_transform(features),)
+
+    def neighbours():
+        reduced, = cached('pca', pca_key, reduce)
+        print('kNN graph, k={}'.format(num_neighbors))
+        return knn_graph(reduced, num_neighbors, num_workers=num_workers)
+
+    def layout():
+        reduced, = cached('pca', pca_key, reduce)
+        dist, idx = cached('knn', graph_key, neighbours)
+        # start from the two leading principal components, scaled like
+        # sklearn's t-SNE / UMAP initializations
+        init = reduced[:, :2] / max(reduced[:, 0].std(), 1e-12)
+        print('{} layout of {} points'.format(method, len(reduced)))
+        if method == 'tsne':
+            return (tsne_layout(dist, idx, init * 1e-4, perplexity,
+                                num_workers, seed),)
+        head, tail, weights = fuzzy_graph(dist, idx)
+        init *= 10 / max(np.abs(init).max(), 1e-12)
+        return (graph_layout(head, tail, weights, init,
+                             num_epochs=num_epochs, seed=seed),)
+
+    y, = cached('embedding_' + method, embed_key, layout)
+    return y
@@ -1,4 +1,55 @@
-import sklearn.metrics
+import numpy as np
+
+
+def average_precision(gt, scores, valid=None):
+    """
+    Exact average precision of every column, computed together.
+    Matches sklearn.metrics.average_precision_score applied column by column
+    (tied scores form a single threshold) with one argsort per column and
+    cumulative sums over the whole (N, C) matrix.
+    gt (np.ndarray): Shape NxC, 0 or 1.
+    scores (np.ndarray): Shape NxC, higher means more likely positive.
+    valid (np.ndarray): Shape NxC, 0 to drop that entry from its column, or
+        None to keep everything.
+    Returns an array of C APs; columns without valid positives get nan.
+    """
+    # work on contiguous (C, N) rows so every sort and scan is cache friendly
+    scores = np.ascontiguousarray(np.asarray(scores).T)
+    c, n = scores.shape
+    if n == 0:
+        return np.full(c, np.nan)
+    gt = np.asarray(gt).T > 0
+    if valid is None:
+        valid = np.ones((c, n), dtype=bool)
+    else:
+        valid = np.asarray(valid).T > 0
+
+    # order inside a tie group does not matter, so no stable sort is needed
+    order = np.argsort(-scores, axis=1)
+    order += (np.arange(c) * n)[:, None]
+    sorted_scores = scores.ravel()[order]
+    pos = (gt & valid).ravel()[order]
+    neg = (~gt & valid).ravel()[order]
+    tp = np.cumsum(pos, axis=1)
+    fp = np.cumsum(neg, axis=1)
+
+    # every entry is scored at the last position of its tie group
+    group_end = np.ones((c, n), dtype=bool)
+    group_end[:, :-1] = sorted_scores[:, :-1] != sorted_scores[:, 1:]
+    end_idx = np.where(group_end, np.arange(n), n)
+    end_idx = np.minimum.accumulate(end_idx[:, ::-1], axis=1)[:, ::-1]
+    end_idx += (np.arange(c) * n)[:, None]
+
+    # AP is the mean precision seen by the positives
+    hits = np.flatnonzero(pos)
+    at = end_idx.ravel()[hits]
+    tp_at = tp.ravel()[at]
+    precision = tp_at / (tp_at + fp.ravel()[at]).astype(np.float64)
+    total = np.bincount(hits // n, weights=precision, minlength=c)
+
+    num_pos = tp[:, -1].astype(np.float64)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return total / num_pos
 
 
 def compute_map(gt, pred, valid, average=None):
@@ -10,16 +61,116 @@ def compute_map(gt, pred, valid, average=None):
         (output probablitiy).
     valid (np.ndarray): Shape Nx20, 0 if you want to ignore that class for that
         image. Some objects are labeled as ambiguous.
+    Returns an array with the AP of every class.
+    """
+    gt = np.asarray(gt).astype('float32')
+    # As per PhilK. code:
+    # https://github.com/philkr/voc-classification/blob/master/src/train_cls.py
+    pred = np.asarray(pred).astype('float32')
+    pred -= 1e-5 * gt
+    return average_precision(gt, pred, valid)
+
+
+class StreamingMAP(object):
+    """
+    Accumulate predictions batch by batch and compute per-class AP at the end.
+    With num_bins=None the scores are kept in compact float32/bool buffers
+    and result() equals compute_map on the stacked arrays. With num_bins set,
+    each class only keeps histograms of positive and negative scores, so
+    memory is O(num_classes * num_bins) for any number of images and every
+    bin is scored as one tied threshold.
+    num_classes (int): Number of columns of gt/pred.
+    num_bins (int): Histogram bins per class, or None for exact AP.
+    score_range (tuple): (low, high) range of the scores; binned mode clips
+        scores outside of it into the end bins.
     """
-    nclasses = gt.shape[1]
-    all_ap = []
-    for cid in range(nclasses):
-        gt_cls = gt[:, cid][valid[:, cid] > 0].astype('float32')
-        pred_cls = pred[:, cid][valid[:, cid] > 0].astype('float32')
-        # As per PhilK. code:
-        # https://github.com/philkr/voc-classification/blob/master/src/train_cls.py
-        pred_cls -= 1e-5 * gt_cls
-        ap = sklearn.metrics.average_precision_score(
-            gt_cls, pred_cls, average=average)
-        all_ap.append(ap)
-    return all_ap
+
+    def __init__(self, num_classes=20, num_bins=None, score_range=(0.0, 1.0)):
+        self.num_classes = num_classes
+        self.num_bins = num_bins
+        self.score_range = score_range
+        self.num_images = 0
+        if num_bins is None:
+            self._gt, self._pred, self._valid = [], [], []
+        else:
+            self._pos_hist = np.zeros((num_classes, num_bins), dtype=np.int64)
+            self._neg_hist = np.zeros((num_classes, num_bins), dtype=np.int64)
+
+    def update(self, gt, pred, valid):
+        """
+        Add a batch; arguments are shaped like those of compute_map.
+        """
+        gt = np.asarray(gt) > 0
+        pred = np.asarray(pred, dtype=np.float32)
+        valid = np.asarray(valid) > 0
+        self.num_images += len(pred)
+        if self.num_bins is None:
+            self._gt.append(gt)
+            self._pred.append(pred)
+            self._valid.append(valid)
+            return
+
+        # same tie-break as compute_map, before the scores are quantized
+        pred = pred - 1e-5 * gt
+        low, high = self.score_range
+        bins = np.floor((pred - low) * (self.num_bins / (high - low)))
+        bins = np.clip(bins, 0, self.num_bins - 1).astype(np.int64)
+        bins += np.arange(self.num_classes) * self.num_bins
+        size = self.num_classes * self.num_bins
+        self._pos_hist += np.bincount(
+            bins[gt & valid], minlength=size).reshape(self._pos_hist.shape)
+        self._neg_hist += np.bincount(
+            bins[~gt & valid], minlength=size).reshape(self._neg_hist.shape)
+
+    def result(self):
+        """
+        Returns an array with the AP of every class (nan without positives).
+        """
+        if self.num_bins is None:
+            if not self._pred:
+                return np.full(self.num_classes, np.nan)
+            return compute_map(np.concatenate(self._gt),
+                               np.concatenate(self._pred),
+                               np.concatenate(self._valid))
+
+        # walk the bins from the highest score down
+        pos = self._pos_hist[:, ::-1]
+        tp = np.cumsum(pos, axis=1)
+        fp = np.cumsum(self._neg_hist[:, ::-1], axis=1)
+        precision = tp / np.maximum(tp + fp, 1).astype(np.float64)
+        total = np.sum(pos * precision, axis=1)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return total / tp[:, -1].astype(np.float64)
+
+
+def streaming_map(predictions, gt, valid, key='probabilities', num_bins=None,
+                  batch_size=1000):
+    """
+    Compute per-class AP straight off an Estimator.predict generator.
+    Predictions are stacked batch_size at a time and handed to a
+    StreamingMAP, so the per-image dicts are never held all at once.
+    predictions (iterable): Dicts with key holding a row of scores, in the
+        same order as the rows of gt.
+    gt (np.ndarray): Shape NxC labels, as for compute_map.
+    valid (np.ndarray): Shape NxC weights, as for compute_map.
+    key (str): Prediction dict entry holding the scores.
+    num_bins (int): Histogram bins per class, or None for exact AP.
+    batch_size (int): Rows handed to StreamingMAP.update at a time.
+    Returns (AP array, number of images seen).
+    """
+    meter = StreamingMAP(gt.shape[1], num_bins=num_bins)
+    batch = []
+
+    def _flush():
+        start = meter.num_images
+        end = start + len(batch)
+        meter.update(gt[start:end], np.stack(batch), valid[start:end])
+        del batch[:]
+
+    for p in predictions:
+        batch.append(p[key])
+        if len(batch) == batch_size:
+            _flush()
+    if batch:
+        _flush()
+    return meter.result(), meter.num_images
@@ -0,0 +1,400 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+# Persistent store of CNN features. Each (split, layer, backbone checkpoint)
+# gets a directory holding a memory-mapped features.npy with the labels, in
+# the same layout as the image packs of pascal_data.py; the directory name
+# carries the key, so features of several checkpoints live side by side.
+# Features are written batch by batch as they are computed and read back
+# lazily. They serve two uses: head_model_fn trains only the layers above
+# frozen pool5/fc7 features, so a learning rate or head sweep never touches
+# the conv stack again, and the 05 analysis scripts read endpoints of a
+# trained model through predict_features instead of predicting again.
+import hashlib
+import json
+import os
+import os.path as osp
+import shutil
+
+import numpy as np
+import tensorflow as tf
+
+import model
+import pascal_data
+import pascal_input
+
+FEATURE_LAYERS = ('pool5', 'fc7')
+# model_fn parameters that still matter for head_model_fn
+HEAD_PARAMS = ('net_params', 'learning_rate', 'decay_steps', 'decay_rate',
+               'momentum', 'summaries', 'grad_summaries')
+# net_params of the backbone that head_net understands
+HEAD_NET_PARAMS = ('width', 'relu_logits', 'pretrained')
+
+
+def _checkpoint_id(checkpoint):
+    """Resolved checkpoint path with the size and mtime of its files."""
+    if checkpoint is None:
+        return None
+    if osp.isdir(checkpoint):
+        checkpoint = tf.train.latest_checkpoint(checkpoint)
+    for path in (checkpoint + '.index', checkpoint):
+        if osp.isfile(path):
+            stat = os.stat(path)
+            return [checkpoint, stat.st_size, int(stat.st_mtime)]
+    return [checkpoint]
+
+
+def feature_key(data_dir, split, model_params, layer, checkpoint=None,
+                ignore_difficult=False, dtype=np.float32):
+    """
+    Hash everything the cached features of a split depend on.
+    Args:
+        data_dir (str): Path to the VOC2007 directory.
+        split (str): train/val/trainval/test split to use.
+        model_params (dict): model_fn keyword arguments of the backbone.
+        layer (str): Name of the features, e.g. one of FEATURE_LAYERS.
+        checkpoint (str): Checkpoint the backbone is restored from.
+        ignore_difficult (bool): Label convention stored with the features.
+        dtype (np.dtype): Storage type of the features.
+    Returns:
+        key (str): Hex digest that changes whenever the features are stale.
+    """
+    image_size = model_params.get('image_size', 256)
+    crop_size = model_params.get('crop_size', 224)
+    net_params = model_params.get('net_params') or {}
+    h = hashlib.sha1()
+    h.update(json.dumps([
+        pascal_data.cache_key(
+            data_dir, split, image_size,
+            pascal_data.split_crop_size(split, crop_size), ignore_difficult),
+        layer, crop_size, model_params.get('arch', 'alexnet'),
+        model_params.get('mean'), model_params.get('scale', False),
+        sorted(net_params.items()), _checkpoint_id(checkpoint),
+        _checkpoint_id(net_params.get('pretrained')), np.dtype(dtype).name,
+    ], default=str).encode('utf-8'))
+    return h.hexdigest()
+
+
+def _feature_dir(cache_dir, split, model_params, layer, key):
+    return osp.join(cache_dir, 'features_{}_{}_{}_{}'.format(
+        model_params.get('arch', 'alexnet'), layer, split, key[:12]))
+
+
+def _is_cached(path, key):
+    meta_path = osp.join(path, 'meta.json')
+    if not osp.isfile(meta_path):
+        return False
+    with open(meta_path, 'r') as f:
+        return json.load(f)['key'] == key
+
+
+def _load_dir(path):
+    features = np.load(osp.join(path, 'features.npy'), mmap_mode='r')
+    labels = np.load(osp.join(path, 'labels.npy'))
+    weights = np.load(osp.join(path, 'weights.npy'))
+    return features, labels, weights
+
+
+class FeatureWriter(object):
+    """
+    Stream the features of one layer into a feature directory.
+    features.npy is created as a memory map on the first batch (when the
+    dimensionality is known) and filled in place, so the features are never
+    held in memory. Everything is written under a temporary name and
+    renamed into place by close().
+    Args:
+        path (str): Feature directory to create.
+        key (str): feature_key of the features.
+        split (str): Split name, stored in meta.json.
+        layer (str): Layer name, stored in meta.json.
+        num_images (int): Number of rows.
+        dtype (np.dtype): Storage type, e.g. np.float16 to halve the size.
+    """
+
+    def __init__(self, path, key, split, layer, num_images, dtype=np.float32):
+        self.path = path
+        self._meta = {'key': key, 'split': split, 'layer': layer,
+                      'num_images': num_images,
+                      'dtype': np.dtype(dtype).name}
+        self._dtype = dtype
+        self._tmp_path = path + '.tmp{}'.format(os.getpid())
+        if osp.isdir(self._tmp_path):
+            shutil.rmtree(self._tmp_path)
+        os.makedirs(self._tmp_path)
+        self._features = None
+
+    def write(self, start, batch):
+        """Store rows start:start + len(batch); batch is (B, D)."""
+        if self._features is None:
+            self._features = np.lib.format.open_memmap(
+                osp.join(self._tmp_path, 'features.npy'), mode='w+',
+                dtype=self._dtype,
+                shape=(self._meta['num_images'], batch.shape[1]))
+        self._features[start:start + len(batch)] = batch
+
+    def close(self, labels, weights):
+        """Write the labels and metadata and move the directory in place."""
+        self._features.flush()
+        self._meta['dim'] = self._features.shape[1]
+        self._features = None
+        np.save(osp.join(self._tmp_path, 'labels.npy'), labels)
+        np.save(osp.join(self._tmp_path, 'weights.npy'), weights)
+        with open(osp.join(self._tmp_path, 'meta.json'), 'w') as f:
+            json.dump(self._meta, f)
+        if osp.isdir(self.path):
+            shutil.rmtree(self.path)
+        os.rename(self._tmp_path, self.path)
+        print('cached {} {} features of {} images to {}'.format(
+            self._meta['dim'], self._meta['layer'],
+            self._meta['num_images'], self.path))
+        return self.path
+
+
+def extract_features(images, model_params, layer, checkpoint=None,
+                     var_map=None, batch_size=64):
+    """
+    Run the backbone over a set of images, one batch at a time.
+    Images larger than the crop size (the uncropped trainval split) are
+    center-cropped; dropout is off.
+    Args:
+        images (np.ndarray): Shape (N, H, W, 3), uint8 (normalized on the
+            graph with the mean/scale of model_params) or float32.
+        model_params (dict): model_fn keyword arguments of the backbone.
+        layer (str): One of FEATURE_LAYERS.
+        checkpoint (str): Checkpoint (or model directory) to restore. With
+            var_map, only the mapped variables are loaded from it, as
+            model.LoadHook does; None keeps the initializers (e.g. vgg
+            with net_params pretrained).
+        var_map (dict): Checkpoint to graph variable names, or None.
+        batch_size (int): Images per session.run.
+    Yields:
+        start (int): Index of the first image of the batch.
+        features (np.ndarray): float32 features of shape (B, D), flattened
+            in NHWC order.
+    """
+    crop_size = model_params.get('crop_size', 224)
+    graph = tf.Graph()
+    with graph.as_default():
+        x = tf.placeholder(tf.as_dtype(images.dtype),
+                           [None] + list(images.shape[1:]))
+        net = pascal_input.normalize_input(
+            x, mean=model_params.get('mean'),
+            scale=model_params.get('scale', False))
+        side = images.shape[1]
+        if crop_size is not None and side > crop_size:
+            margin = (side - crop_size) // 2
+            net = net[:, margin:margin + crop_size,
+                      margin:margin + crop_size, :]
+        _, end_points = model.NETWORKS[model_params.get('arch', 'alexnet')](
+            net, False, **(model_params.get('net_params') or {}))
+        features = end_points[layer]
+        features = tf.reshape(
+            features, [-1, features.shape[1:].num_elements()])
+
+        saver = None
+        if checkpoint is not None:
+            if osp.isdir(checkpoint):
+                checkpoint = tf.train.latest_checkpoint(checkpoint)
+            if var_map is not None:
+                tf.contrib.framework.init_from_checkpoint(checkpoint, var_map)
+            else:
+                saver = tf.train.Saver()
+        with tf.Session(graph=graph) as sess:
+            sess.run(tf.global_variables_initializer())
+            if saver is not None:
+                saver.restore(sess, checkpoint)
+            for start in range(0, len(images), batch_size):
+                yield start, sess.run(
+                    features, {x: images[start:start + batch_size]})
+
+
+def cache_features(data_dir, cache_dir, split, model_params, layer,
+                   checkpoint=None, var_map=None, ignore_difficult=False,
+                   num_workers=None, batch_size=64, dtype=np.float32):
+    """
+    Extract the features of a split into a memory-mappable directory.
+    The directory holds features.npy (N x D), labels.npy, weights.npy and
+    meta.json with the feature key. Images come from the pack of the split
+    in cache_dir (built if needed) and the features are streamed to disk by
+    a FeatureWriter, so neither is held in memory.
+    Args:
+        data_dir (str): Path to the VOC2007 directory.
+        cache_dir (str): Directory holding the image packs and features.
+        split (str): train/val/trainval/test split to use.
+        model_params (dict): model_fn keyword arguments of the backbone.
+        layer (str): One of FEATURE_LAYERS.
+        checkpoint (str): Backbone checkpoint, see extract_features.
+        var_map (dict): Backbone variable map, see extract_features.
+        ignore_difficult (bool): Give difficult entries weight 0.
+        num_workers (int): Decoder processes if the image pack is built.
+        batch_size (int): Images per session.run.
+        dtype (np.dtype): Storage type of the features.
+    Returns:
+        path (str): Directory of the written features.
+    """
+    key = feature_key(data_dir, split, model_params, layer, checkpoint,
+                      ignore_difficult, dtype)
+    images, labels, weights = pascal_data.open_pack(
+        data_dir, cache_dir, split=split,
+        image_size=model_params.get('image_size', 256),
+        crop_size=model_params.get('crop_size', 224),
+        ignore_difficult=ignore_difficult, num_workers=num_workers)
+    writer = FeatureWriter(
+        _feature_dir(cache_dir, split, model_params, layer, key), key,
+        split, layer, len(images), dtype)
+    for start, batch in extract_features(
+            images, model_params, layer, checkpoint=checkpoint,
+            var_map=var_map, batch_size=batch_size):
+        writer.write(start, batch)
+    return writer.close(labels, weights)
+
+
+def open_features(data_dir, cache_dir, split, model_params, layer,
+                  checkpoint=None, var_map=None, ignore_difficult=False,
+                  num_workers=None, batch_size=64, dtype=np.float32):
+    """
+    Memory-map cached features, extracting them first if missing.
+    Arguments are those of cache_features.
+    Returns:
+        features (np.memmap): Read-only array of shape (N, D).
+        labels (np.ndarray): (N, 20) np.int8 array.
+        weights (np.ndarray): (N, 20) np.int8 array.
+    """
+    key = feature_key(data_dir, split, model_params, layer, checkpoint,
+                      ignore_difficult, dtype)
+    path = _feature_dir(cache_dir, split, model_params, layer, key)
+    if not _is_cached(path, key):
+        print('features {} are missing, extracting'.format(path))
+        cache_features(data_dir, cache_dir, split, model_params, layer,
+                       checkpoint=checkpoint, var_map=var_map,
+                       ignore_difficult=ignore_difficult,
+                       num_workers=num_workers, batch_size=batch_size,
+                       dtype=dtype)
+    return _load_dir(path)
+
+
+def predict_features(estimator, data_dir, cache_dir, split, model_params,
+                     layers, ignore_difficult=False, num_workers=None,
+                     batch_size=64, dtype=np.float32):
+    """
+    Prediction entries of a trained Estimator over a split, through the
+    feature store.
+    Entries already stored for the Estimator's latest checkpoint are
+    memory-mapped as they are; the missing ones are computed with a single
+    predict() pass over the image pack, with every prediction written to
+    its FeatureWriter as it arrives instead of being collected in a list.
+    Args:
+        estimator (tf.estimator.Estimator): Model whose model_fn returns the
+            layers as predictions (e.g. model_fn with endpoints).
+        data_dir (str): Path to the VOC2007 directory.
+        cache_dir (str): Directory holding the image packs and features.
+        split (str): train/val/trainval/test split to use.
+        model_params (dict): model_fn keyword arguments of the Estimator.
+        layers (tuple): Prediction keys to return, e.g. ("pool5", "fc7",
+            "probabilities"); each is flattened to one row per image.
+        ignore_difficult (bool): Give difficult entries weight 0.
+        num_workers (int): Decoder processes if the image pack is built.
+        batch_size (int): Images per predict batch and per write.
+        dtype (np.dtype): Storage type of the features.
+    Returns:
+        features (dict): Layer name to read-only (N, D) memmap.
+        labels (np.ndarray): (N, 20) np.int8 array.
+        weights (np.ndarray): (N, 20) np.int8 array.
+    """
+    checkpoint = estimator.latest_checkpoint()
+    paths = {}
+    missing = []
+    for layer in layers:
+        key = feature_key(data_dir, split, model_params, layer, checkpoint,
+                          ignore_difficult, dtype)
+        paths[layer] = _feature_dir(cache_dir, split, model_params, layer,
+                                    key)
+        if not _is_cached(paths[layer], key):
+            missing.append((layer, key))
+
+    if missing:
+        # model_fn predicts one row per image: on center crops, or with tta
+        # on the full images it takes its ten crops from
+        crop_size = model_params.get('crop_size', 224)
+        tta = model_params.get('tta', False)
+        images, labels, weights = pascal_data.open_pack(
+            data_dir, cache_dir, split=split,
+            image_size=model_params.get('image_size', 256),
+            crop_size=None if tta else crop_size,
+            ignore_difficult=ignore_difficult, num_workers=num_workers)
+        if (not tta and crop_size is not None and
+                pascal_data.split_crop_size(split, crop_size) is None):
+            # only the test pack is stored cropped; crop the others as a
+            # view of the memmap
+            margin = (images.shape[1] - crop_size) // 2
+            images = images[:, margin:margin + crop_size,
+                            margin:margin + crop_size]
+        writers = dict(
+            (layer, FeatureWriter(paths[layer], key, split, layer,
+                                  len(images), dtype))
+            for layer, key in missing)
+        input_fn = tf.estimator.inputs.numpy_input_fn(
+            x={"x": images}, batch_size=batch_size, num_epochs=1,
+            shuffle=False)
+        rows = dict((layer, []) for layer in writers)
+        start = num_rows = 0
+        for i, p in enumerate(estimator.predict(
+                input_fn=input_fn, predict_keys=list(writers))):
+            num_rows = i + 1
+            assert num_rows <= len(images), (
+                'more predictions than the {} images of {}'.format(
+                    len(images), split))
+            for layer in writers:
+                rows[layer].append(np.ravel(p[layer]))
+            if i + 1 - start == batch_size or i + 1 == len(images):
+                for layer in writers:
+                    writers[layer].write(start, np.stack(rows[layer]))
+                    rows[layer] = []
+                start = i + 1
+        assert num_rows == len(images), (
+            '{} predictions for the {} images of {}'.format(
+                num_rows, len(images), split))
+        for layer in writers:
+            writers[layer].close(labels, weights)
+
+    features = {}
+    for layer in layers:
+        features[layer], labels, weights = _load_dir(paths[layer])
+    return features, labels, weights
+
+
+def head_model_fn(features, labels, mode, layer='fc7', num_classes=20,
+                  net_params=None, **train_params):
+    """
+    Estimator model function training the head above cached features.
+    features["x"] holds the cached rows; like model_fn, the TRAIN graph
+    names them model.MODEL_INPUT, so train_eval.MAPEvalHook works as is.
+    Args:
+        features (dict): "x" holds (N, D) float32 features.
+        labels (tf.Tensor): Shape (N, num_classes) labels.
+        mode (str): tf.estimator.ModeKeys value.
+        layer (str): Layer the features were taken from, see model.head_net.
+        num_classes (int): Number of outputs.
+        net_params (dict): Backbone net_params; the HEAD_NET_PARAMS entries
+            are passed on to model.head_net.
+        **train_params: Optimizer and summary arguments of
+            model.estimator_spec.
+    Returns:
+        spec (tf.estimator.EstimatorSpec): Spec for the given mode.
+    """
+    training = model.training_flag(mode)
+    inputs = features["x"]
+    if mode == tf.estimator.ModeKeys.TRAIN:
+        inputs = model.model_input(inputs)
+    head_params = dict((k, v) for k, v in (net_params or {}).items()
+                       if k in HEAD_NET_PARAMS)
+    logits, _ = model.head_net(inputs, training, layer=layer,
+                               num_classes=num_classes, **head_params)
+    return model.estimator_spec(
+        mode, logits, labels, tf.nn.sigmoid(logits), **train_params)
+
+
+def head_params(model_params):
+    """The model_fn parameters of a backbone that apply to head_model_fn."""
+    return dict((k, v) for k, v in model_params.items() if k in HEAD_PARAMS)
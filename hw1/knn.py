@@ -0,0 +1,393 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+# Nearest-neighbour retrieval on CNN features (pool5 is 25088-dim for VGG16).
+# Tree indices degrade to brute force at that dimensionality, so the exact
+# search is a chunked BLAS matmul; the approximate indices (IVF, product
+# quantization) and the reducers (PCA, random projection) are plain NumPy.
+# All indices share fit(database) / search(queries, k) -> (dist, indices),
+# with squared euclidean distances, nearest first.
+import numpy as np
+
+
+def _sq_norms(x):
+    return np.einsum('ij,ij->i', x, x)
+
+
+def _gather(a, idx):
+    """a[i, idx[i]] for every row i."""
+    return a[np.arange(len(a))[:, None], idx]
+
+
+def _top_k(dist, k):
+    """Column indices of the k smallest entries of every row, sorted."""
+    k = min(k, dist.shape[1])
+    if k < dist.shape[1]:
+        idx = np.argpartition(dist, k - 1, axis=1)[:, :k]
+    else:
+        idx = np.tile(np.arange(dist.shape[1]), (len(dist), 1))
+    return _gather(idx, np.argsort(_gather(dist, idx), axis=1))
+
+
+def pairwise_sq_dists(queries, database, db_sq_norms=None):
+    """
+    Squared euclidean distances of every query to every database row with a
+    single matmul: |q|^2 - 2 q.x + |x|^2, clipped at 0.
+    Args:
+        queries (np.ndarray): Shape (Q, D).
+        database (np.ndarray): Shape (N, D).
+        db_sq_norms (np.ndarray): Precomputed _sq_norms(database), or None.
+    Returns:
+        dist (np.ndarray): Shape (Q, N) float32 distances.
+    """
+    if db_sq_norms is None:
+        db_sq_norms = _sq_norms(database)
+    dist = np.dot(queries, database.T)
+    dist *= -2
+    dist += _sq_norms(queries)[:, None]
+    dist += db_sq_norms[None, :]
+    return np.maximum(dist, 0, out=dist)
+
+
+def kmeans(data, num_clusters, num_iters=20, seed=0, chunk_size=4096):
+    """
+    Lloyd's k-means with matmul assignments and one-hot matmul updates.
+    Empty clusters are reseeded with random rows.
+    Args:
+        data (np.ndarray): float32 rows of shape (N, D).
+        num_clusters (int): Number of centroids.
+        num_iters (int): Lloyd iterations.
+        seed (int): Seed of the initialization.
+        chunk_size (int): Rows assigned at a time.
+    Returns:
+        centroids (np.ndarray): Shape (num_clusters, D).
+        assign (np.ndarray): Cluster of every row.
+    """
+    rng = np.random.RandomState(seed)
+    n = len(data)
+    centroids = data[rng.choice(n, num_clusters, replace=n < num_clusters)]
+    centroids = np.array(centroids, dtype=np.float32)
+    for _ in range(num_iters):
+        assign = assign_clusters(data, centroids, chunk_size)
+        sums = np.zeros_like(centroids)
+        for start in range(0, n, chunk_size):
+            a = assign[start:start + chunk_size]
+            one_hot = np.zeros((len(a), num_clusters), dtype=np.float32)
+            one_hot[np.arange(len(a)), a] = 1
+            sums += np.dot(one_hot.T, data[start:start + chunk_size])
+        counts = np.bincount(assign, minlength=num_clusters)
+        empty = counts == 0
+        centroids = (sums / np.maximum(counts, 1)[:, None]).astype(np.float32)
+        centroids[empty] = data[rng.choice(n, empty.sum())]
+    return centroids, assign_clusters(data, centroids, chunk_size)
+
+
+def assign_clusters(data, centroids, chunk_size=4096):
+    """Index of the nearest centroid of every row."""
+    c_norms = _sq_norms(centroids)
+    return np.concatenate([
+        np.argmin(pairwise_sq_dists(
+            data[start:start + chunk_size], centroids, c_norms), axis=1)
+        for start in range(0, len(data), chunk_size)])
+
+
+class ExactIndex(object):
+    """
+    Exact k-nearest-neighbour search by brute force.
+    Queries and database are both processed in chunks, so the distance
+    block held at a time is at most query_chunk x db_chunk; per query chunk
+    a running top-k is merged across database chunks.
+    Args:
+        query_chunk (int): Queries per matmul.
+        db_chunk (int): Database rows per matmul.
+    """
+
+    def __init__(self, query_chunk=1024, db_chunk=16384):
+        self.query_chunk = query_chunk
+        self.db_chunk = db_chunk
+
+    def fit(self, database):
+        self.database = np.asarray(database, dtype=np.float32)
+        self.sq_norms = _sq_norms(self.database)
+        return self
+
+    def search(self, queries, k=5):
+        """
+        Returns:
+            dist (np.ndarray): Shape (Q, k) squared distances, ascending.
+            indices (np.ndarray): Shape (Q, k) database rows.
+        """
+        queries = np.asarray(queries, dtype=np.float32)
+        k = min(k, len(self.database))
+        all_dist, all_idx = [], []
+        for qs in range(0, len(queries), self.query_chunk):
+            q = queries[qs:qs + self.query_chunk]
+            best_dist = np.empty((len(q), 0), dtype=np.float32)
+            best_idx = np.empty((len(q), 0), dtype=np.int64)
+            for ds in range(0, len(self.database), self.db_chunk):
+                dist = pairwise_sq_dists(
+                    q, self.database[ds:ds + self.db_chunk],
+                    self.sq_norms[ds:ds + self.db_chunk])
+                idx = _top_k(dist, k)
+                best_dist = np.concatenate([best_dist, _gather(dist, idx)], 1)
+                best_idx = np.concatenate([best_idx, idx + ds], 1)
+                keep = _top_k(best_dist, k)
+                best_dist = _gather(best_dist, keep)
+                best_idx = _gather(best_idx, keep)
+            all_dist.append(best_dist)
+            all_idx.append(best_idx)
+        return np.concatenate(all_dist), np.concatenate(all_idx)
+
+
+class PCA(object):
+    """
+    Randomized PCA (Halko et al.): a Gaussian sketch of the centered data
+    with a few power iterations, then an exact SVD of the small sketch.
+    Costs O(N D k) instead of the O(N D min(N, D)) of a full SVD.
+    Args:
+        num_components (int): Output dimensionality.
+        whiten (bool): Scale the components to unit variance.
+        oversample (int): Extra sketch columns.
+        num_power_iters (int): Power iterations, more for slowly decaying
+            spectra.
+        seed (int): Seed of the sketch.
+    """
+
+    def __init__(self, num_components, whiten=False, oversample=10,
+                 num_power_iters=2, seed=0):
+        self.num_components = num_components
+        self.whiten = whiten
+        self.oversample = oversample
+        self.num_power_iters = num_power_iters
+        self.seed = seed
+
+    def fit(self, data):
+        data = np.asarray(data, dtype=np.float32)
+        rng = np.random.RandomState(self.seed)
+        self.mean = data.mean(axis=0)
+        x = data - self.mean
+        size = min(self.num_components + self.oversample, min(x.shape))
+        sketch = np.dot(x, rng.randn(x.shape[1], size).astype(np.float32))
+        for _ in range(self.num_power_iters):
+            sketch, _ = np.linalg.qr(sketch)
+            sketch = np.dot(x, np.dot(x.T, sketch))
+        basis, _ = np.linalg.qr(sketch)
+        _, s, vt = np.linalg.svd(np.dot(basis.T, x), full_matrices=False)
+        self.components = vt[:self.num_components]
+        self.singular_values = s[:self.num_components]
+        self.explained_variance = self.singular_values ** 2 / max(
+            len(x) - 1, 1)
+        return self
+
+    def transform(self, data):
+        out = np.dot(np.asarray(data, dtype=np.float32) - self.mean,
+                     self.components.T)
+        if self.whiten:
+            out /= np.sqrt(self.explained_variance + 1e-12)
+        return out
+
+    def fit_transform(self, data):
+        return self.fit(data).transform(data)
+
+
+class RandomProjection(object):
+    """
+    Gaussian random projection; preserves distances up to a small factor
+    (Johnson-Lindenstrauss) without looking at the data.
+    Args:
+        num_components (int): Output dimensionality.
+        seed (int): Seed of the projection matrix.
+    """
+
+    def __init__(self, num_components, seed=0):
+        self.num_components = num_components
+        self.seed = seed
+
+    def fit(self, data):
+        rng = np.random.RandomState(self.seed)
+        self.matrix = rng.randn(
+            np.shape(data)[1], self.num_components).astype(np.float32)
+        self.matrix /= np.sqrt(self.num_components)
+        return self
+
+    def transform(self, data):
+        return np.dot(np.asarray(data, dtype=np.float32), self.matrix)
+
+    def fit_transform(self, data):
+        return self.fit(data).transform(data)
+
+
+class ReducedIndex(object):
+    """
+    Search an index in a reduced space (PCA or RandomProjection), optionally
+    re-ranking the best `rerank` candidates with exact distances.
+    Args:
+        reducer: Object with fit/transform, e.g. PCA(256).
+        index: Index searched in the reduced space, ExactIndex by default.
+        rerank (int): Candidates re-ranked in the original space, 0 for
+            none (distances are then those of the reduced space).
+    """
+
+    def __init__(self, reducer, index=None, rerank=0):
+        self.reducer = reducer
+        self.index = index if index is not None else ExactIndex()
+        self.rerank = rerank
+
+    def fit(self, database):
+        self.database = np.asarray(database, dtype=np.float32)
+        self.index.fit(self.reducer.fit_transform(self.database))
+        return self
+
+    def search(self, queries, k=5):
+        queries = np.asarray(queries, dtype=np.float32)
+        dist, idx = self.index.search(
+            self.reducer.transform(queries), max(k, self.rerank))
+        if not self.rerank:
+            return dist[:, :k], idx[:, :k]
+        return _rerank(self.database, queries, idx, k)
+
+
+def _rerank(database, queries, candidates, k):
+    """Exact top-k among per-query candidate rows (-1 entries are padding)."""
+    dist = np.full(candidates.shape, np.inf, dtype=np.float32)
+    for qi, cand in enumerate(candidates):
+        valid = cand >= 0
+        dist[qi, valid] = pairwise_sq_dists(
+            queries[qi:qi + 1], database[cand[valid]])[0]
+    keep = _top_k(dist, k)
+    return _gather(dist, keep), _gather(candidates, keep)
+
+
+class IVFIndex(object):
+    """
+    Inverted file index: k-means partitions the database into num_lists
+    cells; a query is compared exactly with the rows of its num_probe
+    nearest cells only.
+    Args:
+        num_lists (int): Number of k-means cells (about sqrt(N) works well).
+        num_probe (int): Cells searched per query; num_lists is exact.
+        num_iters (int): k-means iterations.
+        seed (int): k-means seed.
+    """
+
+    def __init__(self, num_lists=64, num_probe=8, num_iters=20, seed=0):
+        self.num_lists = num_lists
+        self.num_probe = num_probe
+        self.num_iters = num_iters
+        self.seed = seed
+
+    def fit(self, database):
+        self.database = np.asarray(database, dtype=np.float32)
+        self.centroids, assign = kmeans(
+            self.database, self.num_lists, self.num_iters, self.seed)
+        # rows sorted by cell, so every inverted list is a contiguous slice
+        self.order = np.argsort(assign, kind='mergesort')
+        self.offsets = np.concatenate(
+            [[0], np.cumsum(np.bincount(assign, minlength=self.num_lists))])
+        self.sorted_db = self.database[self.order]
+        self.sorted_sq_norms = _sq_norms(self.sorted_db)
+        return self
+
+    def search(self, queries, k=5):
+        queries = np.asarray(queries, dtype=np.float32)
+        probe = _top_k(pairwise_sq_dists(queries, self.centroids),
+                       self.num_probe)
+        out_dist = np.full((len(queries), k), np.inf, dtype=np.float32)
+        out_idx = np.full((len(queries), k), -1, dtype=np.int64)
+        for qi, cells in enumerate(probe):
+            rows = np.concatenate([
+                np.arange(self.offsets[c], self.offsets[c + 1])
+                for c in cells])
+            if len(rows) == 0:
+                continue
+            dist = pairwise_sq_dists(
+                queries[qi:qi + 1], self.sorted_db[rows],
+                self.sorted_sq_norms[rows])
+            keep = _top_k(dist, k)[0]
+            out_dist[qi, :len(keep)] = dist[0, keep]
+            out_idx[qi, :len(keep)] = self.order[rows[keep]]
+        return out_dist, out_idx
+
+
+class PQIndex(object):
+    """
+    Product quantization: rows are split into num_subspaces blocks and each
+    block is replaced by the id of its nearest of 256 k-means centroids, so a
+    row costs num_subspaces bytes. Queries are scored against the codes with
+    per-query lookup tables (asymmetric distance); the best `rerank`
+    candidates can be re-ranked exactly if the database is kept.
+    Args:
+        num_subspaces (int): Blocks per row; must divide the dimensionality.
+        num_centroids (int): Centroids per block, at most 256.
+        rerank (int): Candidates re-ranked with exact distances, 0 to drop
+            the original vectors and return approximate distances.
+        num_iters (int): k-means iterations per block.
+        train_size (int): Rows sampled to train the codebooks, None for all.
+        seed (int): Seed of the sampling and of k-means.
+    """
+
+    def __init__(self, num_subspaces=64, num_centroids=256, rerank=0,
+                 num_iters=20, train_size=20000, seed=0):
+        self.num_subspaces = num_subspaces
+        self.num_centroids = num_centroids
+        self.rerank = rerank
+        self.num_iters = num_iters
+        self.train_size = train_size
+        self.seed = seed
+
+    def _blocks(self, data):
+        n, d = data.shape
+        return data.reshape(n, self.num_subspaces, d // self.num_subspaces)
+
+    def fit(self, database):
+        database = np.asarray(database, dtype=np.float32)
+        if database.shape[1] % self.num_subspaces:
+            raise ValueError('{} dims cannot be split into {} subspaces'.format(
+                database.shape[1], self.num_subspaces))
+        rng = np.random.RandomState(self.seed)
+        train = database
+        if self.train_size is not None and len(database) > self.train_size:
+            train = database[rng.choice(
+                len(database), self.train_size, replace=False)]
+        train_blocks = self._blocks(train)
+        blocks = self._blocks(database)
+        self.codebooks = []
+        codes = np.empty((len(database), self.num_subspaces), dtype=np.uint8)
+        for j in range(self.num_subspaces):
+            centroids, _ = kmeans(
+                np.ascontiguousarray(train_blocks[:, j]),
+                self.num_centroids, self.num_iters, self.seed + j)
+            self.codebooks.append(centroids)
+            codes[:, j] = assign_clusters(
+                np.ascontiguousarray(blocks[:, j]), centroids)
+        self.codebooks = np.stack(self.codebooks)
+        self.codes = codes
+        self.database = database if self.rerank else None
+        return self
+
+    def search(self, queries, k=5):
+        queries = np.asarray(queries, dtype=np.float32)
+        blocks = self._blocks(queries)
+        code_norms = np.einsum('jcd,jcd->jc', self.codebooks, self.codebooks)
+        sub = np.arange(self.num_subspaces)
+        out_k = max(k, self.rerank)
+        out_dist, out_idx = [], []
+        for q in blocks:
+            # table[j, c]: distance of query block j to centroid c of block j
+            table = (np.einsum('jd,jd->j', q, q)[:, None] + code_norms -
+                     2 * np.einsum('jd,jcd->jc', q, self.codebooks))
+            dist = table[sub, self.codes].sum(axis=1)
+            idx = _top_k(dist[None], out_k)[0]
+            out_dist.append(dist[idx])
+            out_idx.append(idx)
+        dist, idx = np.stack(out_dist), np.stack(out_idx)
+        if not self.rerank:
+            return dist[:, :k], idx[:, :k]
+        return _rerank(self.database, queries, idx, k)
+
+
+def recall_at_k(found, truth):
+    """Fraction of the true k nearest neighbours among the k found ones."""
+    hits = [len(np.intersect1d(f, t)) for f, t in zip(found, truth)]
+    return np.sum(hits) / float(np.size(truth))
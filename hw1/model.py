@@ -0,0 +1,715 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+# Networks shared by the hw1 PASCAL scripts. Layers are created in the same
+# order (and so get the same default tf.layers names) as the per-script
+# cnn_model_fn bodies they replace, so existing checkpoints still load.
+import importlib
+import os.path as osp
+from functools import partial
+
+import tensorflow as tf
+from tensorflow.python import pywrap_tensorflow
+from tensorflow.python.client import device_lib
+
+import pascal_input
+
+MODEL_INPUT = 'model_input'
+IS_TRAINING = 'is_training'
+OUTPUT = 'sigmoid_tensor'
+# summaries that cost real time per step (images, histograms); they are also
+# in tf.GraphKeys.SUMMARIES, train_hooks.SummaryPolicy throttles them
+EXPENSIVE_SUMMARIES = 'expensive_summaries'
+
+# convolutions per VGG block, for each supported depth
+VGG_BLOCKS = {
+    11: (1, 1, 2, 2, 2),
+    13: (2, 2, 2, 2, 2),
+    16: (2, 2, 3, 3, 3),
+    19: (2, 2, 4, 4, 4),
+}
+VGG_FILTERS = (64, 128, 256, 512, 512)
+
+# compute types of model_fn(precision=...); variables always stay float32
+PRECISIONS = {
+    'float32': tf.float32,
+    'float16': tf.float16,
+    'bfloat16': tf.bfloat16,
+}
+# dynamic loss scaling: start high, halve on overflow, double after a run of
+# finite steps
+INITIAL_LOSS_SCALE = 2.0 ** 15
+LOSS_SCALE_PERIOD = 2000
+
+
+def training_flag(mode):
+    """
+    Dropout switch of a model function.
+    In TRAIN mode this is a boolean tensor that defaults to True, which
+    train_eval.MAPEvalHook feeds with False while it evaluates inside the
+    training session. Other modes get a plain python bool.
+    Args:
+        mode (str): tf.estimator.ModeKeys value passed to the model function.
+    Returns:
+        training (tf.Tensor or bool): Value for the `training` argument of
+            tf.layers.dropout.
+    """
+    if mode != tf.estimator.ModeKeys.TRAIN:
+        return False
+    return tf.placeholder_with_default(True, [], name=IS_TRAINING)
+
+
+def model_input(images):
+    """
+    Name the (augmented, normalized) batch that enters the first layer.
+    The batch dimension is relaxed to None, so MAPEvalHook can feed eval
+    batches of any size in place of the training batch. Feeding this tensor
+    skips the input pipeline, augmentation and mixup.
+    Args:
+        images (tf.Tensor): float32 batch of shape (N, H, W, 3).
+    Returns:
+        images (tf.Tensor): The same batch under the name MODEL_INPUT.
+    """
+    shape = [None] + images.shape.as_list()[1:]
+    return tf.placeholder_with_default(images, shape, name=MODEL_INPUT)
+
+
+def _width(filters, width):
+    return max(1, int(round(filters * width)))
+
+
+def channels_first_supported():
+    """
+    Whether this TensorFlow build can run the networks in NCHW.
+    Stock CPU builds only have NHWC conv/pool kernels; channels_first needs
+    an MKL-DNN build or a GPU.
+    """
+    is_mkl = getattr(pywrap_tensorflow, 'IsMklEnabled', None)
+    if is_mkl is not None and is_mkl():
+        return True
+    return any(d.device_type == 'GPU'
+               for d in device_lib.list_local_devices())
+
+
+def _channels_first(inputs, data_format):
+    """Transpose an NHWC batch to NCHW if the network runs channels_first."""
+    if data_format == 'channels_first':
+        return tf.transpose(inputs, [0, 3, 1, 2])
+    return inputs
+
+
+def _channels_last(inputs, data_format):
+    """
+    NHWC view of a channels_first activation. End points and flattened
+    features always come out in NHWC order, so dense kernels, pretrained
+    initializers and stored features do not depend on the layout.
+    """
+    if data_format == 'channels_first' and inputs.shape.ndims == 4:
+        return tf.transpose(inputs, [0, 2, 3, 1])
+    return inputs
+
+
+def _flatten(inputs, data_format='channels_last'):
+    inputs = _channels_last(inputs, data_format)
+    return tf.reshape(inputs, [-1, inputs.shape[1:].num_elements()])
+
+
+def scratch_net(inputs, training, num_classes=20, width=1.0,
+                data_format='channels_last'):
+    """
+    The two-layer network of 01_pascal.py.
+    Args:
+        inputs (tf.Tensor): float32 batch of shape (N, H, W, 3).
+        training (tf.Tensor or bool): Dropout switch, see training_flag.
+        num_classes (int): Number of outputs.
+        width (float): Multiplier on the number of filters and units.
+        data_format (str): Layout of the convolutions, "channels_last" (NHWC)
+            or "channels_first" (NCHW). Inputs are always NHWC.
+    Returns:
+        logits (tf.Tensor): Shape (N, num_classes).
+        end_points (dict): Intermediate activations by layer name.
+    """
+    end_points = {}
+    net = _channels_first(inputs, data_format)
+    for i, filters in enumerate((32, 64)):
+        net = tf.layers.conv2d(
+            inputs=net,
+            filters=_width(filters, width),
+            kernel_size=[5, 5],
+            padding="same",
+            activation=tf.nn.relu,
+            data_format=data_format)
+        end_points['conv%d' % (i + 1)] = _channels_last(net, data_format)
+        net = tf.layers.max_pooling2d(inputs=net, pool_size=[2, 2], strides=2,
+                                      data_format=data_format)
+        end_points['pool%d' % (i + 1)] = _channels_last(net, data_format)
+
+    net = tf.layers.dense(inputs=_flatten(net, data_format),
+                          units=_width(1024, width),
+                          activation=tf.nn.relu)
+    end_points['fc3'] = net
+    net = tf.layers.dropout(inputs=net, rate=0.4, training=training)
+    logits = tf.layers.dense(inputs=net, units=num_classes)
+    return logits, end_points
+
+
+def alexnet(inputs, training, num_classes=20, width=1.0,
+            data_format='channels_last'):
+    """
+    AlexNet of 02_pascal_alexnet.py (conv4 and conv5 without ReLU, as in
+    the original scripts).
+    Args:
+        inputs (tf.Tensor): float32 batch of shape (N, 224, 224, 3).
+        training (tf.Tensor or bool): Dropout switch, see training_flag.
+        num_classes (int): Number of outputs.
+        width (float): Multiplier on the number of filters and units.
+        data_format (str): Layout of the convolutions, "channels_last" (NHWC)
+            or "channels_first" (NCHW). Inputs are always NHWC.
+    Returns:
+        logits (tf.Tensor): Shape (N, num_classes).
+        end_points (dict): Intermediate activations; "pool5" is the last
+            pooling layer and "fc7" the second fully connected layer.
+    """
+    conv_init = tf.random_normal_initializer(0, 0.01)
+    fc_init = tf.random_normal_initializer(0, 0.005)
+    end_points = {}
+
+    def conv(net, name, filters, kernel, strides=1, padding="same",
+             activation=tf.nn.relu):
+        net = tf.layers.conv2d(
+            inputs=net,
+            filters=_width(filters, width),
+            kernel_size=[kernel, kernel],
+            strides=[strides, strides],
+            padding=padding,
+            activation=activation,
+            kernel_initializer=conv_init,
+            bias_initializer=tf.zeros_initializer(),
+            data_format=data_format)
+        end_points[name] = _channels_last(net, data_format)
+        return net
+
+    def pool(net, name):
+        net = tf.layers.max_pooling2d(inputs=net, pool_size=[3, 3], strides=2,
+                                      data_format=data_format)
+        end_points[name] = _channels_last(net, data_format)
+        return net
+
+    net = _channels_first(inputs, data_format)
+    net = conv(net, 'conv1', 96, 11, strides=4, padding="valid")
+    net = pool(net, 'pool1')
+    net = conv(net, 'conv2', 256, 5)
+    net = pool(net, 'pool2')
+    net = conv(net, 'conv3', 384, 3)
+    net = conv(net, 'conv4', 384, 3, activation=None)
+    net = conv(net, 'conv5', 256, 3, activation=None)
+    net = pool(net, 'pool5')
+
+    net = _flatten(net, data_format)
+    for name in ('fc6', 'fc7'):
+        net = tf.layers.dense(inputs=net, units=_width(4096, width),
+                              activation=tf.nn.relu,
+                              kernel_initializer=fc_init,
+                              bias_initializer=tf.zeros_initializer())
+        end_points[name] = net
+        net = tf.layers.dropout(inputs=net, rate=0.5, training=training)
+
+    logits = tf.layers.dense(inputs=net, units=num_classes,
+                             kernel_initializer=conv_init,
+                             bias_initializer=tf.zeros_initializer())
+    return logits, end_points
+
+
+def _vgg_initializers(reader, name):
+    """Constant (kernel, bias) initializers from a vgg_16 checkpoint."""
+    if reader is None:
+        return None, None
+    return (tf.constant_initializer(reader.get_tensor(name + '/weights')),
+            tf.constant_initializer(reader.get_tensor(name + '/biases')))
+
+
+def vgg(inputs, training, num_classes=20, depth=16, width=1.0, fc_conv=True,
+        relu_logits=False, pretrained=None, data_format='channels_last'):
+    """
+    VGG network of 03_pascal_vgg16*.py and 04_pascal_vgg16_finetune*.py.
+    Args:
+        inputs (tf.Tensor): float32 batch of shape (N, 224, 224, 3).
+        training (tf.Tensor or bool): Dropout switch, see training_flag.
+        num_classes (int): Number of outputs.
+        depth (int): 11, 13, 16 or 19 weight layers.
+        width (float): Multiplier on the number of filters and units.
+        data_format (str): Layout of the convolutions, "channels_last" (NHWC)
+            or "channels_first" (NCHW). Inputs are always NHWC.
+        fc_conv (bool): Build fc6/fc7 as 7x7 and 1x1 convolutions (the
+            *_final scripts, laid out like the vgg_16 checkpoint) instead of
+            dense layers on the flattened pool5.
+        relu_logits (bool): Apply ReLU to the logits, as the non-final
+            scripts did.
+        pretrained (str): vgg_16 checkpoint to initialize every layer but the
+            logits from through constant initializers (04_pascal_vgg16_
+            finetune.py). Needs depth 16 and width 1.
+        data_format (str): Layout of the convolutions, "channels_last" (NHWC)
+            or "channels_first" (NCHW). Inputs are always NHWC. Conv kernels
+            are stored HWIO either way, so vgg16_var_map and pretrained
+            checkpoints work with both.
+    Returns:
+        logits (tf.Tensor): Shape (N, num_classes).
+        end_points (dict): Intermediate activations by layer name ("conv3_2",
+            "pool5", "fc7", ...).
+    """
+    reader = None
+    if pretrained is not None:
+        reader = pywrap_tensorflow.NewCheckpointReader(pretrained)
+    end_points = {}
+
+    net = _channels_first(inputs, data_format)
+    for block, (num_convs, filters) in enumerate(
+            zip(VGG_BLOCKS[depth], VGG_FILTERS)):
+        for i in range(num_convs):
+            name = 'conv%d_%d' % (block + 1, i + 1)
+            k_init, b_init = _vgg_initializers(
+                reader, 'vgg_16/conv%d/%s' % (block + 1, name))
+            net = tf.layers.conv2d(
+                inputs=net,
+                filters=_width(filters, width),
+                kernel_size=[3, 3],
+                strides=[1, 1],
+                padding="same",
+                activation=tf.nn.relu,
+                kernel_initializer=k_init,
+                bias_initializer=b_init or tf.zeros_initializer(),
+                data_format=data_format)
+            end_points[name] = _channels_last(net, data_format)
+        net = tf.layers.max_pooling2d(inputs=net, pool_size=[2, 2], strides=2,
+                                      data_format=data_format)
+        end_points['pool%d' % (block + 1)] = _channels_last(net, data_format)
+
+    # fc6 covers all of pool5 (7x7 for 224 inputs), fc7 is 1x1
+    height = net.shape[2 if data_format == 'channels_first' else 1].value
+    kernels = {'fc6': height, 'fc7': 1}
+    if not fc_conv:
+        net = _flatten(net, data_format)
+    for name in ('fc6', 'fc7'):
+        k_init, b_init = _vgg_initializers(reader, 'vgg_16/' + name)
+        if fc_conv:
+            net = tf.layers.conv2d(
+                inputs=net,
+                filters=_width(4096, width),
+                strides=1,
+                kernel_size=[kernels[name], kernels[name]],
+                padding="valid",
+                activation=tf.nn.relu,
+                use_bias=True,
+                kernel_initializer=k_init,
+                bias_initializer=b_init or tf.zeros_initializer(),
+                data_format=data_format)
+        else:
+            net = tf.layers.dense(
+                inputs=net, units=_width(4096, width),
+                activation=tf.nn.relu,
+                kernel_initializer=k_init,
+                bias_initializer=b_init or tf.zeros_initializer())
+        end_points[name] = _channels_last(net, data_format)
+        net = tf.layers.dropout(inputs=net, rate=0.5, training=training)
+
+    logits = tf.layers.dense(
+        inputs=_flatten(net, data_format), units=num_classes,
+        activation=tf.nn.relu if relu_logits else None)
+    return logits, end_points
+
+
+def head_net(inputs, training, layer='fc7', num_classes=20, width=1.0,
+             relu_logits=False, pretrained=None):
+    """
+    The layers of alexnet/vgg above a cached feature layer, for training on
+    frozen-backbone features (see feature_cache.py).
+    Args:
+        inputs (tf.Tensor): Flattened (NHWC order) features of shape (N, D).
+        training (tf.Tensor or bool): Dropout switch, see training_flag.
+        layer (str): "pool5" to rebuild fc6, fc7 and the logits, or "fc7"
+            for the logits only.
+        num_classes (int): Number of outputs.
+        width (float): Multiplier on the number of fc units.
+        relu_logits (bool): Apply ReLU to the logits, as vgg.
+        pretrained (str): vgg_16 checkpoint to initialize fc6/fc7 from
+            (layer "pool5" only); dense kernels take the conv kernels of the
+            checkpoint in flattened form.
+    Returns:
+        logits (tf.Tensor): Shape (N, num_classes).
+        end_points (dict): "fc6" and "fc7" for layer "pool5".
+    """
+    end_points = {}
+    net = inputs
+    if layer == 'pool5':
+        reader = None
+        if pretrained is not None:
+            reader = pywrap_tensorflow.NewCheckpointReader(pretrained)
+        for name in ('fc6', 'fc7'):
+            k_init, b_init = _vgg_initializers(reader, 'vgg_16/' + name)
+            net = tf.layers.dense(
+                inputs=net, units=_width(4096, width),
+                activation=tf.nn.relu,
+                kernel_initializer=k_init,
+                bias_initializer=b_init or tf.zeros_initializer())
+            end_points[name] = net
+            net = tf.layers.dropout(inputs=net, rate=0.5, training=training)
+    else:
+        # fc7 is cached before its dropout
+        net = tf.layers.dropout(inputs=net, rate=0.5, training=training)
+    logits = tf.layers.dense(
+        inputs=net, units=num_classes,
+        activation=tf.nn.relu if relu_logits else None)
+    return logits, end_points
+
+
+NETWORKS = {
+    'scratch': scratch_net,
+    'alexnet': alexnet,
+    'vgg': vgg,
+}
+
+
+def vgg16_var_map():
+    """
+    Map vgg_16 checkpoint names to the variables of vgg(fc_conv=True).
+    """
+    var_map = {}
+    layer = 0
+    for block, num_convs in enumerate(VGG_BLOCKS[16]):
+        for i in range(num_convs):
+            scope = 'vgg_16/conv%d/conv%d_%d/' % (block + 1, block + 1, i + 1)
+            var_map.update(_layer_map(scope, layer))
+            layer += 1
+    for name in ('fc6', 'fc7'):
+        var_map.update(_layer_map('vgg_16/%s/' % name, layer))
+        layer += 1
+    return var_map
+
+
+def _layer_map(scope, layer):
+    prefix = 'conv2d' if layer == 0 else 'conv2d_%d' % layer
+    return {scope + 'weights': prefix + '/kernel',
+            scope + 'biases': prefix + '/bias'}
+
+
+class LoadHook(tf.train.SessionRunHook):
+    '''define load pretrain model hook'''
+    def __init__(self, checkpoint_path, var_map=None):
+        self.checkpoint_path = checkpoint_path
+        self.var_map = var_map if var_map is not None else vgg16_var_map()
+
+    def begin(self):
+        tf.contrib.framework.init_from_checkpoint(
+            self.checkpoint_path, self.var_map)
+
+
+MIXUP_MODES = ('halves', 'shuffle')
+
+
+def _mixup(inputs, labels, mode='halves', alpha=1.0):
+    """
+    Mix pairs of images and their labels.
+    Args:
+        inputs (tf.Tensor): float32 batch of shape (N, H, W, C).
+        labels (tf.Tensor): Shape (N, num_classes) labels.
+        mode (str): "halves" blends the first half of the batch into the
+            second half with one uniform lambda (the original 06 scripts),
+            which returns N / 2 samples. "shuffle" pairs every sample with a
+            partner from a shuffled copy of the batch and draws one
+            Beta(alpha, alpha) lambda per sample, keeping all N samples.
+        alpha (float): Beta parameter of the "shuffle" lambdas.
+    Returns:
+        inputs (tf.Tensor): The mixed batch.
+        labels (tf.Tensor): The mixed float32 labels.
+    """
+    labels = tf.cast(labels, tf.float32)
+    if mode == 'halves':
+        bs = tf.shape(inputs)[0] // 2
+        lam = tf.random_uniform([1], dtype=tf.float32)
+        x = inputs[:bs] * lam + inputs[bs:2 * bs] * (1 - lam)
+        y = labels[:bs] * lam + labels[bs:2 * bs] * (1 - lam)
+        return x, y
+
+    n = tf.shape(inputs)[0]
+    partner = tf.random_shuffle(tf.range(n))
+    # Beta(alpha, alpha) as a ratio of two Gamma(alpha) draws
+    g1 = tf.random_gamma([n], alpha)
+    g2 = tf.random_gamma([n], alpha)
+    lam = g1 / (g1 + g2)
+    x_lam = tf.reshape(lam, [-1, 1, 1, 1])
+    x = inputs * x_lam + tf.gather(inputs, partner) * (1 - x_lam)
+    y_lam = lam[:, None]
+    y = labels * y_lam + tf.gather(labels, partner) * (1 - y_lam)
+    return x, y
+
+
+def _master_weights_getter(getter, *args, **kwargs):
+    """
+    Variable getter for reduced precision layers: the variable is created in
+    float32 (so the optimizer, checkpoints and LoadHook see float32 master
+    weights under the usual names) and the layer gets a cast copy.
+    """
+    dtype = kwargs.get('dtype')
+    if dtype in (tf.float16, tf.bfloat16):
+        kwargs['dtype'] = tf.float32
+        return tf.cast(getter(*args, **kwargs), dtype)
+    return getter(*args, **kwargs)
+
+
+def _loss_scaled_gradients(loss, loss_scale):
+    """
+    Gradients of the trainable variables through a scaled loss.
+    float16 gradients underflow for small values; scaling the loss up before
+    differentiation and the gradients back down afterwards keeps them
+    representable. A step whose gradients overflow gets zero gradients.
+    Args:
+        loss (tf.Tensor): float32 scalar loss.
+        loss_scale (float or str): Fixed scale, or "dynamic" to start at
+            INITIAL_LOSS_SCALE, halve it after every overflow and double it
+            after LOSS_SCALE_PERIOD finite steps.
+    Returns:
+        grads_and_vars (list): Unscaled (gradient, variable) pairs.
+        finite (tf.Tensor): Boolean, whether every gradient was finite.
+        update (tf.Operation): Adjusts the dynamic loss scale, or None.
+    """
+    var_list = tf.trainable_variables()
+    if loss_scale == 'dynamic':
+        scale = tf.get_variable(
+            'loss_scale', initializer=INITIAL_LOSS_SCALE, trainable=False)
+        good_steps = tf.get_variable(
+            'loss_scale_good_steps', initializer=0, trainable=False)
+    else:
+        scale = tf.constant(float(loss_scale))
+
+    grads = tf.gradients(loss * scale, var_list)
+    # variables the loss does not reach keep a None gradient, as in
+    # Optimizer.compute_gradients; apply_gradients skips them
+    present = [i for i, g in enumerate(grads) if g is not None]
+    scaled = [grads[i] / scale for i in present]
+    finite = tf.reduce_all(
+        tf.stack([tf.constant(True)] +
+                 [tf.reduce_all(tf.is_finite(g)) for g in scaled]))
+    scaled = [tf.where(finite, g, tf.zeros_like(g)) for g in scaled]
+    grads = [None] * len(var_list)
+    for i, g in zip(present, scaled):
+        grads[i] = g
+    grads_and_vars = list(zip(grads, var_list))
+    if loss_scale != 'dynamic':
+        return grads_and_vars, finite, None
+
+    grow = tf.logical_and(finite, good_steps + 1 >= LOSS_SCALE_PERIOD)
+    new_scale = tf.where(
+        finite, tf.where(grow, scale * 2, scale), tf.maximum(scale / 2, 1.0))
+    new_good_steps = tf.where(
+        tf.logical_and(finite, tf.logical_not(grow)),
+        good_steps + 1, tf.zeros_like(good_steps))
+    tf.summary.scalar("loss scale", scale)
+    update = tf.group(scale.assign(new_scale),
+                      good_steps.assign(new_good_steps))
+    return grads_and_vars, finite, update
+
+
+def model_fn(features, labels, mode, arch='alexnet', num_classes=20,
+             image_size=256, crop_size=224, mean=None, scale=False,
+             augment=None, mixup=False, mixup_alpha=1.0, tta=False,
+             endpoints=(),
+             learning_rate=0.001, decay_steps=10000, decay_rate=0.5,
+             momentum=0.9, summaries=False, grad_summaries=False,
+             data_format='channels_last', precision='float32',
+             loss_scale='dynamic', net_params=None):
+    """
+    Estimator model function shared by the hw1 PASCAL scripts.
+    Args:
+        features (dict): "x" holds the images, uint8 or already normalized.
+        labels (tf.Tensor): Shape (N, num_classes) labels.
+        mode (str): tf.estimator.ModeKeys value.
+        arch (str): Key of NETWORKS.
+        num_classes (int): Number of outputs.
+        image_size (int): Side of the training (and 10-crop eval) images.
+        crop_size (int): Side of the crops the network sees, or None to use
+            the full image_size images everywhere.
+        mean (list): Per-channel mean for uint8 inputs, see normalize_input.
+        scale (bool): Scale uint8 inputs to [-1, 1], see normalize_input.
+        augment (dict): Keyword arguments of pascal_input.augment_batch for
+            training (random crop/flip plus the given jitter), or None.
+        mixup (str): Train on mixed pairs of images and labels, with a mode
+            of MIXUP_MODES (True means "halves"), or False.
+        mixup_alpha (float): Beta parameter of the "shuffle" mixup.
+        tta (bool): Predict on 10 crops per image and average them.
+        endpoints (tuple): Names of end points to add to the predictions.
+        learning_rate (float): Initial learning rate.
+        decay_steps (int): Halving period of exponential_decay, or None for a
+            constant learning rate.
+        decay_rate (float): Factor applied every decay_steps.
+        momentum (float): Momentum, or None for plain gradient descent.
+        summaries (bool): Log the learning rate and a few input images.
+        grad_summaries (bool): Log a gradient histogram per variable.
+        data_format (str): "channels_last" or "channels_first" convolutions;
+            the input pipeline and model_input stay NHWC either way.
+        precision (str): Key of PRECISIONS. float16 and bfloat16 run the
+            network in that type on float32 master weights; the loss and the
+            outputs stay float32. bfloat16 needs hardware with bfloat16
+            convolutions.
+        loss_scale (float or str): Loss scaling of float16 training, see
+            _loss_scaled_gradients, or None to disable it.
+        net_params (dict): Extra keyword arguments of the network builder.
+    Returns:
+        spec (tf.estimator.EstimatorSpec): Spec for the given mode.
+    """
+    train = mode == tf.estimator.ModeKeys.TRAIN
+    training = training_flag(mode)
+    if crop_size is None or train or tta:
+        side = image_size
+    else:
+        side = crop_size
+    input_layer = tf.reshape(features["x"], [-1, side, side, 3])
+    input_layer = pascal_input.normalize_input(
+        input_layer, mean=mean, scale=scale)
+    if tta and not train:
+        input_layer = pascal_input.ten_crop(input_layer, crop_size)
+
+    #data augmentation
+    if train:
+        if augment is not None:
+            input_layer = pascal_input.augment_batch(
+                input_layer, crop_size, **augment)
+        if mixup:
+            input_layer, labels = _mixup(
+                input_layer, labels,
+                mode='halves' if mixup is True else mixup, alpha=mixup_alpha)
+        input_layer = model_input(input_layer)
+
+    build_network = partial(
+        NETWORKS[arch], training=training, num_classes=num_classes,
+        data_format=data_format, **(net_params or {}))
+    if precision == 'float32':
+        logits, end_points = build_network(input_layer)
+    else:
+        with tf.variable_scope(tf.get_variable_scope(),
+                               custom_getter=_master_weights_getter):
+            logits, end_points = build_network(
+                tf.cast(input_layer, PRECISIONS[precision]))
+        logits = tf.cast(logits, tf.float32)
+
+    probabilities = tf.nn.sigmoid(logits)
+    if tta and not train:
+        # average the 10 crops of every image
+        probabilities = pascal_input.merge_crops(probabilities)
+        logits = pascal_input.merge_crops(logits)
+
+    extra_predictions = dict(
+        (name, tf.cast(end_points[name], tf.float32)) for name in endpoints)
+    return estimator_spec(
+        mode, logits, labels, probabilities, extra_predictions,
+        images=input_layer, learning_rate=learning_rate,
+        decay_steps=decay_steps, decay_rate=decay_rate, momentum=momentum,
+        summaries=summaries, grad_summaries=grad_summaries,
+        precision=precision, loss_scale=loss_scale)
+
+
+def estimator_spec(mode, logits, labels, probabilities, extra_predictions=None,
+                   images=None, learning_rate=0.001, decay_steps=10000,
+                   decay_rate=0.5, momentum=0.9, summaries=False,
+                   grad_summaries=False, precision='float32',
+                   loss_scale='dynamic'):
+    """
+    Predictions, sigmoid cross-entropy loss and training op of a multi-label
+    classifier, shared by model_fn and feature_cache.head_model_fn.
+    Args:
+        mode (str): tf.estimator.ModeKeys value.
+        logits (tf.Tensor): float32 logits of shape (N, num_classes).
+        labels (tf.Tensor): Shape (N, num_classes) labels.
+        probabilities (tf.Tensor): Sigmoid of the logits.
+        extra_predictions (dict): More tensors to return from predict().
+        images (tf.Tensor): Input batch for the image summary, or None.
+        learning_rate, decay_steps, decay_rate, momentum, summaries,
+        grad_summaries, precision, loss_scale: As for model_fn.
+    Returns:
+        spec (tf.estimator.EstimatorSpec): Spec for the given mode.
+    """
+    predictions = {
+        # Generate predictions (for PREDICT and EVAL mode)
+        "classes": tf.argmax(input=logits, axis=1),
+        # Add `sigmoid_tensor` to the graph. It is used for PREDICT, by the
+        # `logging_hook` and by MAPEvalHook.
+        "probabilities": tf.identity(probabilities, name=OUTPUT)
+    }
+    predictions.update(extra_predictions or {})
+
+    if mode == tf.estimator.ModeKeys.PREDICT:
+        return tf.estimator.EstimatorSpec(mode=mode, predictions=predictions)
+
+    # Calculate Loss (for both TRAIN and EVAL modes)
+    loss = tf.identity(tf.losses.sigmoid_cross_entropy(
+        multi_class_labels=labels, logits=logits), name='loss')
+
+    # Configure the Training Op (for TRAIN mode)
+    if mode == tf.estimator.ModeKeys.TRAIN:
+        global_step = tf.train.get_global_step()
+        lr = learning_rate
+        if decay_steps is not None:
+            lr = tf.train.exponential_decay(
+                learning_rate, global_step, decay_steps, decay_rate)
+        step_lr = lr
+        update_scale = None
+        if precision == 'float16' and loss_scale is not None:
+            grads_and_vars, finite, update_scale = _loss_scaled_gradients(
+                loss, loss_scale)
+            # overflowing steps leave the weights alone (momentum only decays)
+            step_lr = lr * tf.cast(finite, tf.float32)
+        if momentum is not None:
+            optimizer = tf.train.MomentumOptimizer(
+                learning_rate=step_lr, momentum=momentum)
+        else:
+            optimizer = tf.train.GradientDescentOptimizer(
+                learning_rate=step_lr)
+
+        if update_scale is None:
+            grads_and_vars = optimizer.compute_gradients(loss)
+        if summaries:
+            tf.summary.scalar("learning rate", lr)
+            if images is not None:
+                tf.summary.image(
+                    "input image", images[:3, :, :, :],
+                    collections=[tf.GraphKeys.SUMMARIES, EXPENSIVE_SUMMARIES])
+        if grad_summaries:
+            for g, v in grads_and_vars:
+                if g is not None:
+                    tf.summary.histogram(
+                        "{}/grad_histogram".format(v.name), g,
+                        collections=[tf.GraphKeys.SUMMARIES,
+                                     EXPENSIVE_SUMMARIES])
+
+        train_op = optimizer.apply_gradients(
+            grads_and_vars, global_step=global_step)
+        if update_scale is not None:
+            train_op = tf.group(train_op, update_scale)
+        return tf.estimator.EstimatorSpec(
+            mode=mode, loss=loss, train_op=train_op)
+
+    # Add evaluation metrics (for EVAL mode)
+    eval_metric_ops = {
+        "accuracy": tf.metrics.accuracy(
+            labels=labels, predictions=predictions["classes"])}
+    return tf.estimator.EstimatorSpec(
+        mode=mode, loss=loss, eval_metric_ops=eval_metric_ops)
+
+
+def script_model_params(script):
+    """
+    MODEL_PARAMS of a hw1 training script, for tools that rebuild its
+    network outside the script (checkpoint probes, inference, serving).
+    Args:
+        script (str): Script name or path, e.g. "03_pascal_vgg16" or
+            "hw1/03_pascal_vgg16.py"; it is imported from this directory.
+    Returns:
+        model_params (dict): A copy of the script's model_fn keyword
+            arguments (arch, image_size, crop_size, mean, scale,
+            net_params, ...).
+    """
+    name = osp.splitext(osp.basename(script))[0]
+    module = importlib.import_module(name)
+    if not hasattr(module, 'MODEL_PARAMS'):
+        raise ValueError('{} defines no MODEL_PARAMS'.format(script))
+    return dict(module.MODEL_PARAMS)
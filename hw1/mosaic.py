@@ -0,0 +1,115 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+# Filter and activation mosaics in NumPy. Kernels are read straight from
+# checkpoints with NewCheckpointReader (no graph, no session), and a whole
+# stack of mosaics, e.g. the conv1 filters of every checkpoint of a run, is
+# tiled with one pad, one reshape and one transpose.
+import re
+
+import matplotlib.pyplot as plt
+import numpy as np
+import tensorflow as tf
+
+
+def tile(images, cols=None, pad=1, pad_value=0.):
+    """
+    Tile batches of equally sized images into grids.
+    Args:
+        images (np.ndarray): Shape (B, N, H, W, C): B grids of N tiles.
+        cols (int): Tiles per grid row, None for a square-ish grid.
+        pad (int): Border added around every tile.
+        pad_value (float): Value of the border and of empty grid cells.
+    Returns:
+        grids (np.ndarray): Shape (B, rows * (H + 2 pad),
+            cols * (W + 2 pad), C).
+    """
+    b, n, h, w, c = images.shape
+    if cols is None:
+        cols = int(np.ceil(np.sqrt(n)))
+    rows = -(-n // cols)
+    images = np.pad(
+        images, ((0, 0), (0, rows * cols - n), (pad, pad), (pad, pad),
+                 (0, 0)), mode='constant', constant_values=pad_value)
+    h, w = h + 2 * pad, w + 2 * pad
+    grids = images.reshape(b, rows, cols, h, w, c).transpose(0, 1, 3, 2, 4, 5)
+    return grids.reshape(b, rows * h, cols * w, c)
+
+
+def _to_uint8(x):
+    """Min-max scale every leading entry of x to [0, 255] uint8."""
+    axes = tuple(range(1, x.ndim))
+    x_min = x.min(axis=axes, keepdims=True)
+    x_max = x.max(axis=axes, keepdims=True)
+    x = (x - x_min) / np.maximum(x_max - x_min, 1e-12)
+    return (x * 255).astype(np.uint8)
+
+
+def filter_mosaics(kernels, cols=None, pad=1):
+    """
+    One image of all filters per kernel.
+    Args:
+        kernels (np.ndarray): Shape (T, size, size, channels, num_filters),
+            e.g. conv1 kernels of T checkpoints; channels is 3 for RGB
+            input filters or 1.
+        cols (int): Filters per mosaic row, see tile.
+        pad (int): Border between filters.
+    Returns:
+        mosaics (np.ndarray): uint8 images of shape (T, H, W, channels),
+            each min-max scaled on its own.
+    """
+    tiles = np.transpose(kernels, (0, 4, 1, 2, 3))
+    return tile(_to_uint8(tiles), cols, pad)
+
+
+def activation_mosaics(activations, cols=None, pad=1):
+    """
+    One grayscale image of all channels per feature map.
+    Args:
+        activations (np.ndarray): Shape (B, H, W, C), e.g. conv1 endpoints
+            of B images.
+        cols (int): Channels per mosaic row, see tile.
+        pad (int): Border between channels.
+    Returns:
+        mosaics (np.ndarray): uint8 images of shape (B, H', W', 1), each
+            min-max scaled on its own.
+    """
+    tiles = np.transpose(activations, (0, 3, 1, 2))[..., None]
+    return tile(_to_uint8(tiles), cols, pad, pad_value=255)
+
+
+def checkpoint_history(model_dir):
+    """
+    Checkpoints of a model directory that are still on disk, oldest first.
+    Returns:
+        checkpoints (list): Checkpoint prefixes.
+        steps (list): Global step of every checkpoint.
+    """
+    state = tf.train.get_checkpoint_state(model_dir)
+    checkpoints = list(state.all_model_checkpoint_paths) if state else []
+    steps = [int(re.search(r'-(\d+)$', c).group(1)) for c in checkpoints]
+    return checkpoints, steps
+
+
+def read_kernels(checkpoints, name='conv2d/kernel'):
+    """
+    Stack one variable of several checkpoints.
+    Args:
+        checkpoints (list): Checkpoint prefixes.
+        name (str): Variable name, e.g. "conv2d/kernel" for conv1.
+    Returns:
+        kernels (np.ndarray): Shape (len(checkpoints),) + variable shape.
+    """
+    return np.stack([tf.train.NewCheckpointReader(c).get_tensor(name)
+                     for c in checkpoints])
+
+
+def save_mosaics(mosaics, paths):
+    """Write every mosaic of a stack to its path."""
+    for m, path in zip(mosaics, paths):
+        if m.shape[-1] == 1:
+            plt.imsave(path, m[..., 0], cmap='gray')
+        else:
+            plt.imsave(path, m)
+        print('saved {} mosaic to {}'.format(m.shape[:2], path))
@@ -0,0 +1,403 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import argparse
+import hashlib
+import json
+import multiprocessing
+import os
+import os.path as osp
+import shutil
+import time
+
+import numpy as np
+import scipy.misc as sci
+
+CLASS_NAMES = [
+    'aeroplane',
+    'bicycle',
+    'bird',
+    'boat',
+    'bottle',
+    'bus',
+    'car',
+    'cat',
+    'chair',
+    'cow',
+    'diningtable',
+    'dog',
+    'horse',
+    'motorbike',
+    'person',
+    'pottedplant',
+    'sheep',
+    'sofa',
+    'train',
+    'tvmonitor',
+]
+
+MEAN_VALUE = [123, 116, 103]
+
+
+def read_image_ids(data_dir, split):
+    """
+    Read the image ids listed in ImageSets/Main/<split>.txt.
+    Args:
+        data_dir (str): Path to the VOC2007 directory.
+        split (str): train/val/trainval/test split to use.
+    Returns:
+        ids (list): Image ids (str) in file order.
+    """
+    label_path = data_dir + 'ImageSets/Main/' + split + '.txt'
+    with open(label_path, 'r') as f:
+        return [line.split()[0] for line in f if line.strip()]
+
+
+def _decode_image(job):
+    """Decode, resize and (optionally) center-crop one image to uint8."""
+    img_name, image_size, crop_size = job
+    img = sci.imread(img_name, mode='RGB')
+    img = sci.imresize(img, (image_size, image_size, 3))
+    if crop_size is not None:
+        margin = (image_size - crop_size) // 2
+        img = img[margin:crop_size+margin, margin:crop_size+margin, :]
+    return img
+
+
+def decode_images(img_paths, out, image_size, crop_size=None,
+                  num_workers=None, progress_every=1000):
+    """
+    Decode a list of JPEGs into a preallocated array with a process pool.
+    Args:
+        img_paths (list): Paths of the images to decode.
+        out (np.ndarray): Array of shape (N, S, S, 3) to fill in place, where
+            S is crop_size (or image_size if crop_size is None).
+        image_size (int): Side every image is resized to.
+        crop_size (int): Side of the center crop, None to keep the full image.
+        num_workers (int): Decoder processes, None for one per CPU and
+            0 or 1 to decode in the calling process.
+        progress_every (int): Print progress every this many images.
+    Returns:
+        out (np.ndarray): The filled array.
+    """
+    if num_workers is None:
+        num_workers = multiprocessing.cpu_count()
+    jobs = [(p, image_size, crop_size) for p in img_paths]
+    start = time.time()
+
+    pool = None
+    if num_workers > 1:
+        pool = multiprocessing.Pool(num_workers)
+        chunksize = max(1, len(jobs) // (num_workers * 16))
+        results = pool.imap(_decode_image, jobs, chunksize=chunksize)
+    else:
+        results = (_decode_image(job) for job in jobs)
+
+    try:
+        for i, img in enumerate(results):
+            out[i] = img
+            if progress_every and (i + 1) % progress_every == 0:
+                print('decoded {}/{} images ({:.1f} img/s)'.format(
+                    i + 1, len(jobs), (i + 1) / (time.time() - start)))
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    print('decoded {} images in {:.1f}s with {} workers'.format(
+        len(jobs), time.time() - start, max(num_workers, 1)))
+    return out
+
+
+def read_gt_matrix(data_dir, split, ids):
+    """
+    Parse every per-class ImageSets file of a split into one matrix.
+    Rows are aligned by image id rather than by line position, so the class
+    files may list images in any order.
+    Args:
+        data_dir (str): Path to the VOC2007 directory.
+        split (str): train/val/trainval/test split to use.
+        ids (list): Image ids defining the row order.
+    Returns:
+        gt (np.ndarray): (N, 20) np.int8 array of raw VOC labels
+            (1 present, 0 difficult, -1 absent).
+    """
+    label_dir = data_dir + 'ImageSets/Main/'
+    cols = [np.loadtxt(label_dir + c + '_' + split + '.txt', dtype=str,
+                       ndmin=2) for c in CLASS_NAMES]
+    cls_ids = np.concatenate([col[:, 0] for col in cols])
+    cls_vals = np.concatenate([col[:, 1] for col in cols]).astype(np.int8)
+    cls_pos = np.repeat(np.arange(len(CLASS_NAMES)),
+                        [len(col) for col in cols])
+
+    ids = np.asarray(ids, dtype=str)
+    order = np.argsort(ids)
+    rows = np.searchsorted(ids, cls_ids, sorter=order)
+    rows = order[np.minimum(rows, len(ids) - 1)]
+    unknown = ids[rows] != cls_ids
+    if np.any(unknown):
+        raise ValueError('{} entries in {} class files are not listed in '
+                         '{}.txt, e.g. {}'.format(
+                             np.sum(unknown), split, split,
+                             cls_ids[unknown][0]))
+
+    gt = np.full((len(ids), len(CLASS_NAMES)), -1, dtype=np.int8)
+    gt[rows, cls_pos] = cls_vals
+    return gt
+
+
+def load_labels(data_dir, split, ids=None, ignore_difficult=False):
+    """
+    Read the per-class ImageSets files into label and weight matrices.
+    Args:
+        data_dir (str): Path to the VOC2007 directory.
+        split (str): train/val/trainval/test split to use.
+        ids (list): Image ids defining the row order, None to read
+            ImageSets/Main/<split>.txt.
+        ignore_difficult (bool): Give difficult (0) entries weight 0
+            instead of treating them as negatives.
+    Returns:
+        labels (np.ndarray): (N, 20) np.int8 array, 1 for active classes.
+        weights (np.ndarray): (N, 20) np.int8 array, 0 to ignore an entry.
+    """
+    if ids is None:
+        ids = read_image_ids(data_dir, split)
+    gt = read_gt_matrix(data_dir, split, ids)
+    if ignore_difficult:
+        label_list = (gt >= 0).astype(np.int8)
+        weight_list = (gt != 0).astype(np.int8)
+    else:
+        label_list = (gt == 1).astype(np.int8)
+        weight_list = np.ones_like(gt)
+    print("finish loading label")
+    return label_list, weight_list
+
+
+def normalize_images(images, mean=None, scale=False):
+    """
+    Normalize a float image array in place.
+    Args:
+        images (np.ndarray): Float array of shape (N, H, W, 3).
+        mean (list): Per-channel RGB mean to subtract, or None.
+        scale (bool): Map [0, 255] to [-1, 1] after mean subtraction.
+    Returns:
+        images (np.ndarray): The same array, normalized.
+    """
+    if mean is not None:
+        images -= np.asarray(mean, dtype=images.dtype)
+    if scale:
+        images /= 255.0
+        images -= 0.5
+        images *= 2
+    return images
+
+
+def split_crop_size(split, crop_size):
+    """Only the test split is center-cropped when loading."""
+    if split != 'test':
+        return None
+    return crop_size
+
+
+def cache_key(data_dir, split, image_size, crop_size, ignore_difficult=False):
+    """
+    Hash the ImageSets files of a split together with the resize parameters.
+    Args:
+        data_dir (str): Path to the VOC2007 directory.
+        split (str): train/val/trainval/test split to use.
+        image_size (int): Side every image is resized to.
+        crop_size (int): Side of the center crop, None for no crop.
+        ignore_difficult (bool): Label convention stored in the pack.
+    Returns:
+        key (str): Hex digest that changes whenever the pack is stale.
+    """
+    label_dir = data_dir + 'ImageSets/Main/'
+    h = hashlib.sha1()
+    h.update(json.dumps([split, image_size, crop_size,
+                         bool(ignore_difficult)]).encode('utf-8'))
+    for name in [split] + [c + '_' + split for c in CLASS_NAMES]:
+        with open(label_dir + name + '.txt', 'rb') as f:
+            h.update(f.read())
+    return h.hexdigest()
+
+
+def _pack_dir(cache_dir, split, image_size, crop_size):
+    return osp.join(cache_dir, '{}_{}_{}'.format(
+        split, image_size, crop_size if crop_size is not None else 'full'))
+
+
+def pack_pascal(data_dir, cache_dir, split='train', image_size=256,
+                crop_size=224, ignore_difficult=False, num_workers=None):
+    """
+    Decode a split once and write it as a memory-mappable pack.
+    The pack is a directory holding images.npy (uint8, N x S x S x 3),
+    labels.npy, weights.npy and meta.json with the cache key. It is written
+    to a temporary directory and renamed into place when complete.
+    Args:
+        data_dir (str): Path to the VOC2007 directory.
+        cache_dir (str): Directory holding all packs.
+        split (str): train/val/trainval/test split to use.
+        image_size (int): Side every image is resized to.
+        crop_size (int): Side of the center crop for the test split.
+        ignore_difficult (bool): Give difficult entries weight 0.
+        num_workers (int): Decoder processes, None for one per CPU.
+    Returns:
+        path (str): Directory of the written pack.
+    """
+    crop_size = split_crop_size(split, crop_size)
+    side = crop_size if crop_size is not None else image_size
+    key = cache_key(data_dir, split, image_size, crop_size, ignore_difficult)
+    path = _pack_dir(cache_dir, split, image_size, crop_size)
+    tmp_path = path + '.tmp{}'.format(os.getpid())
+    if osp.isdir(tmp_path):
+        shutil.rmtree(tmp_path)
+    os.makedirs(tmp_path)
+
+    ids = read_image_ids(data_dir, split)
+    images = np.lib.format.open_memmap(
+        osp.join(tmp_path, 'images.npy'), mode='w+', dtype=np.uint8,
+        shape=(len(ids), side, side, 3))
+    decode_images([data_dir + 'JPEGImages/' + i + '.jpg' for i in ids],
+                  images, image_size, crop_size, num_workers=num_workers)
+    images.flush()
+    del images
+
+    labels, weights = load_labels(
+        data_dir, split, ids, ignore_difficult=ignore_difficult)
+    np.save(osp.join(tmp_path, 'labels.npy'), labels)
+    np.save(osp.join(tmp_path, 'weights.npy'), weights)
+    with open(osp.join(tmp_path, 'meta.json'), 'w') as f:
+        json.dump({'key': key, 'split': split, 'image_size': image_size,
+                   'crop_size': crop_size, 'num_images': len(ids)}, f)
+
+    if osp.isdir(path):
+        shutil.rmtree(path)
+    os.rename(tmp_path, path)
+    print('packed {} images to {}'.format(len(ids), path))
+    return path
+
+
+def open_pack(data_dir, cache_dir, split='train', image_size=256,
+              crop_size=224, ignore_difficult=False, num_workers=None):
+    """
+    Memory-map a pack, (re)building it first if missing or stale.
+    Args:
+        data_dir (str): Path to the VOC2007 directory.
+        cache_dir (str): Directory holding all packs.
+        split (str): train/val/trainval/test split to use.
+        image_size (int): Side every image is resized to.
+        crop_size (int): Side of the center crop for the test split.
+        ignore_difficult (bool): Give difficult entries weight 0.
+        num_workers (int): Decoder processes used if the pack is rebuilt.
+    Returns:
+        images (np.memmap): Read-only uint8 array of shape (N, S, S, 3).
+        labels (np.ndarray): (N, 20) np.int8 array.
+        weights (np.ndarray): (N, 20) np.int8 array.
+    """
+    key = cache_key(data_dir, split, image_size,
+                    split_crop_size(split, crop_size), ignore_difficult)
+    path = _pack_dir(cache_dir, split, image_size,
+                     split_crop_size(split, crop_size))
+    meta_path = osp.join(path, 'meta.json')
+    meta = None
+    if osp.isfile(meta_path):
+        with open(meta_path, 'r') as f:
+            meta = json.load(f)
+    if meta is None or meta['key'] != key:
+        print('pack {} is missing or stale, rebuilding'.format(path))
+        pack_pascal(data_dir, cache_dir, split=split, image_size=image_size,
+                    crop_size=crop_size, ignore_difficult=ignore_difficult,
+                    num_workers=num_workers)
+
+    images = np.load(osp.join(path, 'images.npy'), mmap_mode='r')
+    labels = np.load(osp.join(path, 'labels.npy'))
+    weights = np.load(osp.join(path, 'weights.npy'))
+    return images, labels, weights
+
+
+def load_pascal(data_dir, split='train', image_size=256, crop_size=224,
+                mean=None, scale=False, ignore_difficult=False,
+                num_workers=None, cache_dir=None, uint8=False):
+    """
+    Function to read images from PASCAL data folder.
+    Args:
+        data_dir (str): Path to the VOC2007 directory.
+        split (str): train/val/trainval/test split to use.
+        image_size (int): Side every image is resized to.
+        crop_size (int): Side of the center crop applied to the test split,
+            None to never crop.
+        mean (list): Per-channel RGB mean to subtract, or None.
+        scale (bool): Map pixel values to [-1, 1].
+        ignore_difficult (bool): Give difficult entries weight 0.
+        num_workers (int): Decoder processes, None for one per CPU.
+        cache_dir (str): If set, read the images from a memory-mapped pack
+            in this directory (built on first use) instead of the JPEGs.
+        uint8 (bool): Return raw uint8 pixels and skip mean/scale, leaving
+            normalization to pascal_input.normalize_input on the graph.
+            With cache_dir the pack's memory map is returned as is.
+    Returns:
+        images (np.ndarray): Return a np.float32 array (np.uint8 if uint8)
+            of shape (N, H, W, 3), and each image is in RGB format.
+        labels (np.ndarray): An array of shape (N, 20) of
+            type np.int8, with 0s and 1s; 1s for classes that
+            are active in that image.
+        weights (np.ndarray): An array of shape (N, 20) of
+            type np.int8, 0s for entries to ignore.
+    """
+    if cache_dir is not None:
+        packed, label_list, weight_list = open_pack(
+            data_dir, cache_dir, split=split, image_size=image_size,
+            crop_size=crop_size, ignore_difficult=ignore_difficult,
+            num_workers=num_workers)
+        img_list = packed if uint8 else packed.astype(np.float32)
+    else:
+        crop_size = split_crop_size(split, crop_size)
+        side = crop_size if crop_size is not None else image_size
+        ids = read_image_ids(data_dir, split)
+        img_list = np.empty((len(ids), side, side, 3),
+                            dtype=np.uint8 if uint8 else np.float32)
+        decode_images([data_dir + 'JPEGImages/' + i + '.jpg' for i in ids],
+                      img_list, image_size, crop_size,
+                      num_workers=num_workers)
+        label_list, weight_list = load_labels(
+            data_dir, split, ids, ignore_difficult=ignore_difficult)
+
+    if not uint8:
+        normalize_images(img_list, mean=mean, scale=scale)
+    print("finish loading images")
+    print(img_list.shape)
+    return img_list, label_list, weight_list
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Pack PASCAL splits into memory-mapped caches.')
+    parser.add_argument(
+        'data_dir', type=str, default='data/VOC2007',
+        help='Path to PASCAL data storage')
+    parser.add_argument(
+        'cache_dir', type=str,
+        help='Directory to write the packs to')
+    parser.add_argument(
+        '--splits', type=str, nargs='+', default=['trainval', 'test'],
+        help='Splits to pack')
+    parser.add_argument('--image_size', type=int, default=256)
+    parser.add_argument('--crop_size', type=int, default=224)
+    parser.add_argument('--ignore_difficult', action='store_true')
+    parser.add_argument(
+        '--num_workers', type=int, default=None,
+        help='Number of JPEG decoder processes (default: one per CPU)')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    for split in args.splits:
+        pack_pascal(args.data_dir, args.cache_dir, split=split,
+                    image_size=args.image_size, crop_size=args.crop_size,
+                    ignore_difficult=args.ignore_difficult,
+                    num_workers=args.num_workers)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,317 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import multiprocessing
+import os
+
+import tensorflow as tf
+
+import pascal_data
+
+# suffixes read by list_images from directories (decoded as JPEG)
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg')
+
+
+def normalize_input(images, mean=None, scale=False):
+    """
+    Cast uint8 images to float32 and normalize them on the graph.
+    Float inputs are assumed to be normalized by load_pascal already and are
+    returned unchanged, so model functions work with either loader mode.
+    Args:
+        images (tf.Tensor): Batch of shape (N, H, W, 3), uint8 or float32.
+        mean (list): Per-channel RGB mean to subtract, or None.
+        scale (bool): Map [0, 255] to [-1, 1] after mean subtraction.
+    Returns:
+        images (tf.Tensor): float32 batch of the same shape.
+    """
+    if images.dtype != tf.uint8:
+        return images
+    images = tf.cast(images, tf.float32)
+    if mean is not None:
+        images -= tf.constant(mean, dtype=tf.float32)
+    if scale:
+        images = (images / 255.0 - 0.5) * 2
+    return images
+
+
+def _decode_jpeg(path, image_size, crop_size):
+    """Graph version of pascal_data._decode_image, returning uint8."""
+    img = tf.image.decode_jpeg(tf.read_file(path), channels=3)
+    img = tf.image.resize_images(img, [image_size, image_size])
+    img = tf.saturate_cast(tf.round(img), tf.uint8)
+    if crop_size is not None:
+        margin = (image_size - crop_size) // 2
+        img = tf.image.crop_to_bounding_box(
+            img, margin, margin, crop_size, crop_size)
+    return img
+
+
+def stream_input_fn(data_dir, split, image_size=256, crop_size=224,
+                    batch_size=128, shuffle=False, num_epochs=1,
+                    cache_dir=None, ignore_difficult=False,
+                    num_parallel_calls=None, prefetch_batches=2):
+    """
+    Build a tf.data input_fn that streams a PASCAL split lazily.
+    Only file names (or pack row indices) and the label matrices are held in
+    memory. Shuffling permutes those keys before any pixel is read, so the
+    shuffle buffer costs a few bytes per image whatever the split size.
+    Images come out as uint8; cnn_model_fn normalizes them through
+    normalize_input.
+    Args:
+        data_dir (str): Path to the VOC2007 directory.
+        split (str): train/val/trainval/test split to use.
+        image_size (int): Side every image is resized to.
+        crop_size (int): Side of the center crop applied to the test split.
+        batch_size (int): Images per batch.
+        shuffle (bool): Reshuffle the split on every pass.
+        num_epochs (int): Passes over the split, None to repeat forever.
+        cache_dir (str): If set, read rows from the memory-mapped pack in
+            this directory instead of decoding JPEGs.
+        ignore_difficult (bool): Give difficult entries weight 0.
+        num_parallel_calls (int): Parallel decode/read calls, None for one
+            per CPU.
+        prefetch_batches (int): Batches to prepare ahead of the model.
+    Returns:
+        input_fn (callable): Returns ({"x": images, "w": weights}, labels).
+    """
+    if num_parallel_calls is None:
+        num_parallel_calls = multiprocessing.cpu_count()
+    eff_crop_size = pascal_data.split_crop_size(split, crop_size)
+    side = eff_crop_size if eff_crop_size is not None else image_size
+
+    def _pack_dataset():
+        images, labels, weights = pascal_data.open_pack(
+            data_dir, cache_dir, split=split, image_size=image_size,
+            crop_size=crop_size, ignore_difficult=ignore_difficult)
+
+        def _read_rows(idx):
+            return images[idx], labels[idx], weights[idx]
+
+        def _gather(idx):
+            x, y, w = tf.py_func(
+                _read_rows, [idx], [tf.uint8, tf.int8, tf.int8],
+                stateful=False)
+            x.set_shape([None, side, side, 3])
+            y.set_shape([None, labels.shape[1]])
+            w.set_shape([None, weights.shape[1]])
+            return x, y, w
+
+        dataset = tf.data.Dataset.range(len(images))
+        if shuffle:
+            dataset = dataset.shuffle(len(images))
+        dataset = dataset.repeat(num_epochs).batch(batch_size)
+        return dataset.map(_gather, num_parallel_calls=num_parallel_calls)
+
+    def _jpeg_dataset():
+        ids = pascal_data.read_image_ids(data_dir, split)
+        labels, weights = pascal_data.load_labels(
+            data_dir, split, ids, ignore_difficult=ignore_difficult)
+        paths = [(data_dir + 'JPEGImages/' + i + '.jpg').encode('utf-8')
+                 for i in ids]
+
+        # like the pack rows, entries are looked up by index in python, so
+        # neither the paths nor the labels become graph constants
+        def _read_entry(idx):
+            return paths[idx], labels[idx], weights[idx]
+
+        def _load(idx):
+            path, y, w = tf.py_func(
+                _read_entry, [idx], [tf.string, tf.int8, tf.int8],
+                stateful=False)
+            path.set_shape([])
+            y.set_shape([labels.shape[1]])
+            w.set_shape([weights.shape[1]])
+            return _decode_jpeg(path, image_size, eff_crop_size), y, w
+
+        dataset = tf.data.Dataset.range(len(paths))
+        if shuffle:
+            dataset = dataset.shuffle(len(paths))
+        dataset = dataset.repeat(num_epochs)
+        dataset = dataset.map(_load, num_parallel_calls=num_parallel_calls)
+        return dataset.batch(batch_size)
+
+    def input_fn():
+        if cache_dir is not None:
+            dataset = _pack_dataset()
+        else:
+            dataset = _jpeg_dataset()
+        dataset = dataset.prefetch(prefetch_batches)
+        x, y, w = dataset.make_one_shot_iterator().get_next()
+        return {"x": x, "w": w}, y
+
+    return input_fn
+
+
+def list_images(inputs, extensions=IMAGE_EXTENSIONS):
+    """
+    Expand directories (recursively, sorted) and list files (one path per
+    line) into image paths; other arguments are taken as image paths.
+    Args:
+        inputs (list): Directories, .txt lists or image paths.
+        extensions (tuple): Lower-case suffixes of the files kept from
+            directories.
+    Returns:
+        paths (list): Image paths, in input order.
+    """
+    paths = []
+    for item in inputs:
+        if os.path.isdir(item):
+            for root, dirs, files in os.walk(item):
+                dirs.sort()
+                paths.extend(os.path.join(root, f) for f in sorted(files)
+                             if f.lower().endswith(extensions))
+        elif item.endswith('.txt'):
+            with open(item, 'r') as f:
+                paths.extend(line.strip() for line in f if line.strip())
+        else:
+            paths.append(item)
+    return paths
+
+
+def files_input_fn(paths, image_size=256, crop_size=224, batch_size=64,
+                   num_parallel_calls=None, prefetch_batches=2):
+    """
+    Build a predict input_fn over arbitrary JPEG files.
+    Paths are fed from a Python generator, so the list never becomes a
+    graph constant, and decoding runs num_parallel_calls images at a time
+    with at most prefetch_batches batches waiting, so memory stays bounded
+    whatever the number of files. Output order is the order of paths.
+    Args:
+        paths (list): Image paths, e.g. from list_images.
+        image_size (int): Side every image is resized to.
+        crop_size (int): Side of the center crop, None to keep the full
+            image.
+        batch_size (int): Images per batch.
+        num_parallel_calls (int): Parallel decodes, None for one per CPU.
+        prefetch_batches (int): Batches to prepare ahead of the model.
+    Returns:
+        input_fn (callable): Returns {"x": uint8 images}.
+    """
+    if num_parallel_calls is None:
+        num_parallel_calls = multiprocessing.cpu_count()
+
+    def input_fn():
+        dataset = tf.data.Dataset.from_generator(
+            lambda: iter(paths), tf.string, tf.TensorShape([]))
+        dataset = dataset.map(
+            lambda p: _decode_jpeg(p, image_size, crop_size),
+            num_parallel_calls=num_parallel_calls)
+        dataset = dataset.batch(batch_size).prefetch(prefetch_batches)
+        return {"x": dataset.make_one_shot_iterator().get_next()}
+
+    return input_fn
+
+
+def _gather_crops(images, batch, offset_y, offset_x, flip, crop_size):
+    """
+    Gather one square crop per (batch, offset, flip) entry with tf.gather_nd.
+    Offsets and flips are folded into a single (M, crop, crop, 3) index
+    tensor, so the graph does not grow with the number of crops.
+    """
+    m = tf.shape(batch)[0]
+    steps = tf.tile(tf.range(crop_size)[None, :], [m, 1])
+    rows = offset_y[:, None] + steps
+    cols = offset_x[:, None] + tf.where(flip, crop_size - 1 - steps, steps)
+    indices = tf.stack([
+        tf.tile(batch[:, None, None], [1, crop_size, crop_size]),
+        tf.tile(rows[:, :, None], [1, 1, crop_size]),
+        tf.tile(cols[:, None, :], [1, crop_size, 1])], axis=-1)
+
+    crops = tf.gather_nd(images, indices)
+    crops.set_shape([None, crop_size, crop_size, images.shape[-1]])
+    return crops
+
+
+def random_crop_flip(images, crop_size):
+    """
+    Randomly crop and horizontally flip every image of a batch in one gather.
+    Args:
+        images (tf.Tensor): Batch of shape (N, H, W, C), any dtype.
+        crop_size (int): Side of the square crops.
+    Returns:
+        crops (tf.Tensor): Batch of shape (N, crop_size, crop_size, C).
+    """
+    shape = tf.shape(images)
+    n, height, width = shape[0], shape[1], shape[2]
+    offset_y = tf.random_uniform([n], 0, height - crop_size + 1, tf.int32)
+    offset_x = tf.random_uniform([n], 0, width - crop_size + 1, tf.int32)
+    flip = tf.random_uniform([n]) < 0.5
+    return _gather_crops(
+        images, tf.range(n), offset_y, offset_x, flip, crop_size)
+
+
+TEN_CROPS = 10
+
+
+def ten_crop(images, crop_size):
+    """
+    Expand a batch into the standard 10 test-time crops per image.
+    The four corner crops and the center crop, each with and without a
+    horizontal flip, are gathered in a single op. Crops of an image are
+    contiguous, so merge_crops can average them back.
+    Args:
+        images (tf.Tensor): Batch of shape (N, H, W, C) with static H, W.
+        crop_size (int): Side of the square crops.
+    Returns:
+        crops (tf.Tensor): Batch of shape (N * 10, crop_size, crop_size, C).
+    """
+    height, width = images.shape[1].value, images.shape[2].value
+    bottom, right = height - crop_size, width - crop_size
+    offsets = [(0, 0), (0, right), (bottom, 0), (bottom, right),
+               (bottom // 2, right // 2)]
+    offset_y = [oy for oy, _ in offsets] * 2
+    offset_x = [ox for _, ox in offsets] * 2
+    flip = [False] * len(offsets) + [True] * len(offsets)
+
+    n = tf.shape(images)[0]
+    batch = tf.reshape(
+        tf.tile(tf.range(n)[:, None], [1, TEN_CROPS]), [-1])
+    return _gather_crops(
+        images, batch,
+        tf.tile(tf.constant(offset_y), [n]),
+        tf.tile(tf.constant(offset_x), [n]),
+        tf.tile(tf.constant(flip), [n]), crop_size)
+
+
+def merge_crops(outputs, num_crops=TEN_CROPS):
+    """
+    Average per-crop outputs back to one row per image.
+    Args:
+        outputs (tf.Tensor): Tensor of shape (N * num_crops, ...).
+        num_crops (int): Crops per image, as produced by ten_crop.
+    Returns:
+        merged (tf.Tensor): Tensor of shape (N, ...).
+    """
+    shape = tf.concat([[-1, num_crops], tf.shape(outputs)[1:]], axis=0)
+    return tf.reduce_mean(tf.reshape(outputs, shape), axis=1)
+
+
+def augment_batch(images, crop_size, contrast=None, brightness=None,
+                  noise_stddev=None):
+    """
+    Batched training augmentation: random crop, flip and color jitter.
+    Replaces the per-image random_flip_left_right/random_crop loop. All
+    random parameters are drawn per sample with one op each, so any batch
+    size (including a short last batch) works. Jitter is applied after the
+    crop, which makes the contrast mean that of the crop.
+    Args:
+        images (tf.Tensor): float32 batch of shape (N, H, W, 3).
+        crop_size (int): Side of the square crops.
+        contrast (tuple): (lower, upper) contrast factor range, or None.
+        brightness (float): Max absolute brightness delta, or None.
+        noise_stddev (float): Stddev of additive Gaussian noise, or None.
+    Returns:
+        images (tf.Tensor): float32 batch of shape (N, crop, crop, 3).
+    """
+    images = random_crop_flip(images, crop_size)
+    per_sample = tf.stack([tf.shape(images)[0], 1, 1, 1])
+    if contrast is not None:
+        factor = tf.random_uniform(per_sample, contrast[0], contrast[1])
+        mean = tf.reduce_mean(images, axis=[1, 2], keep_dims=True)
+        images = (images - mean) * factor + mean
+    if brightness is not None:
+        images += tf.random_uniform(per_sample, -brightness, brightness)
+    if noise_stddev is not None:
+        images += tf.random_normal(tf.shape(images), 0, noise_stddev)
+    return images
@@ -0,0 +1,141 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+# Batched inference of a trained hw1 classifier on arbitrary images. Inputs
+# are directories (walked recursively), .txt lists of paths or image paths;
+# they are streamed through pascal_input.files_input_fn (parallel decode,
+# bounded prefetch) into Estimator.predict, and the top-k classes of every
+# image are written as they arrive, to a CSV (path, then class/probability
+# pairs) or to a structured .npy with a sibling _paths.txt.
+import argparse
+import csv
+import time
+
+import numpy as np
+import tensorflow as tf
+
+import model
+import pascal_data
+import pascal_input
+
+
+class CSVWriter(object):
+    """Rows of path, class_1, probability_1, ..., class_k, probability_k."""
+
+    def __init__(self, path, top_k, num_images):
+        self._file = open(path, 'w')
+        self._writer = csv.writer(self._file)
+        header = ['path']
+        for i in range(1, top_k + 1):
+            header += ['class_{}'.format(i), 'probability_{}'.format(i)]
+        self._writer.writerow(header)
+
+    def write(self, i, path, classes, probabilities):
+        row = [path]
+        for c, p in zip(classes, probabilities):
+            row += [pascal_data.CLASS_NAMES[c], '{:.6f}'.format(p)]
+        self._writer.writerow(row)
+
+    def close(self):
+        self._file.close()
+
+
+class NPYWriter(object):
+    """(N,) structured memmap of class indices and probabilities."""
+
+    def __init__(self, path, top_k, num_images):
+        self._paths = open(path[:-len('.npy')] + '_paths.txt', 'w')
+        self._out = np.lib.format.open_memmap(
+            path, mode='w+', shape=(num_images,),
+            dtype=[('class', np.int16, (top_k,)),
+                   ('probability', np.float32, (top_k,))])
+
+    def write(self, i, path, classes, probabilities):
+        self._out[i] = (classes, probabilities)
+        self._paths.write(path + '\n')
+
+    def close(self):
+        self._out.flush()
+        self._out = None
+        self._paths.close()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Top-k PASCAL classes of a folder of images.')
+    parser.add_argument(
+        'inputs', type=str, nargs='+',
+        help='Image directories, .txt files of paths, or images')
+    parser.add_argument(
+        '--model_dir', type=str, required=True, help='Estimator model_dir')
+    parser.add_argument(
+        '--checkpoint', type=str, default=None,
+        help='Checkpoint to restore (default: latest in --model_dir)')
+    parser.add_argument(
+        '--script', type=str, required=True,
+        help='Training script of the model, e.g. 03_pascal_vgg16; its '
+             'MODEL_PARAMS define the network and the input size')
+    parser.add_argument(
+        '--output', type=str, default='predictions.csv',
+        help='.csv or .npy file to write')
+    parser.add_argument('--top_k', type=int, default=5)
+    parser.add_argument('--batch_size', type=int, default=64)
+    parser.add_argument(
+        '--num_workers', type=int, default=None,
+        help='Parallel JPEG decodes (default: one per CPU)')
+    parser.add_argument(
+        '--prefetch', type=int, default=2,
+        help='Decoded batches queued ahead of the model')
+    parser.add_argument('--log_every', type=int, default=1000)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    if not args.output.endswith(('.csv', '.npy')):
+        raise ValueError('--output must be a .csv or .npy file')
+    paths = pascal_input.list_images(args.inputs)
+    if not paths:
+        raise ValueError('no images in {}'.format(args.inputs))
+    print('predicting {} images'.format(len(paths)))
+
+    model_params = model.script_model_params(args.script)
+    estimator = tf.estimator.Estimator(
+        model_fn=lambda features, labels, mode: model.model_fn(
+            features, labels, mode, **model_params),
+        model_dir=args.model_dir)
+    input_fn = pascal_input.files_input_fn(
+        paths, image_size=model_params.get('image_size', 256),
+        crop_size=model_params.get('crop_size', 224),
+        batch_size=args.batch_size,
+        num_parallel_calls=args.num_workers, prefetch_batches=args.prefetch)
+
+    writer_cls = CSVWriter if args.output.endswith('.csv') else NPYWriter
+    writer = writer_cls(args.output, args.top_k, len(paths))
+    start = first = time.time()
+    try:
+        for i, p in enumerate(estimator.predict(
+                input_fn=input_fn, predict_keys=['probabilities'],
+                checkpoint_path=args.checkpoint)):
+            if i == 0:
+                # graph construction, restore and the first batch
+                first = time.time()
+            probabilities = p['probabilities']
+            classes = np.argsort(-probabilities)[:args.top_k]
+            writer.write(i, paths[i], classes, probabilities[classes])
+            if args.log_every and (i + 1) % args.log_every == 0:
+                print('{}/{} images, {:.1f} images/sec'.format(
+                    i + 1, len(paths), i / max(time.time() - first, 1e-9)))
+    finally:
+        writer.close()
+    end = time.time()
+    print('wrote {} ({} images) in {:.1f}s: {:.1f} images/sec sustained, '
+          '{:.1f} including startup'.format(
+              args.output, len(paths), end - start,
+              (len(paths) - 1) / max(end - first, 1e-9),
+              len(paths) / (end - start)))
+
+
+if __name__ == "__main__":
+    main()
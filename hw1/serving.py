@@ -0,0 +1,252 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+# Low-latency serving of the hw1 classifiers. export_saved_model freezes a
+# checkpoint of model.model_fn in PREDICT mode (no dropout, augmentation or
+# optimizer) into constants, constant-folds the graph and writes it as a
+# SavedModel. Predictor loads that once, warms it up and serves requests from
+# any number of threads through a single session, grouping requests that
+# arrive together into one batch (dynamic micro-batching).
+import collections
+import os.path as osp
+import threading
+import time
+
+try:
+    import queue
+except ImportError:  # python 2
+    import Queue as queue
+
+import numpy as np
+import tensorflow as tf
+from tensorflow.tools.graph_transforms import TransformGraph
+
+import model
+
+INPUT = 'images'
+# graph rewrites applied to the frozen inference graph
+TRANSFORMS = [
+    'strip_unused_nodes',
+    'remove_nodes(op=Identity, op=CheckNumerics)',
+    'fold_constants(ignore_errors=true)',
+    'fold_batch_norms',
+    'fold_old_batch_norms',
+    'sort_by_execution_order',
+]
+
+
+def input_size(model_params):
+    """
+    Side of the images model_fn predicts on: crop_size, or image_size for
+    models without crops.
+    """
+    crop_size = model_params.get('crop_size', 224)
+    if crop_size is None:
+        return model_params.get('image_size', 256)
+    return crop_size
+
+
+def export_saved_model(model_dir, export_dir, model_params, checkpoint=None,
+                       transforms=TRANSFORMS):
+    """
+    Export a trained classifier as an inference-only SavedModel.
+    The PREDICT graph of model.model_fn is built on a uint8 placeholder of
+    center crops, its variables are frozen to the values of the checkpoint
+    and the graph is rewritten with the graph transform tool.
+    Args:
+        model_dir (str): Estimator model_dir.
+        export_dir (str): Parent directory; the model is written to a new
+            timestamped subdirectory, as Estimator.export_savedmodel does.
+        model_params (dict): model_fn keyword arguments (arch, mean, scale,
+            crop_size, net_params, ...), e.g. from
+            model.script_model_params.
+        checkpoint (str): Checkpoint to export, None for the latest.
+        transforms (list): Graph transforms, see TRANSFORMS.
+    Returns:
+        path (str): Directory of the SavedModel.
+    """
+    checkpoint = checkpoint or tf.train.latest_checkpoint(model_dir)
+    side = input_size(model_params)
+    params = dict(model_params, tta=False, endpoints=())
+    graph = tf.Graph()
+    with graph.as_default():
+        images = tf.placeholder(tf.uint8, [None, side, side, 3], name=INPUT)
+        spec = model.model_fn({"x": images}, None,
+                              tf.estimator.ModeKeys.PREDICT, **params)
+        output = spec.predictions["probabilities"].op.name
+        with tf.Session(graph=graph) as sess:
+            tf.train.Saver().restore(sess, checkpoint)
+            graph_def = tf.graph_util.convert_variables_to_constants(
+                sess, graph.as_graph_def(), [output])
+    graph_def = TransformGraph(graph_def, [INPUT], [output], transforms)
+
+    path = osp.join(export_dir, str(int(time.time())))
+    frozen = tf.Graph()
+    with frozen.as_default():
+        tf.import_graph_def(graph_def, name='')
+        signature = tf.saved_model.signature_def_utils.predict_signature_def(
+            inputs={'images': frozen.get_tensor_by_name(INPUT + ':0')},
+            outputs={'probabilities':
+                     frozen.get_tensor_by_name(output + ':0')})
+        builder = tf.saved_model.builder.SavedModelBuilder(path)
+        with tf.Session(graph=frozen) as sess:
+            builder.add_meta_graph_and_variables(
+                sess, [tf.saved_model.tag_constants.SERVING],
+                signature_def_map={
+                    tf.saved_model.signature_constants
+                    .DEFAULT_SERVING_SIGNATURE_DEF_KEY: signature})
+        builder.save()
+    print('exported {} ({} nodes) to {}'.format(
+        checkpoint, len(graph_def.node), path))
+    return path
+
+
+class _Request(object):
+    """One image waiting for its probabilities."""
+
+    def __init__(self, image):
+        self.image = image
+        self.start = time.time()
+        self._done = threading.Event()
+        self._result = None
+        self._error = None
+
+    def set(self, result=None, error=None):
+        self._result, self._error = result, error
+        self._done.set()
+
+    def result(self, timeout=None):
+        if not self._done.wait(timeout):
+            raise RuntimeError('prediction timed out')
+        if self._error is not None:
+            raise self._error
+        return self._result
+
+
+class Predictor(object):
+    """
+    Long-lived, thread-safe predictor of an exported SavedModel.
+    The model is loaded and run once on a dummy batch at construction, so
+    the first request pays no graph or kernel setup. Requests go through a
+    queue to one batching thread: it takes the first waiting request, then
+    keeps collecting until max_batch_size requests are gathered or
+    max_wait_ms has passed since the first, and runs them as one batch.
+    The latency of every request (submit to result) is recorded, see
+    latency_report.
+    Args:
+        export_dir (str): SavedModel directory from export_saved_model.
+        max_batch_size (int): Largest batch run at once.
+        max_wait_ms (float): Longest wait for a batch to fill up.
+        num_threads (int): intra-op threads of the session, None for TF's
+            default.
+        history (int): Latencies kept for latency_report.
+    """
+
+    def __init__(self, export_dir, max_batch_size=32, max_wait_ms=5.,
+                 num_threads=None, history=100000):
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self._graph = tf.Graph()
+        config = tf.ConfigProto()
+        if num_threads is not None:
+            config.intra_op_parallelism_threads = num_threads
+        self._sess = tf.Session(graph=self._graph, config=config)
+        meta_graph = tf.saved_model.loader.load(
+            self._sess, [tf.saved_model.tag_constants.SERVING], export_dir)
+        signature = meta_graph.signature_def[
+            tf.saved_model.signature_constants
+            .DEFAULT_SERVING_SIGNATURE_DEF_KEY]
+        self._input = self._graph.get_tensor_by_name(
+            signature.inputs['images'].name)
+        self._output = self._graph.get_tensor_by_name(
+            signature.outputs['probabilities'].name)
+        self._graph.finalize()
+        self.image_shape = tuple(self._input.shape.as_list()[1:])
+
+        # warm up on the smallest and the largest batch
+        for size in sorted(set([1, max_batch_size])):
+            self._run(np.zeros((size,) + self.image_shape, np.uint8))
+
+        self._latencies = collections.deque(maxlen=history)
+        self._batch_sizes = collections.deque(maxlen=history)
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._batch_loop)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self, images):
+        return self._sess.run(self._output, {self._input: images})
+
+    def _batch_loop(self):
+        while True:
+            first = self._queue.get()
+            if first is None:
+                return
+            batch = [first]
+            deadline = time.time() + self.max_wait_ms / 1000.
+            stop = False
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - time.time()
+                try:
+                    request = (self._queue.get_nowait() if timeout <= 0
+                               else self._queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+                if request is None:
+                    stop = True
+                    break
+                batch.append(request)
+            try:
+                probabilities = self._run(np.stack([r.image for r in batch]))
+            except Exception as e:  # hand the error to the callers
+                for r in batch:
+                    r.set(error=e)
+            else:
+                end = time.time()
+                for r, p in zip(batch, probabilities):
+                    r.set(p)
+                    self._latencies.append(end - r.start)
+                self._batch_sizes.append(len(batch))
+            if stop:
+                return
+
+    def submit(self, image):
+        """
+        Queue one image.
+        Args:
+            image (np.ndarray): uint8 center crop of shape image_shape.
+        Returns:
+            request: Object whose result(timeout=None) blocks until the
+                probabilities (np.ndarray of shape (num_classes,)) are ready.
+        """
+        request = _Request(np.asarray(image, dtype=np.uint8))
+        self._queue.put(request)
+        return request
+
+    def predict(self, image):
+        """Probabilities of one image, blocking."""
+        return self.submit(image).result()
+
+    def latency_report(self):
+        """
+        Returns:
+            report (dict): Number of requests, p50/p99/mean latency in ms and
+                mean batch size.
+        """
+        latencies = np.asarray(self._latencies) * 1e3
+        if not len(latencies):
+            return {'requests': 0}
+        return {
+            'requests': len(latencies),
+            'p50_ms': float(np.percentile(latencies, 50)),
+            'p99_ms': float(np.percentile(latencies, 99)),
+            'mean_ms': float(latencies.mean()),
+            'mean_batch_size': float(np.mean(self._batch_sizes)),
+        }
+
+    def close(self):
+        """Serve the queued requests, then stop the thread and session."""
+        self._queue.put(None)
+        self._thread.join()
+        self._sess.close()
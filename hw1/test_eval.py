@@ -0,0 +1,25 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import numpy as np
+
+from eval import average_precision, compute_map
+
+
+def test_average_precision_ranks_and_ties():
+    gt = np.array([[1, 0], [0, 1], [1, 0], [0, 0]])
+    scores = np.array([[0.9, 0.5], [0.8, 0.5], [0.7, 0.1], [0.1, 0.5]])
+    ap = average_precision(gt, scores)
+    # column 0: positives at ranks 1 and 3; column 1: the positive is tied
+    # with two negatives for first place
+    np.testing.assert_allclose(ap, [(1 + 2 / 3) / 2, 1 / 3])
+
+
+def test_empty_input_gives_nan_per_class():
+    gt = np.zeros((0, 20), dtype=np.int8)
+    pred = np.zeros((0, 20), dtype=np.float32)
+    assert np.isnan(average_precision(gt, pred)).all()
+    ap = compute_map(gt, pred, gt)
+    assert ap.shape == (20,)
+    assert np.isnan(ap).all()
@@ -0,0 +1,57 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import collections
+
+import pytest
+
+tf = pytest.importorskip('tensorflow')
+
+import train_hooks  # noqa: E402
+
+_Node = collections.namedtuple(
+    '_Node', 'node_name all_start_micros all_end_rel_micros')
+_Device = collections.namedtuple('_Device', 'node_stats')
+_StepStats = collections.namedtuple('_StepStats', 'dev_stats')
+_RunMetadata = collections.namedtuple('_RunMetadata', 'step_stats')
+_RunValues = collections.namedtuple('_RunValues', 'results run_metadata')
+
+
+def _traced_step(profiler, monkeypatch, start, end, step_stats):
+    """Run after_run of one traced step that took end - start seconds."""
+    profiler._op_types = {'dequeue': 'QueueDequeueManyV2',
+                          'merged': 'MergeSummary', 'conv': 'Conv2D'}
+    profiler._run_start = start
+    profiler._last_end = None
+    profiler._next_step = 1
+    profiler._traced = True
+    monkeypatch.setattr(train_hooks.time, 'time', lambda: end)
+    profiler.after_run(None, _RunValues(0, _RunMetadata(step_stats)))
+    return profiler.steps[-1]
+
+
+def test_traced_step_keeps_wall_run_ms(monkeypatch):
+    # 30 ms of ops (10 of them input wait) inside a 100 ms session run
+    step_stats = _StepStats([_Device([
+        _Node('dequeue', 0, 10000),
+        _Node('conv', 10000, 15000),
+        _Node('merged:0', 25000, 5000),
+    ])])
+    profiler = train_hooks.Profiler(trace_every=1)
+    record = _traced_step(profiler, monkeypatch, 100.0, 100.1, step_stats)
+
+    assert record['run_ms'] == pytest.approx(100.0)
+    assert record['traced_run_ms'] == pytest.approx(30.0)
+    assert record['input_ms'] == pytest.approx(10.0)
+    assert record['summary_op_ms'] == pytest.approx(5.0)
+
+    report = profiler.report()
+    assert report['mean_ms']['run'] == pytest.approx(100.0)
+    assert report['mean_ms']['input'] == pytest.approx(100.0 / 3)
+    assert report['traced_mean_ms']['run'] == pytest.approx(30.0)
+
+    profiler._run_metadata = None  # no op timeline of the fake stats
+    step, = [e for e in profiler.chrome_trace()['traceEvents']
+             if e['name'] == 'step 1']
+    assert step['dur'] == pytest.approx(100.0 * 1e3)
@@ -0,0 +1,443 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import argparse
+import os
+import sys
+import time
+from functools import partial
+
+import matplotlib.pyplot as plt
+import numpy as np
+import tensorflow as tf
+
+import feature_cache
+import model
+import pascal_data
+import pascal_input
+import train_hooks
+from eval import StreamingMAP, compute_map, streaming_map
+
+
+class MAPEvalHook(tf.train.SessionRunHook):
+    """
+    Compute mAP every N steps inside the training session.
+    Estimator.train(steps=stride) followed by predict() rebuilds the graph,
+    opens a new session and restores the checkpoint on every call. This hook
+    instead runs the eval set through the live training graph: it feeds
+    model.MODEL_INPUT with eval batches and model.IS_TRAINING with False, and
+    reads the model.OUTPUT probabilities, so the session and variables are
+    never torn down.
+    Args:
+        images (np.ndarray): Eval images of shape (N, H, W, 3) with the
+            shape MODEL_INPUT expects (center-cropped).
+        labels (np.ndarray): Shape (N, C) labels, as for compute_map.
+        weights (np.ndarray): Shape (N, C) weights, as for compute_map.
+        every_n_steps (int): Evaluate every this many global steps.
+        batch_size (int): Eval images per session.run.
+        mean (list): Per-channel mean for uint8 images, as normalize_input.
+        scale (bool): Scale uint8 images to [-1, 1], as normalize_input.
+        num_bins (int): Histogram bins for StreamingMAP, None for exact AP.
+        output_dir (str): If set, write an "mAP" summary there.
+    """
+
+    def __init__(self, images, labels, weights, every_n_steps,
+                 batch_size=128, mean=None, scale=False, num_bins=None,
+                 output_dir=None):
+        self._images = images
+        self._labels = labels
+        self._weights = weights
+        self._batch_size = batch_size
+        self._mean = mean
+        self._scale = scale
+        self._num_bins = num_bins
+        self._output_dir = output_dir
+        self._timer = tf.train.SecondOrStepTimer(every_steps=every_n_steps)
+        self.steps = []
+        self.maps = []
+        self.last_ap = None
+
+    def begin(self):
+        graph = tf.get_default_graph()
+        self._global_step = tf.train.get_global_step()
+        self._input = graph.get_tensor_by_name(model.MODEL_INPUT + ':0')
+        self._training = graph.get_tensor_by_name(model.IS_TRAINING + ':0')
+        self._output = graph.get_tensor_by_name(model.OUTPUT + ':0')
+        self._writer = None
+        if self._output_dir is not None:
+            self._writer = tf.summary.FileWriterCache.get(self._output_dir)
+        self._timer.reset()
+
+    def before_run(self, run_context):
+        return tf.train.SessionRunArgs(self._global_step)
+
+    def after_run(self, run_context, run_values):
+        stale_step = run_values.results
+        if self._timer.should_trigger_for_step(stale_step + 1):
+            step = run_context.session.run(self._global_step)
+            if self._timer.should_trigger_for_step(step):
+                self._timer.update_last_triggered_step(step)
+                self._evaluate(run_context.session, step)
+
+    def end(self, session):
+        step = session.run(self._global_step)
+        if step != self._timer.last_triggered_step():
+            self._evaluate(session, step)
+
+    def _batch(self, start):
+        images = self._images[start:start + self._batch_size]
+        if images.dtype == np.uint8:
+            images = pascal_data.normalize_images(
+                images.astype(np.float32), self._mean, self._scale)
+        return images
+
+    def _evaluate(self, session, step):
+        meter = StreamingMAP(self._labels.shape[1], num_bins=self._num_bins)
+        start = time.time()
+        for i in range(0, len(self._images), self._batch_size):
+            probs = session.run(self._output, feed_dict={
+                self._input: self._batch(i), self._training: False})
+            j = i + len(probs)
+            meter.update(self._labels[i:j], probs, self._weights[i:j])
+        elapsed = time.time() - start
+
+        ap = meter.result()
+        self.steps.append(step)
+        self.maps.append(np.mean(ap))
+        self.last_ap = ap
+        tf.logging.info('step %d: %.4f mAP (%.1f images/sec)',
+                        step, self.maps[-1], meter.num_images / elapsed)
+        if self._writer is not None:
+            summary = tf.Summary(value=[
+                tf.Summary.Value(tag='mAP', simple_value=self.maps[-1])])
+            self._writer.add_summary(summary, step)
+
+
+def parse_args(tta=True):
+    """
+    Command line shared by the hw1 trainers.
+    Args:
+        tta (bool): Offer --tta (10-crop evaluation).
+    Returns:
+        args (argparse.Namespace): Parsed arguments.
+    """
+    parser = argparse.ArgumentParser(
+        description='Train a classifier in tensorflow!')
+    parser.add_argument(
+        'data_dir', type=str, default='data/VOC2007',
+        help='Path to PASCAL data storage')
+    parser.add_argument(
+        '--num_workers', type=int, default=None,
+        help='Number of JPEG decoder processes (default: one per CPU)')
+    parser.add_argument(
+        '--cache_dir', type=str, default=None,
+        help='Directory of memory-mapped image packs (see pascal_data.py)')
+    parser.add_argument(
+        '--uint8', action='store_true',
+        help='Keep images as uint8 in memory and normalize them on the graph')
+    parser.add_argument(
+        '--stream', action='store_true',
+        help='Stream images with tf.data instead of loading them up front')
+    if tta:
+        parser.add_argument(
+            '--tta', action='store_true',
+            help='Evaluate on 10 crops (corners, center and flips) per image')
+    parser.add_argument(
+        '--map_bins', type=int, default=None,
+        help='Histogram bins per class for approximate streaming mAP '
+             '(default: exact)')
+    parser.add_argument(
+        '--eval_every', type=int, default=None,
+        help='Train in one session and compute mAP every N steps '
+             'with a hook instead of alternating train/predict')
+    parser.add_argument(
+        '--data_format', type=str, default='channels_last',
+        choices=['channels_last', 'channels_first'],
+        help='Convolution layout; channels_first (NCHW) can raise CPU '
+             'throughput on MKL-DNN builds of TensorFlow and needs MKL or '
+             'a GPU (see bench_data_format.py)')
+    parser.add_argument(
+        '--precision', type=str, default='float32',
+        choices=sorted(model.PRECISIONS),
+        help='Compute type of the network; float16 uses dynamic loss '
+             'scaling, variables stay float32 either way')
+    parser.add_argument(
+        '--batch_size', type=int, default=None,
+        help='Override the training batch size of the script, e.g. to use '
+             'the memory freed by --precision float16')
+    parser.add_argument(
+        '--summary_every', type=int, default=None,
+        help='Write image/histogram summaries every N steps and scalars '
+             'every step from a background thread (train_hooks.'
+             'SummaryPolicy) instead of all of them every 100 steps')
+    parser.add_argument(
+        '--mixup', type=str, default=None, choices=model.MIXUP_MODES,
+        help='Train with mixup: "halves" blends half the batch into the '
+             'other half, "shuffle" mixes every sample with a shuffled '
+             'partner and a per-sample lambda (default: as the script)')
+    parser.add_argument(
+        '--mixup_alpha', type=float, default=None,
+        help='Beta(alpha, alpha) parameter of --mixup shuffle')
+    parser.add_argument(
+        '--feature_layer', type=str, default=None,
+        choices=feature_cache.FEATURE_LAYERS,
+        help='Freeze the network below this layer: cache its features in '
+             '--cache_dir once and train only the layers above it')
+    parser.add_argument(
+        '--profile_dir', type=str, default=None,
+        help='Record per-step input/compute/summary times and save '
+             'step_profile.json and a Chrome trace step_trace.json here')
+    parser.add_argument(
+        '--trace_every', type=int, default=None,
+        help='With --profile_dir, capture a full RunMetadata trace every N '
+             'steps to split out the input wait')
+    if len(sys.argv) == 1:
+        parser.print_help()
+        sys.exit(1)
+    args = parser.parse_args()
+    if (args.data_format == 'channels_first'
+            and not model.channels_first_supported()):
+        parser.error('--data_format channels_first needs a TensorFlow build '
+                     'with MKL-DNN or a GPU; this one only has NHWC '
+                     'convolution and pooling kernels')
+    if getattr(args, 'tta', False) and args.eval_every:
+        parser.error('--eval_every evaluates center crops only, '
+                     'it cannot be combined with --tta')
+    if args.feature_layer is not None:
+        if args.cache_dir is None:
+            parser.error('--feature_layer stores the features in --cache_dir')
+        if args.stream or getattr(args, 'tta', False):
+            parser.error('--feature_layer trains on cached center crops, '
+                         'it cannot be combined with --stream or --tta')
+    return args
+
+
+def print_map(AP, gt, valid):
+    """Print the mAP next to the random and ground-truth baselines."""
+    rand_AP = compute_map(gt, np.random.random(gt.shape), valid)
+    print('Random AP: {} mAP'.format(np.mean(rand_AP)))
+    gt_AP = compute_map(gt, gt, valid)
+    print('GT AP: {} mAP'.format(np.mean(gt_AP)))
+    print('Obtained {} mAP'.format(np.mean(AP)))
+    print('per class:')
+    for cid, cname in enumerate(pascal_data.CLASS_NAMES):
+        print('{}: {}'.format(cname, AP[cid]))
+
+
+def plot_map(step_list, map_list, path):
+    fig = plt.figure()
+    plt.plot(step_list, map_list)
+    plt.title("mAP")
+    fig.savefig(path)
+    plt.close(fig)
+
+
+def train_and_evaluate(args, model_params, model_dir, max_step, stride,
+                       batch_size, plot_path, plot_every=None, hooks=(),
+                       eval_split='test', ignore_difficult=False,
+                       first_step=0, log_every=100, config=None,
+                       summary_every=None):
+    """
+    Common main() of the hw1 trainers.
+    Loads the data as the command line asks, trains model.model_fn (or,
+    with --feature_layer, feature_cache.head_model_fn on cached features) and
+    tracks the mAP on eval_split, either every `stride` steps with
+    alternating train/predict calls or, with --eval_every, through a
+    MAPEvalHook in a single training session. The curve is saved to
+    plot_path, and with --profile_dir the per-step profile of the training
+    steps (see train_hooks.Profiler) is saved at the end.
+    Args:
+        args (argparse.Namespace): Output of parse_args.
+        model_params (dict): Keyword arguments of model.model_fn; the data is
+            loaded with its image_size, crop_size, mean and scale.
+        model_dir (str): Estimator model directory.
+        max_step (int): Global step to train to.
+        stride (int): Steps between evaluations without --eval_every.
+        batch_size (int): Training batch size, unless args.batch_size is
+            set.
+        plot_path (str): Where to save the mAP curve.
+        plot_every (int): Also save the curve at steps divisible by this.
+        hooks (list): Extra training hooks, e.g. model.LoadHook. With
+            --feature_layer a LoadHook only selects the checkpoint the
+            frozen backbone is read from (and, for layer "pool5", the
+            fc6/fc7 initialization of the head); otherwise that is the
+            net_params "pretrained" initialization or, failing that, the
+            latest checkpoint in model_dir. The head is trained in
+            model_dir + "_<layer>_head".
+        eval_split (str): Split to compute the mAP on.
+        ignore_difficult (bool): Give difficult entries weight 0.
+        first_step (int): First step of the evaluation range.
+        log_every (int): Loss logging period.
+        config (tf.estimator.RunConfig): Estimator config.
+        summary_every (int): Use a train_hooks.SummaryPolicy that writes the
+            expensive summaries every this many steps; --summary_every
+            overrides it.
+    Returns:
+        step_list (list): Steps at which the mAP was computed.
+        map_list (list): The mAP at those steps.
+    """
+    tta = getattr(args, 'tta', False)
+    if args.batch_size is not None:
+        batch_size = args.batch_size
+    if args.mixup is not None:
+        model_params = dict(model_params, mixup=args.mixup)
+    if args.mixup_alpha is not None:
+        model_params = dict(model_params, mixup_alpha=args.mixup_alpha)
+    image_size = model_params.get('image_size', 256)
+    crop_size = model_params.get('crop_size', 224)
+    mean = model_params.get('mean')
+    scale = model_params.get('scale', False)
+    eval_crop_size = None if tta else crop_size
+    load = partial(
+        pascal_data.load_pascal, args.data_dir, image_size=image_size,
+        mean=mean, scale=scale, ignore_difficult=ignore_difficult,
+        num_workers=args.num_workers, cache_dir=args.cache_dir)
+
+    model_fn = partial(model.model_fn, tta=tta, data_format=args.data_format,
+                       precision=args.precision, **model_params)
+
+    # Load training and eval data
+    if args.feature_layer is not None:
+        # frozen backbone: extract its features once, train the head only
+        backbone = [h for h in hooks if isinstance(h, model.LoadHook)]
+        hooks = [h for h in hooks if not isinstance(h, model.LoadHook)]
+        net_params = model_params.get('net_params') or {}
+        head_model_params = model_params
+        checkpoint, var_map = None, None
+        if backbone:
+            checkpoint = backbone[0].checkpoint_path
+            var_map = backbone[0].var_map
+            if args.feature_layer == 'pool5':
+                # the hook also initialized fc6/fc7, which are head layers
+                # now; head_net reads them from a vgg_16 checkpoint
+                if var_map != model.vgg16_var_map():
+                    raise ValueError(
+                        '--feature_layer pool5 can only initialize the head '
+                        'from a vgg_16 checkpoint; use --feature_layer fc7')
+                head_model_params = dict(model_params, net_params=dict(
+                    net_params, pretrained=checkpoint))
+        elif not net_params.get('pretrained'):
+            checkpoint = tf.train.latest_checkpoint(model_dir)
+            if checkpoint is None:
+                raise ValueError(
+                    '--feature_layer needs a trained backbone, but there is '
+                    'no LoadHook, no net_params "pretrained" and no '
+                    'checkpoint in {}'.format(model_dir))
+        load_features = partial(
+            feature_cache.open_features, args.data_dir, args.cache_dir,
+            model_params=model_params, layer=args.feature_layer,
+            checkpoint=checkpoint, var_map=var_map,
+            ignore_difficult=ignore_difficult, num_workers=args.num_workers)
+        train_data, train_labels, train_weights = load_features('trainval')
+        eval_data, eval_labels, eval_weights = load_features(eval_split)
+        model_fn = partial(feature_cache.head_model_fn,
+                           layer=args.feature_layer,
+                           **feature_cache.head_params(head_model_params))
+        model_dir = '{}_{}_head'.format(model_dir, args.feature_layer)
+    elif args.stream:
+        train_labels, train_weights = pascal_data.load_labels(
+            args.data_dir, 'trainval', ignore_difficult=ignore_difficult)
+        eval_labels, eval_weights = pascal_data.load_labels(
+            args.data_dir, eval_split, ignore_difficult=ignore_difficult)
+        if args.eval_every:
+            eval_data, _, _ = load(
+                split=eval_split, crop_size=crop_size, uint8=True)
+    else:
+        train_data, train_labels, train_weights = load(
+            split='trainval', crop_size=crop_size, uint8=args.uint8)
+        eval_data, eval_labels, eval_weights = load(
+            split=eval_split, crop_size=eval_crop_size, uint8=args.uint8)
+
+    if args.summary_every is not None:
+        summary_every = args.summary_every
+    if summary_every is not None:
+        # SummaryPolicy replaces the Estimator's own summary saver
+        config = (config or tf.estimator.RunConfig()).replace(
+            save_summary_steps=0)
+
+    pascal_classifier = tf.estimator.Estimator(
+        model_fn=partial(model_fn, num_classes=train_labels.shape[1]),
+        model_dir=model_dir,
+        config=config)
+    logging_hook = tf.train.LoggingTensorHook(
+        tensors={"loss": "loss"}, every_n_iter=log_every)
+    hooks = [logging_hook] + list(hooks)
+    summary_policy = None
+    if summary_every is not None:
+        summary_policy = train_hooks.SummaryPolicy(
+            pascal_classifier.model_dir, expensive_every=summary_every)
+        hooks.append(summary_policy)
+    profiler = None
+    if args.profile_dir is not None:
+        # first, so the other hooks (and MAPEvalHook) count as hook time
+        profiler = train_hooks.Profiler(
+            trace_every=args.trace_every, summary_policy=summary_policy)
+        hooks.insert(0, profiler)
+
+    eval_batch_size = batch_size if tta else 128
+    if args.stream:
+        train_input_fn = pascal_input.stream_input_fn(
+            args.data_dir, 'trainval', image_size=image_size,
+            crop_size=crop_size, batch_size=batch_size,
+            shuffle=True, num_epochs=None, cache_dir=args.cache_dir,
+            ignore_difficult=ignore_difficult,
+            num_parallel_calls=args.num_workers)
+        eval_input_fn = pascal_input.stream_input_fn(
+            args.data_dir, eval_split, image_size=image_size,
+            crop_size=eval_crop_size, batch_size=eval_batch_size,
+            cache_dir=args.cache_dir, ignore_difficult=ignore_difficult,
+            num_parallel_calls=args.num_workers)
+    else:
+        train_input_fn = tf.estimator.inputs.numpy_input_fn(
+            x={"x": train_data, "w": train_weights},
+            y=train_labels,
+            batch_size=batch_size,
+            num_epochs=None,
+            shuffle=True)
+        eval_input_fn = tf.estimator.inputs.numpy_input_fn(
+            x={"x": eval_data, "w": eval_weights},
+            y=eval_labels,
+            batch_size=eval_batch_size,
+            num_epochs=1,
+            shuffle=False)
+
+    if args.eval_every:
+        # one training session; the hook evaluates without restarting it
+        eval_hook = MAPEvalHook(
+            eval_data, eval_labels, eval_weights, args.eval_every,
+            mean=mean, scale=scale, num_bins=args.map_bins,
+            output_dir=pascal_classifier.model_dir)
+        pascal_classifier.train(
+            input_fn=train_input_fn,
+            max_steps=max_step,
+            hooks=hooks + [eval_hook])
+        step_list, map_list = eval_hook.steps, eval_hook.maps
+    else:
+        step_list, map_list = [], []
+        for step in range(first_step, max_step, stride):
+            pascal_classifier.train(
+                input_fn=train_input_fn,
+                steps=stride,
+                hooks=hooks)
+            print("evaluate")
+            start = time.time()
+            AP, num_eval = streaming_map(
+                pascal_classifier.predict(input_fn=eval_input_fn),
+                eval_labels, eval_weights, num_bins=args.map_bins)
+            print('eval throughput: {:.1f} images/sec'.format(
+                num_eval / (time.time() - start)))
+            print_map(AP, eval_labels, eval_weights)
+
+            map_list.append(np.mean(AP))
+            step_list.append(step)
+            if plot_every is not None and step % plot_every == 0:
+                plot_map(step_list, map_list, plot_path)
+
+    plot_map(step_list, map_list, plot_path)
+    if profiler is not None:
+        if not os.path.isdir(args.profile_dir):
+            os.makedirs(args.profile_dir)
+        profiler.write(os.path.join(args.profile_dir, 'step_profile.json'),
+                       os.path.join(args.profile_dir, 'step_trace.json'))
+    return step_list, map_list
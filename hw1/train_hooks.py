@@ -0,0 +1,376 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import json
+import threading
+import time
+
+try:
+    import queue
+except ImportError:  # python 2
+    import Queue as queue
+
+import numpy as np
+import tensorflow as tf
+from tensorflow.python.client import timeline
+
+import model
+
+SCALARS = 'scalars'
+EXPENSIVE = 'expensive'
+
+
+class SummaryPolicy(tf.train.SessionRunHook):
+    """
+    Throttled summary writing for Estimator training.
+    Replaces the Estimator's SummarySaverHook (run it with
+    RunConfig(save_summary_steps=0)). Summaries registered under
+    model.EXPENSIVE_SUMMARIES (input images, gradient histograms) are only
+    fetched every `expensive_every` steps; every other summary (loss,
+    learning rate, ...) is a cheap scalar fetched every `scalar_every` steps.
+    Fetched summaries go through a queue to a background thread that hands
+    them to the FileWriter, so protobuf parsing and event writing stay off
+    the training loop.
+    The hook times every step by the kinds of summaries it fetched, and the
+    writer thread times every write, so report() gives the measured cost of
+    each kind.
+    Args:
+        output_dir (str): Directory of the event files (the model_dir).
+        expensive_every (int): Steps between expensive summary fetches.
+        scalar_every (int): Steps between scalar summary fetches.
+        max_queue (int): Summaries waiting to be written before the training
+            loop blocks.
+    """
+
+    def __init__(self, output_dir, expensive_every=500, scalar_every=1,
+                 max_queue=100):
+        self._output_dir = output_dir
+        self._every = {SCALARS: scalar_every, EXPENSIVE: expensive_every}
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._step_times = {}
+        self._write_times = {SCALARS: [], EXPENSIVE: []}
+
+    def begin(self):
+        expensive = tf.get_collection(model.EXPENSIVE_SUMMARIES)
+        scalars = [s for s in tf.get_collection(tf.GraphKeys.SUMMARIES)
+                   if s not in expensive]
+        self._ops = {}
+        for kind, ops in ((SCALARS, scalars), (EXPENSIVE, expensive)):
+            if ops:
+                self._ops[kind] = tf.summary.merge(ops)
+        self._global_step = tf.train.get_global_step()
+        self._writer = tf.summary.FileWriterCache.get(self._output_dir)
+        self._thread = threading.Thread(target=self._write_loop)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def after_create_session(self, session, coord):
+        self._next_step = session.run(self._global_step) + 1
+
+    def before_run(self, run_context):
+        self._kinds = tuple(
+            kind for kind in sorted(self._ops)
+            if self._next_step % self._every[kind] == 0)
+        self._start = time.time()
+        fetches = dict((kind, self._ops[kind]) for kind in self._kinds)
+        fetches['step'] = self._global_step
+        return tf.train.SessionRunArgs(fetches)
+
+    def after_run(self, run_context, run_values):
+        elapsed = time.time() - self._start
+        self._step_times.setdefault(self._kinds, []).append(elapsed)
+        results = run_values.results
+        step = results['step'] + 1
+        for kind in self._kinds:
+            self._queue.put((kind, results[kind], step))
+        self._next_step = step + 1
+
+    def end(self, session):
+        self._queue.put(None)
+        self._thread.join()
+        self._writer.flush()
+        for kind, stats in sorted(self.report().items()):
+            tf.logging.info(
+                'summaries %s: %d steps, %s ms/step to fetch, '
+                '%.2f ms/summary to write', kind, stats['steps'],
+                'n/a' if stats['fetch_ms'] is None
+                else '%.2f' % stats['fetch_ms'], stats['write_ms'])
+
+    def _write_loop(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            kind, summary, step = item
+            start = time.time()
+            self._writer.add_summary(summary, step)
+            self._write_times[kind].append(time.time() - start)
+
+    def _mean_step(self, kinds):
+        times = self._step_times.get(tuple(sorted(kinds)))
+        return np.mean(times) if times else None
+
+    def report(self):
+        """
+        Measured cost of every summary kind.
+        The fetch cost of scalars is the mean step time with scalars minus
+        that of steps without summaries (None if every step has scalars);
+        the fetch cost of expensive summaries is compared against steps
+        that fetched the same scalars but no expensive summaries.
+        Returns:
+            report (dict): Per kind, "steps" (steps it was fetched on),
+                "fetch_ms" (extra step time) and "write_ms" (background write
+                time per summary).
+        """
+        bare = self._mean_step(())
+        with_scalars = self._mean_step((SCALARS,))
+        both = self._mean_step((SCALARS, EXPENSIVE))
+        only_expensive = self._mean_step((EXPENSIVE,))
+
+        def _diff(a, b):
+            return None if a is None or b is None else (a - b) * 1e3
+
+        fetch = {
+            SCALARS: _diff(with_scalars, bare),
+            EXPENSIVE: (_diff(both, with_scalars) if both is not None
+                        else _diff(only_expensive, bare)),
+        }
+        report = {}
+        for kind in self._ops:
+            steps = sum(len(t) for k, t in self._step_times.items()
+                        if kind in k)
+            writes = self._write_times[kind]
+            report[kind] = {
+                'steps': steps,
+                'fetch_ms': fetch[kind],
+                'write_ms': np.mean(writes) * 1e3 if writes else 0.0,
+            }
+        return report
+
+
+# op types of the input pipeline (tf.data and the numpy_input_fn queues) and
+# of summary ops, as seen in RunMetadata step stats
+INPUT_OPS = frozenset([
+    'IteratorGetNext', 'QueueDequeue', 'QueueDequeueV2', 'QueueDequeueMany',
+    'QueueDequeueManyV2', 'QueueDequeueUpTo', 'QueueDequeueUpToV2'])
+SUMMARY_OPS = frozenset([
+    'ScalarSummary', 'HistogramSummary', 'ImageSummary', 'MergeSummary'])
+# Chrome trace process of the host side step events
+HOST_PID = 1000
+
+
+def _union_micros(intervals):
+    """Total length of a list of (start, end) intervals, overlaps once."""
+    total, last_end = 0, None
+    for start, end in sorted(intervals):
+        if last_end is None or start > last_end:
+            total += end - start
+            last_end = end
+        elif end > last_end:
+            total += end - last_end
+            last_end = end
+    return total
+
+
+class Profiler(tf.train.SessionRunHook):
+    """
+    Per-step latency breakdown of Estimator training.
+    Every step records its run time, from this hook's before_run to its
+    after_run, and its hook time, from that after_run to the next
+    before_run. The hook time holds the after_run of the hooks listed after
+    this one (MAPEvalHook evaluations, logging, summary hand-off) and python
+    overhead, so put the profiler first in the hook list; it is reported on
+    its own instead of as compute. Summary costs come from the run's
+    SummaryPolicy: its measured fetch cost per summary kind and the write
+    times of its writer thread. Every `trace_every` steps a FULL_TRACE
+    RunMetadata is captured as well, which splits the session run into
+    input wait (dequeue ops), summary ops and compute. Steps without a
+    trace count their input wait as compute; the report extrapolates the
+    traced input fraction to them.
+    The hook keeps its records across train() calls; call write() once at
+    the end.
+    Args:
+        trace_every (int): Steps between RunMetadata captures, None for none.
+        max_trace_steps (int): Steps kept as host events in the Chrome trace.
+        summary_policy (SummaryPolicy): Summary hook of the run, or None;
+            then the summary cost is the traced summary op fraction,
+            extrapolated like the input wait.
+    """
+
+    def __init__(self, trace_every=None, max_trace_steps=1000,
+                 summary_policy=None):
+        self._trace_every = trace_every
+        self._max_trace_steps = max_trace_steps
+        self._summary_policy = summary_policy
+        self.steps = []
+        self._run_metadata = None
+
+    def begin(self):
+        self._global_step = tf.train.get_global_step()
+        self._op_types = dict(
+            (op.name, op.type) for op in tf.get_default_graph().get_operations())
+
+    def after_create_session(self, session, coord):
+        self._next_step = session.run(self._global_step) + 1
+        self._last_end = None
+
+    def _close_step(self, now):
+        """Charge the time since the last after_run to the last step."""
+        if self._last_end is not None:
+            self.steps[-1]['hooks_ms'] = (now - self._last_end) * 1e3
+
+    def before_run(self, run_context):
+        self._run_start = time.time()
+        self._close_step(self._run_start)
+        options = None
+        self._traced = (self._trace_every is not None and
+                        self._next_step % self._trace_every == 0)
+        if self._traced:
+            options = tf.RunOptions(trace_level=tf.RunOptions.FULL_TRACE)
+        return tf.train.SessionRunArgs(self._global_step, options=options)
+
+    def after_run(self, run_context, run_values):
+        now = time.time()
+        step = run_values.results + 1
+        record = {
+            'step': int(step),
+            'start': self._run_start,
+            'run_ms': (now - self._run_start) * 1e3,
+            'hooks_ms': 0.0,
+        }
+        if self._traced:
+            stats = run_values.run_metadata.step_stats
+            record.update(self._split_trace(stats))
+            self._run_metadata = stats
+        self.steps.append(record)
+        self._last_end = now
+        self._next_step = step + 1
+
+    def end(self, session):
+        self._close_step(time.time())
+        self._last_end = None
+
+    def _split_trace(self, step_stats):
+        """
+        Input wait, summary op and total op milliseconds of a traced run.
+        The total is the union of the op intervals on all devices, not the
+        wall time of the run; it is kept apart from run_ms as
+        traced_run_ms.
+        """
+        intervals = {'input': [], 'summary': [], 'all': []}
+        for dev_stats in step_stats.dev_stats:
+            for node in dev_stats.node_stats:
+                start = node.all_start_micros
+                interval = (start, start + node.all_end_rel_micros)
+                op_type = self._op_types.get(node.node_name.split(':')[0])
+                intervals['all'].append(interval)
+                if op_type in INPUT_OPS:
+                    intervals['input'].append(interval)
+                elif op_type in SUMMARY_OPS:
+                    intervals['summary'].append(interval)
+        input_ms = _union_micros(intervals['input']) / 1e3
+        summary_op_ms = _union_micros(intervals['summary']) / 1e3
+        traced_run_ms = _union_micros(intervals['all']) / 1e3
+        return {'input_ms': input_ms, 'summary_op_ms': summary_op_ms,
+                'traced_run_ms': traced_run_ms}
+
+    def _summary_ms(self, summaries):
+        """Mean summary fetch time per step from a SummaryPolicy report."""
+        total = sum((stats['fetch_ms'] or 0.0) * stats['steps']
+                    for stats in summaries.values())
+        return total / len(self.steps)
+
+    def report(self):
+        """
+        Compact summary of the recorded steps.
+        Returns:
+            report (dict): Mean step, run, input, summary, compute and hook
+                milliseconds per step ("step" is run plus hooks, "compute"
+                is what is left of the run), run and hook time percentiles,
+                the number of traced steps and, with a SummaryPolicy, its
+                report under "summaries".
+        """
+        if not self.steps:
+            return {'steps': 0}
+        run = np.array([s['run_ms'] for s in self.steps])
+        hooks = np.array([s['hooks_ms'] for s in self.steps])
+        traced = [s for s in self.steps if 'input_ms' in s]
+        input_fraction = summary_fraction = 0.0
+        if traced:
+            traced_run = max(sum(s['traced_run_ms'] for s in traced), 1e-9)
+            input_fraction = sum(s['input_ms'] for s in traced) / traced_run
+            summary_fraction = (sum(s['summary_op_ms'] for s in traced) /
+                                traced_run)
+        input_ms = input_fraction * run.mean()
+        summaries = None
+        if self._summary_policy is not None:
+            summaries = self._summary_policy.report()
+            summary_ms = self._summary_ms(summaries)
+        else:
+            summary_ms = summary_fraction * run.mean()
+        report = {
+            'steps': len(self.steps),
+            'traced_steps': len(traced),
+            'mean_ms': {
+                'step': run.mean() + hooks.mean(),
+                'run': run.mean(),
+                'input': input_ms,
+                'summary': summary_ms,
+                'compute': run.mean() - input_ms - summary_ms,
+                'hooks': hooks.mean(),
+            },
+            'run_ms_percentiles': dict(
+                ('p%d' % q, np.percentile(run, q)) for q in (50, 90, 99)),
+            'hooks_ms_percentiles': dict(
+                ('p%d' % q, np.percentile(hooks, q)) for q in (50, 90, 99)),
+            'steps_per_sec': 1e3 / (run.mean() + hooks.mean()),
+            'traced_mean_ms': {} if not traced else {
+                'input': np.mean([s['input_ms'] for s in traced]),
+                'summary_ops': np.mean([s['summary_op_ms'] for s in traced]),
+                'run': np.mean([s['traced_run_ms'] for s in traced]),
+            },
+        }
+        if summaries is not None:
+            report['summaries'] = summaries
+        return report
+
+    def chrome_trace(self):
+        """
+        Chrome trace (chrome://tracing) of the last max_trace_steps steps as
+        host events, merged with the op timeline of the last traced step.
+        Returns:
+            trace (dict): Trace in the Chrome "traceEvents" JSON format.
+        """
+        events = [{'name': 'process_name', 'ph': 'M', 'pid': HOST_PID,
+                   'args': {'name': 'training loop'}}]
+        for s in self.steps[-self._max_trace_steps:]:
+            start = s['start'] * 1e6
+            events.append({
+                'name': 'step %d' % s['step'], 'ph': 'X', 'pid': HOST_PID,
+                'tid': 0, 'ts': start, 'dur': s['run_ms'] * 1e3,
+                'args': dict((k, v) for k, v in s.items() if k != 'start')})
+            if s['hooks_ms']:
+                events.append({
+                    'name': 'hooks', 'ph': 'X', 'pid': HOST_PID, 'tid': 1,
+                    'ts': start + s['run_ms'] * 1e3,
+                    'dur': s['hooks_ms'] * 1e3})
+        if self._run_metadata is not None:
+            ops = json.loads(timeline.Timeline(
+                self._run_metadata).generate_chrome_trace_format())
+            events.extend(ops['traceEvents'])
+        return {'traceEvents': events}
+
+    def write(self, report_path, trace_path=None):
+        """
+        Log the report and save it as JSON, plus the Chrome trace if
+        trace_path is given.
+        """
+        report = self.report()
+        tf.logging.info('step profile: %s', json.dumps(report['mean_ms'])
+                        if 'mean_ms' in report else 'no steps')
+        with open(report_path, 'w') as f:
+            json.dump(report, f, indent=1, sort_keys=True, default=float)
+        if trace_path is not None:
+            with open(trace_path, 'w') as f:
+                json.dump(self.chrome_trace(), f, default=float)
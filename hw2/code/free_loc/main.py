@@ -7,8 +7,6 @@ import sys
 import scipy.misc as sci
 # sys.path.insert(0,'/home/spurushw/reps/hw-wsddn-sol/faster_rcnn')
 sys.path.insert(0, '../faster_rcnn')
-import sklearn
-import sklearn.metrics
 
 import torch
 import torch.nn as nn
@@ -481,20 +479,12 @@ def adjust_learning_rate(optimizer, epoch):
 
 def metric1(output, target):
     # TODO: Ignore for now - proceed till instructed
-    bs, num_cls = target.shape
-    ap_all = []
-    num = num_cls
-    for i in range(num_cls):
-        tar_cls = target[:, i]
-        out_cls = output[:, i]
-        out_cls -= 1e-5 * tar_cls
-        ap = sklearn.metrics.average_precision_score(tar_cls, out_cls, average=None)
-        if math.isnan(ap):
-            ap = 0
-            num -= 1
-        ap_all.append(ap)
-    ap_mean = np.sum(ap_all) / float(num)
-    return ap_mean
+    output = output.cpu().numpy().astype(np.float32)
+    target = target.cpu().numpy()
+    output -= 1e-5 * target
+    # classes without positives in the batch come back as nan; skip them
+    ap_all = average_precision(target, output)
+    return np.nanmean(ap_all)
 
 def metric2(output, target):
     # TODO: Ignore for now - proceed till instructed